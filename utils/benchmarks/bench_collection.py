@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+import urllib.request
+
+from .mock_twitter_api import MockTwitterAPI, MockData
+
+# -----------------------------------------------------------
+# bench_collection.py
+#
+# Runs each data_collection module against the mock API (mock_twitter_api.py),
+# in a scratch data directory, and reports for each:
+#   requests/s         -- calls the mock served, over the module's wall time
+#   records/s          -- rows / users / lists it persisted, over the same
+#   resume             -- how long re-opening the tweets CSV at a checkpoint takes,
+#                         by byte offset vs. the line index vs. replaying lines.
+#
+# The collectors read their endpoints + paths from constants at import time,
+# so TWIT_API_BASE and TWIT_DATA_DIR are set before anything in utils is imported.
+#
+# Usage: python3 -m utils.benchmarks.bench_collection [n_tweets]
+#
+# -----------------------------------------------------------
+
+DEFAULT_TWEETS = 20000
+RESUME_REPEATS = 5
+
+
+class NoInput:
+    """Stands in for stdin, so the collectors' 'any key + enter' interrupt never fires."""
+
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+
+    def fileno(self):
+        return self.read_fd
+
+    def readline(self):
+        return ""
+
+
+def get_stats(server):
+    with urllib.request.urlopen(f"{server.base_url}/_stats") as resp:
+        stats = json.load(resp)
+    return sum(n for by_status in stats.values() for n in by_status.values())
+
+
+def timed(server, fn):
+    """Run fn (quietly); returns (secs, requests served, fn's result)."""
+    reqs_before = get_stats(server)
+    start_time = time.time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = fn()
+    return time.time() - start_time, get_stats(server) - reqs_before, result
+
+
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def write_geo_csv(c):
+    """Stand-in for the sort/unique step between download_tweets and the per-user collectors."""
+    seen = set()
+    with open(c.TWTS_CSV) as tweets, open(c.GEO_TWTS_CSV, 'w') as geo_tweets:
+        for tw_row in tweets:
+            tweet = tw_row.rstrip('\n').split(',', 3)
+            if len(tweet) == 4 and tweet[3] and tweet[1] not in seen:
+                seen.add(tweet[1])
+                geo_tweets.write(tw_row)
+
+
+def bench_resume(c, tw, csv_path):
+    """Secs to get back to the last line of csv_path: (by offset, by line index, by replaying lines)."""
+    n_lines = count_lines(csv_path)
+    offset = os.path.getsize(csv_path)
+    idx_path = tw.line_index_path(csv_path)
+    results = dict()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name in ["offset", "line index", "line replay"]:
+            if name == "line index":
+                tw.build_line_index(csv_path)
+            elif os.path.exists(idx_path):
+                os.remove(idx_path)
+            checkpoint = {c.LAST_OFFSET: offset} if name == "offset" else {c.LAST_LINE: n_lines - 1}
+            start_time = time.time()
+            for _ in range(RESUME_REPEATS):
+                with open(csv_path) as rFile:
+                    tw.advance_to_checkpoint(rFile, checkpoint, c.LAST_OFFSET, c.LAST_LINE)
+            results[name] = (time.time() - start_time) / RESUME_REPEATS
+    return n_lines, results
+
+
+def run(n_tweets=DEFAULT_TWEETS):
+    server = MockTwitterAPI(data=MockData(n_tweets=n_tweets)).start()
+    data_dir = tempfile.mkdtemp(prefix="twit_bench_")
+    os.environ["TWIT_API_BASE"] = server.base_url
+    os.environ["TWIT_DATA_DIR"] = data_dir
+    os.environ.setdefault("TWIT_BEARER_TOKEN", "mock")
+    os.environ["TWIT_TELEMETRY"] = "0"     # (its files would outlive the scratch dir)
+
+    from ..common import constants as c
+    from ..common import twitter_helpers as tw
+    from ..common import activity_store
+    from sqlitedict import SqliteDict
+    from ..data_collection import download_tweets, download_users, download_geos
+    from ..data_collection import download_prior_bool, download_friends, download_activity
+
+    # The mock has no real limits to respect.
+    c.ENDPOINT_MIN_INTERVALS.clear()
+    c.ERR_WAIT_PD = 0
+    os.makedirs(c.TWEET_DIR, exist_ok=True)
+    os.makedirs(c.USER_DIR, exist_ok=True)
+    sys.stdin = NoInput()
+
+    def n_users(attr=None):
+        with SqliteDict(c.USERS_SQL) as users_dict:
+            return sum(
+              1 for u_id, user in users_dict.items()
+              if isinstance(u_id, str) and u_id.isdigit() and (attr is None or attr(user))
+            )
+
+    def n_friends():
+        with SqliteDict(c.FRIENDS_SQL) as friends_dict:
+            return len(friends_dict)
+
+    def n_activity():
+        with activity_store.ActivityStore() as store:
+            return len(store.saved_ids())
+
+    stages = [
+      ("tweets", download_tweets.run, lambda: count_lines(c.TWTS_CSV)),
+      ("users", download_users.run, n_users),
+      ("geos", download_geos.run, lambda: n_users(lambda u: len(u.geos) > 0)),
+      ("prior-adopters", download_prior_bool.run, lambda: n_users(lambda u: hasattr(u, "used_prior"))),
+      ("friends", download_friends.run, n_friends),
+      ("activity", download_activity.run, n_activity),
+    ]
+
+    print(f"Benchmarking against {server.base_url}, data in {data_dir}\n")
+    print(f"{'module':<16}{'secs':>10}{'requests':>10}{'req/s':>10}{'records':>10}{'rec/s':>10}")
+    try:
+        for name, stage_run, n_records in stages:
+            secs, reqs, _ = timed(server, stage_run)
+            records = n_records()
+            print(f"{name:<16}{secs:>10.2f}{reqs:>10}{reqs / secs:>10.1f}{records:>10}{records / secs:>10.1f}")
+            if name == "tweets":
+                write_geo_csv(c)
+
+        n_lines, results = bench_resume(c, tw, c.TWTS_CSV)
+        print(f"\nResume at line {n_lines - 1} of the tweets CSV (avg of {RESUME_REPEATS}):")
+        for name, secs in results.items():
+            print(f"  {name:<14}{secs * 1000:>10.3f} ms")
+    finally:
+        server.shutdown()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TWEETS)
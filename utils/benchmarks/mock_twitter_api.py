@@ -0,0 +1,322 @@
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# -----------------------------------------------------------
+# mock_twitter_api.py
+#
+# A local stand-in for the parts of the Twitter API the collectors use,
+# so they can be tuned and regression-tested without API access:
+#
+#   /2/tweets/search/all    -- paginated w/ next_token; from:/has:geo queries, place expansions
+#   /2/tweets/counts/all    -- hourly counts for `from:` queries
+#   /2/users                -- user lookup by ids
+#   /1.1/friends/ids.json   -- paginated w/ next_cursor_str; some users 401 / 404
+#
+# Responses come from a seeded synthetic dataset, or from a JSONL file of
+# recorded responses ({"path", "params", "status", "body"} per line), checked first.
+# Every response carries x-rate-limit-* headers, and once an endpoint's limit
+# is used up within a window it answers 429 until the window resets.
+#
+# Point the collectors at it with TWIT_API_BASE=http://localhost:<port>
+#
+# -----------------------------------------------------------
+
+SEARCH_PATH = "/2/tweets/search/all"
+COUNTS_PATH = "/2/tweets/counts/all"
+USERS_PATH = "/2/users"
+FRIENDS_PATH = "/1.1/friends/ids.json"
+STATS_PATH = "/_stats"
+
+STUDY_START = datetime(2020, 4, 25, tzinfo=timezone.utc)     # a month before the study, for prior-adopter + activity queries.
+STUDY_END = datetime(2020, 6, 7, tzinfo=timezone.utc)
+FRIENDS_PAGE = 5000
+SEARCH_MAX_RESULTS = 500
+WINDOW_SECS = 900
+
+# Users w/ these IDs (mod 50) get errors from the friends endpoint, like protected / deleted accounts.
+UNAUTH_MOD = 7
+MISSING_MOD = 13
+
+
+def iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def parse_iso(s):
+    return datetime.strptime(s[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+class MockData:
+    """
+    Seeded synthetic users, places, tweets and follow edges.
+    """
+
+    def __init__(self, n_users=2000, n_tweets=20000, n_places=200, geo_ratio=0.1, max_friends=8000, seed=0):
+        rng = random.Random(seed)
+        self.user_ids = [str(10**6 + i) for i in range(n_users)]
+        self.users = {
+          u_id: {
+            "id": u_id,
+            "created_at": iso(STUDY_START - timedelta(days=rng.randint(30, 4000))),
+            "protected": rng.random() < 0.02,
+            "public_metrics": {
+              "followers_count": rng.randint(0, 50000),
+              "following_count": rng.randint(0, 5000),
+              "tweet_count": rng.randint(1, 100000),
+            },
+          }
+          for u_id in self.user_ids
+        }
+
+        self.places = dict()
+        for i in range(n_places):
+            lon, lat = rng.uniform(-124, -70), rng.uniform(26, 48)
+            size = rng.choice([0.0001, 0.05, 0.3, 3])
+            pl_id = f"{i:016x}"
+            self.places[pl_id] = {
+              "id": pl_id,
+              "full_name": f"Place {i}",
+              "country_code": "US" if rng.random() < 0.95 else "CA",
+              "place_type": rng.choice(["city", "city", "city", "poi", "neighborhood", "admin"]),
+              "geo": {"type": "Feature", "bbox": [lon, lat, lon + size, lat + size], "properties": {}},
+            }
+        place_ids = list(self.places)
+
+        span = (STUDY_END - STUDY_START).total_seconds()
+        times = sorted(STUDY_START + timedelta(seconds=rng.uniform(0, span)) for _ in range(n_tweets))
+        self.tweets = []        # oldest first, ids increasing w/ time like real snowflake IDs.
+        for i, created_at in enumerate(times):
+            tweet = {
+              "id": str(10**15 + i * 1000 + rng.randint(0, 999)),
+              "author_id": rng.choice(self.user_ids),
+              "created_at": iso(created_at),
+            }
+            if rng.random() < geo_ratio:
+                tweet["geo"] = {"place_id": rng.choice(place_ids)}
+            self.tweets.append((created_at, tweet))
+
+        self.max_friends = max_friends
+        self.seed = seed
+
+    def friends_of(self, u_id):
+        rng = random.Random(f"{self.seed}-{u_id}")
+        n = int(rng.paretovariate(1.2) * 50) % self.max_friends
+        return [str(10**6 + rng.randint(0, 10 * len(self.user_ids))) for _ in range(n)]
+
+
+class RateLimits:
+    """Per-endpoint request counts over fixed windows, like Twitter's 15-minute ones."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.windows = dict()     # path -> (reset_at, used)
+        self.lock = threading.Lock()
+
+    def take(self, path):
+        """Count a request; returns (allowed, headers)."""
+        limit = self.limits.get(path, 10**9)
+        with self.lock:
+            now = time.time()
+            reset_at, used = self.windows.get(path, (now + WINDOW_SECS, 0))
+            if now >= reset_at:
+                reset_at, used = now + WINDOW_SECS, 0
+            allowed = used < limit
+            if allowed:
+                used += 1
+            self.windows[path] = (reset_at, used)
+        headers = {
+          "x-rate-limit-limit": str(limit),
+          "x-rate-limit-remaining": str(limit - used),
+          "x-rate-limit-reset": str(int(reset_at)),
+        }
+        return allowed, headers
+
+
+class MockTwitterAPI(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, port=0, data=None, fixtures_path=None, limits=None, latency=0.0):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.data = data or MockData()
+        self.rate_limits = RateLimits(limits or dict())
+        self.latency = latency      # secs added to every response, to mimic network round-trips.
+        self.stats = dict()         # path -> status -> count
+        self.stats_lock = threading.Lock()
+        self.fixtures = dict()
+        if fixtures_path:
+            with open(fixtures_path) as f:
+                for line in f:
+                    rec = json.loads(line)
+                    self.fixtures[self.fixture_key(rec["path"], rec.get("params", {}))] = (rec.get("status", 200), rec["body"])
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @staticmethod
+    def fixture_key(path, params):
+        return (path, json.dumps({k: str(v) for k, v in params.items()}, sort_keys=True))
+
+    def count(self, path, status):
+        with self.stats_lock:
+            by_status = self.stats.setdefault(path, dict())
+            by_status[status] = by_status.get(status, 0) + 1
+
+    def start(self):
+        """Serve from a background thread; returns the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, val in (headers or dict()).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == STATS_PATH:
+            with server.stats_lock:
+                return self.send_json(200, server.stats)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        allowed, headers = server.rate_limits.take(url.path)
+        if not allowed:
+            server.count(url.path, 429)
+            return self.send_json(429, {"title": "Too Many Requests", "status": 429}, headers)
+
+        fixture = server.fixtures.get(server.fixture_key(url.path, params))
+        if fixture:
+            status, body = fixture
+        elif url.path == SEARCH_PATH:
+            status, body = search(server.data, params)
+        elif url.path == COUNTS_PATH:
+            status, body = counts(server.data, params)
+        elif url.path == USERS_PATH:
+            status, body = users(server.data, params)
+        elif url.path == FRIENDS_PATH:
+            status, body = friends(server.data, params)
+        else:
+            status, body = 404, {"title": "Not Found", "status": 404}
+
+        server.count(url.path, status)
+        self.send_json(status, body, headers)
+
+
+def query_filter(params):
+    """Turn a search query + time range into a predicate on (created_at, tweet)."""
+    query = params.get("query", "")
+    authors = set(re.findall(r"from:(\d+)", query))
+    geo_only = "has:geo" in query
+    start = parse_iso(params["start_time"]) if "start_time" in params else STUDY_START
+    end = parse_iso(params["end_time"]) if "end_time" in params else STUDY_END
+
+    def keep(created_at, tweet):
+        return (
+          start <= created_at < end
+          and (not authors or tweet["author_id"] in authors)
+          and (not geo_only or "geo" in tweet)
+        )
+    return keep
+
+
+def search(data, params):
+    keep = query_filter(params)
+    matches = [tweet for created_at, tweet in reversed(data.tweets) if keep(created_at, tweet)]    # newest first.
+
+    offset = int(params.get("next_token", "0"), 16)
+    max_results = min(int(params.get("max_results", 10)), SEARCH_MAX_RESULTS)
+    page = matches[offset:offset + max_results]
+
+    meta = {"result_count": len(page)}
+    if not page:
+        return 200, {"meta": meta}
+    meta["newest_id"] = page[0]["id"]
+    meta["oldest_id"] = page[-1]["id"]
+    if offset + max_results < len(matches):
+        meta["next_token"] = f"{offset + max_results:x}"
+
+    body = {"data": page, "meta": meta}
+    if "geo.place_id" in params.get("expansions", ""):
+        place_ids = {tweet["geo"]["place_id"] for tweet in page if "geo" in tweet}
+        if place_ids:
+            body["includes"] = {"places": [data.places[pl_id] for pl_id in place_ids]}
+    return 200, body
+
+
+def counts(data, params):
+    keep = query_filter(dict(params, start_time=params.get("start_time", iso(parse_iso(params["end_time"]) - timedelta(days=30)))))
+    end = parse_iso(params["end_time"])
+    start = end - timedelta(days=30)
+    buckets = [0] * 720
+    for created_at, tweet in data.tweets:
+        if keep(created_at, tweet):
+            buckets[int((created_at - start).total_seconds() // 3600)] += 1
+
+    body = {
+      "data": [
+        {"start": iso(start + timedelta(hours=i)), "end": iso(start + timedelta(hours=i + 1)), "tweet_count": n}
+        for i, n in enumerate(buckets)
+      ],
+      "meta": {"total_tweet_count": sum(buckets)},
+    }
+    return 200, body
+
+
+def users(data, params):
+    ids = params.get("ids", "").split(",")
+    found = [data.users[u_id] for u_id in ids if u_id in data.users]
+    body = {"data": found}
+    missing = [u_id for u_id in ids if u_id not in data.users]
+    if missing:
+        body["errors"] = [{"value": u_id, "detail": f"Could not find user with ids: [{u_id}].", "title": "Not Found Error"} for u_id in missing]
+    return 200, body
+
+
+def friends(data, params):
+    u_id = params.get("user_id", "")
+    if u_id not in data.users:
+        return 404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]}
+    if int(u_id) % 50 == UNAUTH_MOD:
+        return 401, {"request": FRIENDS_PATH, "error": "Not authorized."}
+    if int(u_id) % 50 == MISSING_MOD:
+        return 404, {"errors": [{"code": 34, "message": "Sorry, that page does not exist."}]}
+
+    friend_ids = data.friends_of(u_id)
+    cursor = int(params.get("cursor", "-1"))
+    start = max(cursor, 0)
+    page = friend_ids[start:start + FRIENDS_PAGE]
+    next_cursor = start + FRIENDS_PAGE if start + FRIENDS_PAGE < len(friend_ids) else 0
+    return 200, {
+      "ids": page if params.get("stringify_ids") else [int(fr_id) for fr_id in page],
+      "next_cursor_str": str(next_cursor),
+      "previous_cursor_str": str(cursor),
+    }
+
+
+def run(port=8000, fixtures_path=None):
+    server = MockTwitterAPI(port=port, fixtures_path=fixtures_path)
+    print(f"Mock Twitter API at {server.base_url}  (set TWIT_API_BASE to this)")
+    server.serve_forever()
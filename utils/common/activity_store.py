@@ -0,0 +1,134 @@
+import os
+import sqlite3
+from array import array
+from sqlitedict import decode
+
+from . import constants as c
+
+# -----------------------------------------------------------
+# activity_store.py
+#
+# Compact storage for users' hourly tweet counts (their "activity rate"),
+# kept apart from the pickled User objects so saving one doesn't mean
+# re-writing the whole user, and loading them doesn't mean unpickling everyone.
+#
+# Two append-only files, one row per user, in the same order:
+#   ACTIVITY_RATES -- ACTIVITY_HOURS uint16 counts per user (oldest hour first)
+#   ACTIVITY_IDS   -- the user's ID, as an int64
+# so both can be memory-mapped straight into NumPy (see load_activity.py).
+#
+# -----------------------------------------------------------
+
+ROW_BYTES = c.ACTIVITY_HOURS * 2
+ID_BYTES = 8
+UINT16_MAX = 65535
+
+
+def to_row(activity_rate):
+    """
+    Fit a list of hourly counts into a fixed-width uint16 row: keep the
+    most recent ACTIVITY_HOURS hours, zero-padding at the front if there are fewer.
+    """
+    counts = [min(count, UINT16_MAX) for count in activity_rate[-c.ACTIVITY_HOURS:]]
+    return array('H', [0] * (c.ACTIVITY_HOURS - len(counts)) + counts)
+
+
+class ActivityStore:
+    """
+    Appends activity rows. Not thread-safe -- one writer at a time.
+    """
+
+    def __init__(self, rates_path=c.ACTIVITY_RATES, ids_path=c.ACTIVITY_IDS):
+        self.rates_path = rates_path
+        self.ids_path = ids_path
+        self.repair()
+        self.rates_file = open(rates_path, 'ab')
+        self.ids_file = open(ids_path, 'ab')
+
+    def repair(self):
+        """If a previous run died mid-write, drop the partial row so the two files line up again."""
+        rates_size = os.path.getsize(self.rates_path) if os.path.exists(self.rates_path) else 0
+        ids_size = os.path.getsize(self.ids_path) if os.path.exists(self.ids_path) else 0
+        n_rows = min(rates_size // ROW_BYTES, ids_size // ID_BYTES)
+        if rates_size != n_rows * ROW_BYTES or ids_size != n_rows * ID_BYTES:
+            print(f"Truncating activity store to {n_rows} complete rows.")
+            for path, size in [(self.rates_path, n_rows * ROW_BYTES), (self.ids_path, n_rows * ID_BYTES)]:
+                with open(path, 'ab') as f:
+                    f.truncate(size)
+
+    def saved_ids(self):
+        """IDs (as strings, like the users dict keys) of every user already in the store."""
+        ids = array('q')
+        with open(self.ids_path, 'rb') as f:
+            ids.frombytes(f.read())
+        return {str(u_id) for u_id in ids}
+
+    def append(self, u_id, activity_rate):
+        self.rates_file.write(to_row(activity_rate).tobytes())
+        self.ids_file.write(array('q', [int(u_id)]).tobytes())
+
+    def append_rows(self, u_ids, rows):
+        """Append many users at once, w/ their rows already fit to ACTIVITY_HOURS uint16s (e.g. an (n, ACTIVITY_HOURS) NumPy array)."""
+        self.rates_file.write(rows.tobytes())
+        self.ids_file.write(array('q', [int(u_id) for u_id in u_ids]).tobytes())
+
+    def flush(self):
+        self.rates_file.flush()
+        self.ids_file.flush()
+
+    def close(self):
+        self.rates_file.close()
+        self.ids_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_users(start_rowid=0, chunk_size=1000):
+    """
+    Stream (rowid, user_id, user) out of users.sqlite in rowid order, starting after `start_rowid`,
+    without holding them all in memory. Reads the SqliteDict table directly, read-only,
+    so it can run alongside a collector writing to the same file.
+    """
+    conn = sqlite3.connect(f"file:{c.USERS_SQL}?mode=ro", uri=True)
+    try:
+        rowid = start_rowid
+        while True:
+            rows = conn.execute(
+              f'SELECT rowid, key, value FROM "{c.USERS_TABLE}" WHERE rowid > ? ORDER BY rowid LIMIT ?',
+              (rowid, chunk_size)
+            ).fetchall()
+            if not rows:
+                break
+            for rowid, u_id, value in rows:
+                yield rowid, u_id, decode(value)
+    finally:
+        conn.close()
+
+
+def last_user_rowid():
+    """The last rowid in users.sqlite (0 if it's empty), where iter_users will stop."""
+    conn = sqlite3.connect(f"file:{c.USERS_SQL}?mode=ro", uri=True)
+    try:
+        return conn.execute(f'SELECT MAX(rowid) FROM "{c.USERS_TABLE}"').fetchone()[0] or 0
+    finally:
+        conn.close()
+
+
+def import_from_users():
+    """
+    One-off: copy activity rates saved on User objects (before this store existed)
+    into the store, skipping anyone already in it. (Rebuilding the users feather from
+    users.sqlite does the same as part of its scan; see load_activity.import_scanned_rates.)
+    """
+    imported = 0
+    with ActivityStore() as store:
+        done = store.saved_ids()
+        for _, u_id, user in iter_users():
+            if len(getattr(user, "activity_rate", [])) > 0 and u_id not in done:
+                store.append(u_id, user.activity_rate)
+                imported += 1
+    print(f"Imported {imported} users' activity rates.")
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Get file path
@@ -7,18 +8,57 @@ ENV_PATH = f"{root_path}/common/.env"
 
 ######################
 
-DATA_COLLECTION = f"{root_path}/data_collection"
+# Set TWIT_DATA_DIR to keep downloaded data somewhere else (e.g. a scratch dir for benchmarks).
+DATA_COLLECTION = os.environ.get("TWIT_DATA_DIR", f"{root_path}/data_collection")
 
 TWEET_DIR = f"{DATA_COLLECTION}/tweet_data"
 TWTS_CSV = f"{TWEET_DIR}/sorted_tweets_thru02.csv"
 META_TWTS_CSV = f"{TWEET_DIR}/download_tweet_meta.csv"
 GEO_TWTS_CSV = f"{TWEET_DIR}/unique_geos_thru02.csv"
 SAVED_NXT_TOKEN_TWTS_FILE = f"{TWEET_DIR}/saved_next_token.txt" # used to track how far along in saving process.
+TWTS_PARQUET_DIR = f"{TWEET_DIR}/tweets_parquet"   # hour-partitioned alternative to TWTS_CSV (see download_tweets.OUTPUT_FORMAT)
+
+CSV_FMT = "csv"
+PARQUET_FMT = "parquet"
+# Set TWIT_TWEETS_FMT=parquet to have download_tweets write TWTS_PARQUET_DIR instead of TWTS_CSV, and load_tweets read it.
+# (download_users / collect_all read authors out of TWTS_CSV line by line, so they refuse to run on Parquet.)
+TWTS_FMT = os.environ.get("TWIT_TWEETS_FMT", CSV_FMT)
 
 USER_DIR = f"{DATA_COLLECTION}/user_data"
 USERS_SQL = f"{USER_DIR}/users.sqlite"
 USERS_EXTRA_SQL = f"{USER_DIR}/users_extra.sqlite"
 FRIENDS_SQL = f"{USER_DIR}/friends.sqlite"
+PLACES_SQL = f"{USER_DIR}/places.sqlite"    # place catalog: place_id -> Place, shared by all users.
+
+# Friends lists, packed as delta + varint encoded int64s (see common/friends_store.py), instead of pickled lists of strings.
+# Set TWIT_FRIENDS_FMT=packed (after running friends_store.import_from_friends_dict()) to have download_friends + load_edges use it.
+FRIENDS_PICKLED = "pickled"
+FRIENDS_PACKED = "packed"
+FRIENDS_FMT = os.environ.get("TWIT_FRIENDS_FMT", FRIENDS_PICKLED)
+FRIENDS_PACKED_SQL = f"{USER_DIR}/friends_packed.sqlite"
+USERS_TABLE = "unnamed"                     # SqliteDict's default table name, for reading users.sqlite directly.
+
+# Parallel scans of users.sqlite (see common/user_scan.py), for rebuilding the analysis feathers.
+SCAN_WORKERS = int(os.environ.get("TWIT_SCAN_WORKERS", os.cpu_count() or 1))
+SCAN_RANGES_PER_WORKER = 4      # more, smaller rowid ranges than workers, so no one worker is left w/ the slow end.
+SCAN_BATCH_ROWS = 50000         # rows per Arrow record batch.
+
+# Activity rates (hourly tweet counts), stored apart from the User objects -- see common/activity_store.py
+ACTIVITY_RATES = f"{USER_DIR}/activity_rates.u16"
+ACTIVITY_IDS = f"{USER_DIR}/activity_ids.i64"
+ACTIVITY_SCAN_ROWID = f"{USER_DIR}/activity_scan_rowid.txt"    # how far through users.sqlite download_activity got.
+ACTIVITY_HOURS = 720        # 30 days at 1 hr granularity.
+
+# Typed SQLite tables (see common/storage.py), as an alternative to the pickled SqliteDicts above.
+# Set TWIT_STORAGE=tables (after running storage.migrate_from_sqlitedict()) to have the collectors + loaders use them.
+SQLITEDICT_BACKEND = "sqlitedict"
+TABLES_BACKEND = "tables"
+STORAGE_BACKEND = os.environ.get("TWIT_STORAGE", SQLITEDICT_BACKEND)
+STORAGE_SQL = f"{USER_DIR}/twitter.sqlite"
+FRIENDS_OK = 0
+FRIENDS_UNAUTH = -1         # friends "lists" saved for users we couldn't download (as in friends.sqlite).
+FRIENDS_404 = -2
+ACTIVITY_SCAN_KEY = "activity_scan_user_id"    # (tables) how far through the users table download_activity got.
 
 #####################
 
@@ -32,11 +72,54 @@ USERS_FTR = f"{DATA_ANALYSIS}/feathers/users_df.ftr"
 GEO_USERS_FTR = f"{DATA_ANALYSIS}/feathers/geo_users_df.ftr"
 PLACES_FTR = f"{DATA_ANALYSIS}/feathers/places_df.ftr"
 LOCS_FTR = f"{DATA_ANALYSIS}/feathers/locs.ftr"
+ACTIVITY_FTR = f"{DATA_ANALYSIS}/feathers/activity_df.ftr"
+# Each feather's manifest (see data_analysis/artifacts.py) -- what it was built from, and by which version of the code.
+# Bump an artifact's version when the code that builds it changes its output, so old copies get rebuilt.
+MANIFEST_EXT = ".meta.json"
+HASH_CHUNK_BYTES = 16 << 20
+ARTIFACT_VERSIONS = {
+  "users": 2,
+  "places": 1,
+  "activity": 2,
+  "locations": 4,
+  "edges": 1,
+  "geo_edges": 1,
+  "graph": 1,
+  "geo_graph": 1,
+  "tweets": 1,
+  "geo_tweets": 1,
+  "subdivs": 2,
+  "nation": 1,
+  "salients": 1,
+}
+USER_INDEX_NPY = f"{DATA_ANALYSIS}/feathers/user_ids.npy"     # Twitter ID -> dense int32 index (see user_index.py)
+GRAPH_DIR = f"{DATA_ANALYSIS}/feathers/follower_graph"          # CSR/CSC .npy files (see follower_graph.py)
+GEO_GRAPH_DIR = f"{DATA_ANALYSIS}/feathers/geo_follower_graph"
+
+# External datasets (see load_datasets.py), ingested once into GeoParquet (projected to epsg:2163) / Feather.
+DATASETS = f"{DATA_ANALYSIS}/datasets"
+COUSUB_DIR = f"{DATASETS}/county_subdivs"
+COUSUB_SHP = f"{COUSUB_DIR}/COUSUB_2019_US_SL060_Coast_Clipped.shp"
+COUSUB_DBF = f"{COUSUB_DIR}/COUSUB_2019_US_SL060_Coast_Clipped.dbf"
+NATION_SHP = f"{DATASETS}/cb_2018_us_nation_5m/cb_2018_us_nation_5m.shp"
+ACS_CSV = f"{DATASETS}/ACS_data.csv"
+MPV_CSV = f"{DATASETS}/MPV_data.csv"
+SUBDIVS_PARQUET = f"{DATA_ANALYSIS}/feathers/subdivs.parquet"
+NATION_PARQUET = f"{DATA_ANALYSIS}/feathers/nation.parquet"
+SALIENTS_FTR = f"{DATA_ANALYSIS}/feathers/salients_df.ftr"     # ACS + MPV columns per subdivision
+GEOPARQUET_ROW_GROUP_ROWS = 2048    # (rows are in Hilbert order, so a bbox filter only reads the row groups it overlaps)
+
+# Each place's assigned county subdivision (see subdiv_index.py), kept so new users' places are just lookups.
+PLACE_FIPS_FTR = f"{DATA_ANALYSIS}/feathers/place_fips.ftr"
+SUBDIV_MAX_DIST = 800       # meters -- points further than this from every subdivision aren't assigned one.
 
 #####################
 
 # Pandas Column Names
 U_ID = "U_ID"
+U_IDX = "U_Idx"             # dense int32 user index
+SOURCE_IDX = "Source_Idx"
+TARGET_IDX = "Target_Idx"
 FLWNG = "Following"
 FLWRS = "Followers"
 TW_COUNT = "Tweets"
@@ -46,18 +129,24 @@ BORN = "Born"
 HAS_TAG = "Has Geotags"
 NUM_LOCS = "Num of Unique Locs"
 PERCENT = "Ratio Geotagged"
+ACTIVITY_RATE = "Activity Rate"
 
 TW_ID = "Tw_ID"
 CREATED_AT = "Timestamp" # 2  # 2=ISO8601 date
 GEOS = "Geos"
+CSV_BLOCK_BYTES = 64 << 20     # bytes of the tweets CSV parsed per Arrow record batch (see load_tweets.read_tweets_csv)
+GEO_LON = "Lon"     # point coordinates, for the (few) tweets tagged w/ an exact location.
+GEO_LAT = "Lat"
 
 #####################
 
 # Twitter Endpoints:
-USERS_ENDPOINT = "https://api.twitter.com/2/users"  
-COUNT_ENDPOINT = "https://api.twitter.com/2/tweets/counts/all"
-TWTS_ENDPOINT = "https://api.twitter.com/2/tweets/search/all"
-FRIENDS_ENDPOINT = "https://api.twitter.com/1.1/friends/ids.json"   # using v1.1 since it has a higher limit for IDs per call.
+# Set TWIT_API_BASE to point the collectors at another server, e.g. the mock API in utils/benchmarks.
+API_BASE = os.environ.get("TWIT_API_BASE", "https://api.twitter.com")
+USERS_ENDPOINT = f"{API_BASE}/2/users"  
+COUNT_ENDPOINT = f"{API_BASE}/2/tweets/counts/all"
+TWTS_ENDPOINT = f"{API_BASE}/2/tweets/search/all"
+FRIENDS_ENDPOINT = f"{API_BASE}/1.1/friends/ids.json"   # using v1.1 since it has a higher limit for IDs per call.
 
 # Twitter API Rules:
 # *---------------*
@@ -70,13 +159,57 @@ ERR_WAIT_PD = 60
 USERS_WAIT_PD = 3
 COUNT_WAIT_PD = 3
 
+# The wait periods above are only a fallback now -- connect_to_endpoint paces each endpoint
+# from the x-rate-limit-* headers Twitter sends back (see twitter_helpers.TokenBucket),
+# and only uses these until the first response from that endpoint comes in.
+ENDPOINT_WAIT_PDS = {
+  TWTS_ENDPOINT: TWTS_WAIT_PD,
+  FRIENDS_ENDPOINT: FRIENDS_WAIT_PD,
+  USERS_ENDPOINT: USERS_WAIT_PD,
+  COUNT_ENDPOINT: COUNT_WAIT_PD,
+}
+# Full-archive search + counts have a hard 1 request / sec limit on top of the 15-min window.
+ENDPOINT_MIN_INTERVALS = {
+  TWTS_ENDPOINT: 1,
+  COUNT_ENDPOINT: 1,
+}
+RATE_LIMIT_HDR = "x-rate-limit-limit"
+RATE_REMAINING_HDR = "x-rate-limit-remaining"
+RATE_RESET_HDR = "x-rate-limit-reset"     # epoch seconds at which the window resets.
+RATE_RESET_PAD = 1                        # extra secs to wait past a reset, for clock drift.
+HTTP_POOL_SIZE = 10                       # kept-alive connections per host in the shared session.
+
+# Response Cache (see common/response_cache.py):
+# Set TWIT_CACHE_MODE to re-run collectors from responses already on disk instead of re-spending quota.
+CACHE_OFF = "off"                       # always hit the API, save nothing.
+CACHE_REPLAY = "replay"                 # only serve from disk; a miss is an error, nothing goes to the API.
+CACHE_READ_THROUGH = "read-through"     # serve from disk if there, else hit the API and save the response.
+CACHE_WRITE_THROUGH = "write-through"   # always hit the API, and save (or refresh) every response.
+RESPONSE_CACHE_MODE = os.environ.get("TWIT_CACHE_MODE", CACHE_OFF)
+RESPONSE_CACHE_DIR = f"{DATA_COLLECTION}/response_cache"
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("TWIT_CACHE_MAX_BYTES", 10 * 1024**3))  # least-recently-used responses are evicted past this.
+
+# Telemetry (see common/telemetry.py):
+# Per-endpoint request stats + per-collector progress, written every TELEMETRY_FLUSH_PD secs while collecting.
+TELEMETRY_ON = os.environ.get("TWIT_TELEMETRY", "1") != "0"
+TELEMETRY_DIR = f"{DATA_COLLECTION}/telemetry"
+TELEMETRY_JSONL = f"{TELEMETRY_DIR}/metrics.jsonl"    # one snapshot per line, rotated at TELEMETRY_MAX_BYTES.
+TELEMETRY_PROM = f"{TELEMETRY_DIR}/metrics.prom"      # latest snapshot, Prometheus text format (e.g. for node_exporter's textfile collector).
+TELEMETRY_FLUSH_PD = 60
+TELEMETRY_MAX_BYTES = 50 * 1024**2
+TELEMETRY_BACKUPS = 5
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]   # secs, upper bounds of the request latency histogram.
+
 TWTS_MAX_RESULTS = 100      # Number of tweets per Tweets search call.
 
 LAST_LINE = "last_line"     # For logging in SQLiteDict how far we got.
+LAST_OFFSET = "last_offset" # ...and the byte offset of that line in the CSV, so we can seek() back to it.
+LINE_INDEX_EXT = ".lidx"    # Sidecar file w/ the byte offset of every line in a CSV (see twitter_helpers.build_line_index).
 MISSED_USERS_TWTS_CSV = "missed_users.csv"
 MISSED_USERS_LAST_LINE = "MISSED_USERS_LINES_READ"
 
 DWNLD_GEOS_LINES = "download_geos_lines_processed"
+DWNLD_GEOS_OFFSET = "download_geos_offset"
 
 GEOS_MAX_USERS_PER_QUERY = 29
 GEOS_QUERY = "has:geo -is:nullcast"
@@ -113,8 +246,16 @@ US_CC = 'US'
 # Filtering Information
 GEO_DEV = 'mean-mode dev.'
 CENTROID = 'centroid'
+MODE_PL_ID = 'Mode_PL_ID'   # the place a user's location (CENTROID) is taken from.
 FOREIGN = 'foreign'
 IN_US = 'In_US'
 
+# County Subdivision Column Names
+GEO_FIPS = 'Geo_FIPS'
+GEO_QNAME = 'Geo_QNAME'
+TOTAL_POP = 'Total_Pop'
+LAND_AREA = 'Land_Area'
+POLICE_KILLINGS = 'PoliceKillings'
+
 # 
 DIST_THRESHOLD = 30000 # Threshold beyond which, we decide we cannot pinpoint a user to single zipcode.
\ No newline at end of file
@@ -0,0 +1,162 @@
+import sqlite3
+import datetime
+import numpy as np
+from sqlitedict import SqliteDict
+
+from . import constants as c
+
+# -----------------------------------------------------------
+# friends_store.py
+#
+# Compact storage for users' friends lists (FRIENDS_PACKED_SQL), in place of
+# friends.sqlite's pickled lists of decimal strings:
+#
+#   friends  user_id -> status, n_friends, data
+#
+# where `data` is the user's friend IDs, sorted, as int64 deltas (the first one
+# absolute), each varint-encoded (7 bits per byte, high bit set on all but the last byte).
+# Friends' IDs are dense enough that most deltas fit in 4-5 bytes instead of ~20 for
+# a pickled string. `status` is FRIENDS_OK, FRIENDS_UNAUTH or FRIENDS_404, so the
+# old [-1] / [-2] sentinels never end up mixed into the data.
+#
+# Encoding + decoding are vectorized in NumPy; iter_batches() decodes many users'
+# lists in one go, and yields plain int64 arrays.
+#
+# -----------------------------------------------------------
+
+VARINT_MAX_BYTES = 10       # 64 bits / 7 bits per byte.
+IMPORT_BATCH = 10000        # users per commit when importing friends.sqlite.
+
+
+def uses_packed():
+    return c.FRIENDS_FMT == c.FRIENDS_PACKED
+
+
+def encode(friend_ids):
+    """Sorted, de-duplicated friend IDs -> delta + varint bytes. Returns (n_friends, bytes)."""
+    ids = np.unique(np.asarray(friend_ids, dtype=np.int64)).astype(np.uint64)
+    if len(ids) == 0:
+        return 0, b""
+    deltas = np.diff(ids, prepend=np.uint64(0))
+
+    shifts = np.arange(VARINT_MAX_BYTES, dtype=np.uint64) * np.uint64(7)
+    groups = (deltas[:, None] >> shifts) & np.uint64(0x7f)               # (n, 10) 7-bit groups, low first.
+    n_bytes = np.maximum(1, VARINT_MAX_BYTES - np.argmax(groups[:, ::-1] != 0, axis=1))
+    n_bytes[(groups == 0).all(axis=1)] = 1
+    cols = np.arange(VARINT_MAX_BYTES)
+    groups[cols < (n_bytes[:, None] - 1)] |= np.uint64(0x80)              # continuation bits.
+    return len(ids), groups[cols < n_bytes[:, None]].astype(np.uint8).tobytes()
+
+
+def decode_many(data, counts):
+    """
+    Decode several users' varint data (concatenated) at once.
+    `counts` is how many IDs each user has; returns all their IDs, in order, as one int64 array.
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if len(raw) == 0:
+        return np.empty(0, dtype=np.int64)
+    is_last = (raw & 0x80) == 0
+    starts = np.concatenate([[0], np.flatnonzero(is_last)[:-1] + 1])
+    byte_pos = np.arange(len(raw)) - np.repeat(starts, np.diff(np.append(starts, len(raw))))
+    parts = (raw & 0x7f).astype(np.uint64) << (byte_pos.astype(np.uint64) * np.uint64(7))
+    deltas = np.add.reduceat(parts, starts)
+
+    # Running sum within each user: one cumsum over everything, minus the total before each user starts.
+    # (uint64 arithmetic wraps, so this is exact even once the overall sum overflows.)
+    totals = np.cumsum(deltas, dtype=np.uint64)
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    before = np.concatenate([[np.uint64(0)], totals[ends[:-1] - 1]]).astype(np.uint64) if len(counts) else totals[:0]
+    return (totals - np.repeat(before, counts)).view(np.int64)
+
+
+def decode(data, n_friends):
+    return decode_many(data, [n_friends])
+
+
+class FriendsStore:
+    """
+    Same interface for saving as storage.Storage (save_friends, friends_done, commit),
+    so download_friends can write to either.
+    """
+
+    def __init__(self, path=c.FRIENDS_PACKED_SQL, readonly=False):
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+              "CREATE TABLE IF NOT EXISTS friends (user_id INTEGER PRIMARY KEY, status INTEGER, n_friends INTEGER, data BLOB)"
+            )
+        self.conn.execute(c.SET_PRAGMA_MMAP_LIMIT)
+
+    def save_friends(self, u_id, friends):
+        """Save a user's friends (a list of IDs), or [FRIENDS_UNAUTH] / [FRIENDS_404]."""
+        if friends in [[c.FRIENDS_UNAUTH], [c.FRIENDS_404]]:
+            row = (int(u_id), friends[0], 0, b"")
+        else:
+            n_friends, data = encode(friends)
+            row = (int(u_id), c.FRIENDS_OK, n_friends, data)
+        self.conn.execute("INSERT OR REPLACE INTO friends VALUES (?, ?, ?, ?)", row)
+
+    def friends_done(self):
+        """IDs (as strings, like the friends dict keys) of every user already saved, whatever their status."""
+        return {str(u_id) for (u_id,) in self.conn.execute("SELECT user_id FROM friends")}
+
+    def get(self, u_id):
+        """A user's friends as an int64 array, or None if they aren't saved (or couldn't be downloaded)."""
+        row = self.conn.execute(
+          "SELECT n_friends, data FROM friends WHERE user_id = ? AND status = ?", (int(u_id), c.FRIENDS_OK)
+        ).fetchone()
+        return None if row is None else decode(row[1], row[0])
+
+    def statuses(self):
+        """user_id -> status, for every saved user."""
+        return dict(self.conn.execute("SELECT user_id, status FROM friends"))
+
+    def iter_batches(self, batch_users=10000):
+        """
+        Stream every edge, `batch_users` users at a time, as (user_ids, friend_ids) int64 arrays
+        -- user_ids[i] follows friend_ids[i]. No per-edge Python objects are made.
+        """
+        cursor = self.conn.execute(
+          "SELECT user_id, n_friends, data FROM friends WHERE status = ? AND n_friends > 0", (c.FRIENDS_OK,)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_users)
+            if not rows:
+                break
+            u_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            counts = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+            friend_ids = decode_many(b"".join(row[2] for row in rows), counts)
+            yield np.repeat(u_ids, counts), friend_ids
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def import_from_friends_dict():
+    """One-off: pack every friends list in friends.sqlite into the store, skipping anyone already in it."""
+    imported = 0
+    with FriendsStore() as store, SqliteDict(c.FRIENDS_SQL) as friends_dict:
+        done = store.friends_done()
+        for u_id, friends in friends_dict.items():
+            if isinstance(friends, list) and u_id not in done:
+                store.save_friends(u_id, friends)
+                imported += 1
+                if imported % IMPORT_BATCH == 0:
+                    store.commit()
+                    print(f"Imported {imported} users' friends, {datetime.datetime.now()}")
+        store.commit()
+    print(f"Imported {imported} users' friends.")
@@ -1,8 +1,7 @@
-from shapely.geometry import Polygon, Point
+from shapely.geometry import Polygon
+from pyproj import Transformer
 from . import constants as c
-from statistics import mean
 import numpy as np
-from scipy import stats
 
 def convert_to_gjson_proper(geo):
     '''
@@ -41,10 +40,34 @@ def polygon_from_bbox(geo):
 
 
 def geo_center_of(geo):
-    if "geometry" not in geo:
-        geo = convert_to_gjson_proper(geo)
-    poly = Polygon(geo["geometry"]["coordinates"][0])
-    return [poly.centroid.x, poly.centroid.y]
+    '''Center of the geo's bounding box (an axis-aligned box's centroid is just its midpoint).'''
+    b = geo["bbox"]
+    return [(b[0] + b[2]) / 2, (b[1] + b[3]) / 2]
+
+
+# --- Vectorized versions, over (n, 4) arrays of bounding boxes: west(long), south(lat), east(long), north(lat) ---
+
+def bbox_array(geos):
+    '''Twitter geo-objects -> (n, 4) float array of their bboxes (NaN for any w/o one).'''
+    nan_box = [np.nan] * 4
+    return np.array([geo["bbox"] if isinstance(geo, dict) and "bbox" in geo else nan_box for geo in geos], dtype=np.float64).reshape(-1, 4)
+
+
+def bbox_centroids(bboxes):
+    '''(n, 4) bboxes -> (xs, ys) of their centers, w/o building any geometry.'''
+    return (bboxes[:, 0] + bboxes[:, 2]) / 2, (bboxes[:, 1] + bboxes[:, 3]) / 2
+
+
+def reproject(xs, ys, from_crs="epsg:4326", to_crs="epsg:2163"):
+    '''Reproject coordinate arrays in one call (by default, lat/lng -> flat USA coords).'''
+    transformer = Transformer.from_crs(from_crs, to_crs, always_xy=True)
+    return transformer.transform(xs, ys)
+
+
+def reproject_bounds(bounds, from_crs="epsg:4326", to_crs="epsg:2163"):
+    '''(minx, miny, maxx, maxy) -> the bounds, in to_crs, of that whole box (not just its corners).'''
+    transformer = Transformer.from_crs(from_crs, to_crs, always_xy=True)
+    return transformer.transform_bounds(*bounds)
 
 
 def geo_contains_geo(geoA, geoB):
@@ -65,40 +88,57 @@ def geo_contains_geo(geoA, geoB):
       return "C"
 
 
-def calc_point(user_obj):
+def calc_point(user_obj, catalog=None):
+    '''
+    `catalog` is the place catalog (see load_places.load_place_catalog),
+    needed for users whose geos are PlaceRefs.
+    '''
 
     points = []
 
-    for _, pl in user_obj.geos.items():
+    for _, ref in user_obj.geos.items():
+        pl = ref.resolve(catalog)
         if not pl.country_code == c.US_CC:
             print(f"{pl.country_code} not in USA!")
             return None
 
         if pl.place_type not in [c.PL_ADMIN, c.PL_COUNTRY]:
-            point = geo_center_of(pl.geo)
-            for _ in pl.tweets:
-                points.append(point)
+            points.append((geo_center_of(pl.geo), len(ref.tweets)))
 
-    if len(points) == 0:
+    n_tweets = sum(n for _, n in points)
+    if n_tweets == 0:
         print(user_obj)
         return None
     else:
-        # latitude/longitude pairs
-        return (mean([pt[1] for pt in points]), mean([pt[0] for pt in points]))
-
-
-def mean_gdf_centroid(user_centroids):
+        # latitude/longitude pairs, weighted by tweets
+        return (
+          sum(pt[1] * n for pt, n in points) / n_tweets,
+          sum(pt[0] * n for pt, n in points) / n_tweets,
+        )
 
-    return Point(np.mean([pt.x for pt in user_centroids]), np.mean([pt.y for pt in user_centroids]))
 
-def mode_gdf_centroid(user_centroids):
+def mean_centroids(user_codes, xs, ys, weights):
+    '''
+    Each user's weighted mean point. `user_codes` are 0..n_users-1 (as from pd.factorize),
+    one per row of xs / ys / weights. Returns (mean_xs, mean_ys), indexed by user code.
+    '''
+    total = np.bincount(user_codes, weights=weights)
+    return np.bincount(user_codes, weights=weights * xs) / total, np.bincount(user_codes, weights=weights * ys) / total
 
-  pt_strs = []
-  for pt in user_centroids:
-    pt_strs.append(f"{pt.x},{pt.y}")
-  
-  mode_pt = stats.mode(pt_strs).mode[0]
-  mode_pt_list = mode_pt.split(",")
 
-  point = (float(mode_pt_list[0]), float(mode_pt_list[1]))
-  return Point(point)
+def mode_rows(user_codes, place_codes, weights):
+    '''
+    Each user's most-tagged place: sum weights per (user, place) pair, then sort pairs by
+    user, then weight (descending), and take each user's first. Ties go to the lowest place code.
+    Returns, indexed by user code, a row index (into the inputs) for that place.
+    '''
+    n_places = place_codes.max() + 1 if len(place_codes) else 1
+    pairs, first_row, pair_of_row = np.unique(
+      user_codes.astype(np.int64) * n_places + place_codes, return_index=True, return_inverse=True
+    )
+    pair_weights = np.bincount(pair_of_row.ravel(), weights=weights)
+    pair_users = pairs // n_places
+    order = np.lexsort((pairs % n_places, -pair_weights, pair_users))
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = pair_users[order][1:] != pair_users[order][:-1]
+    return first_row[order[is_first]]
@@ -0,0 +1,138 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+import time
+
+from . import constants as c
+
+# -----------------------------------------------------------
+# response_cache.py
+#
+# On-disk cache of API responses, under twitter_helpers.connect_to_endpoint,
+# so a collector can be re-run (after a parsing bug, a schema change...)
+# without spending quota on responses we already have.
+#
+# Each response is stored gzipped, at a path named for the sha256 of its
+# (URL, params) -- params are sorted and stringified first, so the same query
+# always lands on the same file however the dict was built:
+#   RESPONSE_CACHE_DIR/ab/abcdef....json.gz
+#
+# A file's mtime doubles as its last-used time (hits touch it), and once the
+# cache grows past its byte budget the least-recently-used files are deleted.
+# Successful (200) responses are cached, and so are 401s + 404s (as {STATUS_KEY: status}),
+# so a replay raises the same exception the live run did, instead of a cache miss.
+#
+# -----------------------------------------------------------
+
+EVICT_TO = 0.9      # on eviction, shrink to this fraction of the budget, so we don't evict on every write.
+CACHED_STATUSES = [401, 404]        # errors that are a property of the user asked about, so worth caching.
+STATUS_KEY = "_cached_status"
+
+
+class CacheMissException(Exception):
+    """Raised in replay mode for a request that isn't in the cache."""
+    pass
+
+
+def cached_status(json_resp):
+    """The error status saved in place of a response (see put_status), or None for a real response."""
+    return json_resp.get(STATUS_KEY) if isinstance(json_resp, dict) else None
+
+
+def cache_key(url, params):
+    normalized = sorted((str(k), str(v)) for k, v in (params or dict()).items())
+    return hashlib.sha256(json.dumps([url, normalized]).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Thread-safe; collectors running side by side (collect_all) can share one.
+    """
+
+    def __init__(self, cache_dir=c.RESPONSE_CACHE_DIR, mode=c.RESPONSE_CACHE_MODE, max_bytes=c.RESPONSE_CACHE_MAX_BYTES):
+        modes = [c.CACHE_OFF, c.CACHE_REPLAY, c.CACHE_READ_THROUGH, c.CACHE_WRITE_THROUGH]
+        if mode not in modes:
+            raise ValueError(f"Unknown cache mode '{mode}', expected one of {modes}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.total_bytes = None     # summed lazily, on the first write.
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return f"{self.cache_dir}/{key[:2]}/{key}.json.gz"
+
+    def get(self, url, params):
+        """
+        The cached response for this request, or None if the API should be called instead.
+        In replay mode a miss raises CacheMissException.
+        """
+        if self.mode in [c.CACHE_OFF, c.CACHE_WRITE_THROUGH]:
+            return None
+        path = self.path(cache_key(url, params))
+        try:
+            with gzip.open(path, 'rt') as f:
+                json_resp = json.load(f)
+            os.utime(path)      # mark as recently used.
+            return json_resp
+        except FileNotFoundError:
+            if self.mode == c.CACHE_REPLAY:
+                raise CacheMissException(f"No cached response for {url} {params}")
+            return None
+
+    def put_status(self, url, params, status_code):
+        """Cache an error response (one of CACHED_STATUSES) by its status alone."""
+        if status_code in CACHED_STATUSES:
+            self.put(url, params, {STATUS_KEY: status_code})
+
+    def put(self, url, params, json_resp):
+        if self.mode in [c.CACHE_OFF, c.CACHE_REPLAY]:
+            return
+        path = self.path(cache_key(url, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(json_resp, f)
+        size = os.path.getsize(tmp_path)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)      # readers never see a half-written file.
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, size, _ in self.entries())
+            else:
+                self.total_bytes += size - old_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        """(mtime, size, path) of every cached response."""
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".json.gz"):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def evict(self):
+        """Delete least-recently-used responses until we're under EVICT_TO of the budget. Call w/ lock held."""
+        start_time = time.time()
+        target = self.max_bytes * EVICT_TO
+        entries = sorted(self.entries())
+        self.total_bytes = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            evicted += 1
+        print(f"Evicted {evicted} cached responses in {time.time()-start_time} seconds")
@@ -0,0 +1,304 @@
+import json
+import sqlite3
+import datetime
+from sqlitedict import SqliteDict
+
+from . import constants as c
+from .user import User, PlaceRef
+
+# -----------------------------------------------------------
+# storage.py
+#
+# Typed SQLite tables for everything the collectors save, in one file (STORAGE_SQL):
+#
+#   users              user_id -> following, followers, tweet_count, private, created_at, used_prior
+#   places             place_id -> full_name, country_code, place_type, geo (JSON)
+#   user_place_tweets  (user_id, place_id, tweet_id) -- one row per geotagged tweet
+#   friends            (user_id, friend_id) -- one row per follow edge
+#   friends_status     user_id -> 0, or FRIENDS_UNAUTH / FRIENDS_404 if we couldn't download them
+#   checkpoints        name -> value (LAST_LINE, LAST_OFFSET, ...)
+#
+# Unlike users.sqlite, nothing is pickled, and bookkeeping keys live in their own
+# table, so loaders can just SELECT the columns they need.
+#
+# The collectors and loaders use these tables when STORAGE_BACKEND is TABLES_BACKEND;
+# migrate_from_sqlitedict() copies over everything saved in the SqliteDicts so far.
+#
+# -----------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+  user_id INTEGER PRIMARY KEY,
+  following INTEGER,
+  followers INTEGER,
+  tweet_count INTEGER,
+  private INTEGER,
+  created_at TEXT,
+  used_prior INTEGER
+);
+CREATE TABLE IF NOT EXISTS places (
+  place_id TEXT PRIMARY KEY,
+  full_name TEXT,
+  country_code TEXT,
+  place_type TEXT,
+  geo TEXT
+);
+CREATE TABLE IF NOT EXISTS user_place_tweets (
+  user_id INTEGER,
+  place_id TEXT,
+  tweet_id INTEGER,
+  PRIMARY KEY (user_id, place_id, tweet_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS friends (
+  user_id INTEGER,
+  friend_id INTEGER,
+  PRIMARY KEY (user_id, friend_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS friends_status (
+  user_id INTEGER PRIMARY KEY,
+  status INTEGER
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+  name TEXT PRIMARY KEY,
+  value
+);
+"""
+
+BUSY_TIMEOUT = 60       # secs to wait on another connection's write lock (e.g. collect_all's stages).
+MIGRATE_BATCH = 10000   # rows per executemany during migration.
+
+
+def uses_tables():
+    return c.STORAGE_BACKEND == c.TABLES_BACKEND
+
+
+class Checkpoints:
+    """
+    The checkpoints table, used like the SqliteDict the collectors used to keep
+    their line counts / offsets in (so twitter_helpers.advance_to_checkpoint works on either).
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        self.store.conn.execute(
+          "INSERT INTO checkpoints (name, value) VALUES (?, ?) "
+          "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+          (name, value)
+        )
+
+    def get(self, name, default=None):
+        row = self.store.conn.execute("SELECT value FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def commit(self):
+        self.store.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.store.close()
+
+
+class Storage:
+    """
+    One connection to STORAGE_SQL. Like a SqliteDict, nothing is saved until commit(),
+    and a connection should only be used from the thread that opened it.
+    """
+
+    def __init__(self, path=c.STORAGE_SQL, readonly=False):
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT)
+        else:
+            self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+            self.conn.execute("PRAGMA journal_mode=WAL")       # readers (loaders) don't block the collectors.
+            self.conn.execute("PRAGMA synchronous=NORMAL")     # WAL is still crash-safe w/ this.
+            self.conn.executescript(SCHEMA)
+        self.conn.execute(c.SET_PRAGMA_MMAP_LIMIT)
+        self.checkpoints = Checkpoints(self)
+
+    # --- Writes ---
+
+    def save_users(self, user_objs):
+        """Insert or update users' profile data (leaving used_prior alone, as it's filled in later)."""
+        self.conn.executemany(
+          "INSERT INTO users (user_id, following, followers, tweet_count, private, created_at) "
+          "VALUES (?, ?, ?, ?, ?, ?) "
+          "ON CONFLICT(user_id) DO UPDATE SET following = excluded.following, followers = excluded.followers, "
+          "tweet_count = excluded.tweet_count, private = excluded.private, created_at = excluded.created_at",
+          [
+            (int(u.user_id), u.following, u.followers, u.tweet_count, int(u.private), u.created_at)
+            for u in user_objs
+          ]
+        )
+
+    def save_places(self, places):
+        """Add Places (or raw place JSON from the API, which has the same fields) not already saved."""
+        rows = []
+        for pl in places:
+            if isinstance(pl, dict):
+                rows.append((pl["id"], pl["full_name"], pl["country_code"], pl["place_type"], json.dumps(pl["geo"])))
+            else:
+                rows.append((pl.place_id, pl.full_name, pl.country_code, pl.place_type, json.dumps(pl.geo)))
+        self.conn.executemany("INSERT OR IGNORE INTO places VALUES (?, ?, ?, ?, ?)", rows)
+
+    def save_user_place_tweets(self, rows):
+        """rows: (user_id, place_id, tweet_id)."""
+        self.conn.executemany(
+          "INSERT OR IGNORE INTO user_place_tweets VALUES (?, ?, ?)",
+          [(int(u_id), pl_id, int(tw_id)) for u_id, pl_id, tw_id in rows]
+        )
+
+    def save_friends(self, u_id, friends):
+        """Save a user's friends, or just their status if friends is [FRIENDS_UNAUTH] / [FRIENDS_404]."""
+        if friends in [[c.FRIENDS_UNAUTH], [c.FRIENDS_404]]:
+            status = friends[0]
+        else:
+            status = c.FRIENDS_OK
+            self.conn.executemany(
+              "INSERT OR IGNORE INTO friends VALUES (?, ?)",
+              [(int(u_id), int(fr_id)) for fr_id in friends]
+            )
+        self.conn.execute("INSERT OR REPLACE INTO friends_status VALUES (?, ?)", (int(u_id), status))
+
+    def save_prior(self, u_ids, found):
+        """Mark whether each of u_ids had tweeted the hashtag before the study period (i.e. is in `found`)."""
+        self.conn.executemany(
+          "UPDATE users SET used_prior = ? WHERE user_id = ?",
+          [(int(u_id in found), int(u_id)) for u_id in u_ids]
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Reads (IDs come back as strings, like the SqliteDict keys) ---
+
+    def has_user(self, u_id):
+        return self.conn.execute("SELECT 1 FROM users WHERE user_id = ?", (int(u_id),)).fetchone() is not None
+
+    def has_places(self, u_id):
+        return self.conn.execute("SELECT 1 FROM user_place_tweets WHERE user_id = ? LIMIT 1", (int(u_id),)).fetchone() is not None
+
+    def place_ids(self):
+        return {pl_id for (pl_id,) in self.conn.execute("SELECT place_id FROM places")}
+
+    def user_ids(self, geotagged=False):
+        query = "SELECT user_id FROM users"
+        if geotagged:
+            query += " WHERE user_id IN (SELECT user_id FROM user_place_tweets)"
+        return {str(u_id) for (u_id,) in self.conn.execute(query)}
+
+    def unchecked_prior_ids(self):
+        """Geotagged users not yet checked for prior use of the hashtag."""
+        return [
+          str(u_id) for (u_id,) in self.conn.execute(
+            "SELECT user_id FROM users WHERE used_prior IS NULL "
+            "AND user_id IN (SELECT user_id FROM user_place_tweets) ORDER BY user_id"
+          )
+        ]
+
+    def geo_user_ids_after(self, u_id):
+        """Stream geotagged users' IDs in order, starting after `u_id`."""
+        for (next_id,) in self.conn.execute(
+          "SELECT user_id FROM users WHERE user_id > ? "
+          "AND user_id IN (SELECT user_id FROM user_place_tweets) ORDER BY user_id",
+          (int(u_id),)
+        ):
+            yield next_id
+
+    def last_user_id(self):
+        """The largest user ID (0 if there are no users), where geo_user_ids_after will stop."""
+        return self.conn.execute("SELECT MAX(user_id) FROM users").fetchone()[0] or 0
+
+    def friends_done(self):
+        return {str(u_id) for (u_id,) in self.conn.execute("SELECT user_id FROM friends_status")}
+
+
+def checkpoints_for(sqlitedict_path):
+    """
+    Where a collector keeps its checkpoints: the SqliteDict at `sqlitedict_path`
+    (as before), or the checkpoints table. Either way, use it like a dict, then commit().
+    """
+    if uses_tables():
+        return Storage().checkpoints
+    return SqliteDict(sqlitedict_path)
+
+
+def migrate_from_sqlitedict():
+    """
+    One-off: copy users.sqlite, places.sqlite and friends.sqlite into STORAGE_SQL.
+    Safe to re-run -- rows already there are left alone (users are updated).
+    Activity rates still saved on Users (from before the activity store) go into the activity store,
+    as activity_store.import_from_users would -- the typed tables don't keep them.
+    """
+    from .activity_store import iter_users, ActivityStore      # (avoids a circular import)
+
+    with Storage() as store, ActivityStore() as activity:
+        activity_done = activity.saved_ids()
+        with SqliteDict(c.PLACES_SQL) as places_dict:
+            catalog = dict(places_dict.items())
+        store.save_places(catalog.values())
+        print(f"Migrated {len(catalog)} places, {datetime.datetime.now()}")
+
+        users, prior, place_tweets = [], [], []
+        n_users = 0
+        for _, key, value in iter_users():
+            if not isinstance(value, User):
+                store.checkpoints[key] = value      # LAST_LINE, LAST_OFFSET, ...
+                continue
+            users.append(value)
+            if len(getattr(value, "activity_rate", [])) > 0 and key not in activity_done:
+                activity.append(key, value.activity_rate)
+            if hasattr(value, "used_prior"):
+                prior.append((int(value.used_prior), int(key)))
+            for pl_id, ref in value.geos.items():
+                if not isinstance(ref, PlaceRef):
+                    store.save_places([ref])        # saved before the place catalog existed.
+                place_tweets.extend((key, pl_id, tw_id) for tw_id in ref.tweets)
+
+            if len(users) >= MIGRATE_BATCH:
+                n_users += len(users)
+                store.save_users(users)
+                store.conn.executemany("UPDATE users SET used_prior = ? WHERE user_id = ?", prior)
+                store.save_user_place_tweets(place_tweets)
+                store.commit()
+                users, prior, place_tweets = [], [], []
+                print(f"Migrated {n_users} users, {datetime.datetime.now()}")
+        n_users += len(users)
+        store.save_users(users)
+        store.conn.executemany("UPDATE users SET used_prior = ? WHERE user_id = ?", prior)
+        store.save_user_place_tweets(place_tweets)
+        store.commit()
+        print(f"Migrated {n_users} users, {datetime.datetime.now()}")
+
+        n_friends = 0
+        with SqliteDict(c.FRIENDS_SQL) as friends_dict:
+            for u_id, friends in friends_dict.items():
+                if isinstance(friends, list):
+                    store.save_friends(u_id, friends)
+                    n_friends += 1
+                    if n_friends % MIGRATE_BATCH == 0:
+                        store.commit()
+                        print(f"Migrated {n_friends} users' friends, {datetime.datetime.now()}")
+        store.commit()
+        print(f"Migrated {n_friends} users' friends.")
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import datetime
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+from . import constants as c
+
+# -----------------------------------------------------------
+# telemetry.py
+#
+# Counters for long collection runs, to see where throughput goes.
+#
+# Per endpoint (filled in by twitter_helpers.connect_to_endpoint):
+#   requests by status, latency histogram, requests in the last minute,
+#   secs spent sleeping for the rate limit vs. waiting on requests,
+#   rate-limit headroom (x-rate-limit-remaining / -limit), cache hits
+# Per collector (filled in by the data_collection scripts):
+#   records persisted, retries, progress through the input CSV (or a known number of items) + ETA
+#
+# Every TELEMETRY_FLUSH_PD secs (and at exit) a snapshot is appended to TELEMETRY_JSONL
+# (rotated like a log file), and TELEMETRY_PROM is re-written in Prometheus text format.
+# Turn off w/ TWIT_TELEMETRY=0.
+#
+# -----------------------------------------------------------
+
+RATE_WINDOW = 60    # secs, for requests/min.
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.statuses = dict()          # status code -> count
+        self.latency_buckets = [0] * (len(c.LATENCY_BUCKETS) + 1)   # last bucket is +Inf.
+        self.latency_sum = 0.0
+        self.sleep_secs = 0.0
+        self.recent = deque()           # request times within the last RATE_WINDOW.
+        self.rate_remaining = None
+        self.rate_limit = None
+        self.cache_hits = 0
+
+    def per_min(self, now):
+        while self.recent and self.recent[0] < now - RATE_WINDOW:
+            self.recent.popleft()
+        return len(self.recent) * 60 / RATE_WINDOW
+
+    def snapshot(self, now):
+        return {
+          "requests": dict(self.statuses),
+          "latency_buckets": dict(zip([str(le) for le in c.LATENCY_BUCKETS] + ["+Inf"], self.latency_buckets)),
+          "latency_secs": self.latency_sum,
+          "sleep_secs": self.sleep_secs,
+          "requests_per_min": self.per_min(now),
+          "rate_remaining": self.rate_remaining,
+          "rate_limit": self.rate_limit,
+          "cache_hits": self.cache_hits,
+        }
+
+
+class CollectorStats:
+
+    def __init__(self):
+        self.records = 0
+        self.retries = 0
+        self.input_path = None
+        self.input_bytes = 0
+        self.total_lines = None         # from the input's line index, if it has one.
+        self.start_time = None
+        self.start_lines = 0
+        self.start_offset = 0
+        self.lines = 0
+        self.offset = 0
+
+    def eta_secs(self, now):
+        """Secs until the input is done, at this run's rate so far. None until there's a rate to go on."""
+        lines_done = self.lines - self.start_lines
+        if self.start_time is None or lines_done <= 0 or now <= self.start_time:
+            return None
+        if self.total_lines is not None:
+            remaining = self.total_lines - self.lines
+        else:
+            # No line index -- estimate the lines left from the bytes left, at this run's bytes per line.
+            bytes_per_line = (self.offset - self.start_offset) / lines_done
+            remaining = (self.input_bytes - self.offset) / bytes_per_line if bytes_per_line > 0 else 0
+        return max(0, remaining) * (now - self.start_time) / lines_done
+
+    def snapshot(self, now):
+        return {
+          "records": self.records,
+          "retries": self.retries,
+          "lines": self.lines,
+          "total_lines": self.total_lines,
+          "eta_secs": self.eta_secs(now) if self.input_path or self.total_lines is not None else None,
+        }
+
+
+class Telemetry:
+    """Thread-safe; one shared instance (TELEMETRY) for the whole process."""
+
+    def __init__(self, on=c.TELEMETRY_ON):
+        self.on = on
+        self.endpoints = dict()     # endpoint path -> EndpointStats
+        self.collectors = dict()    # collector name -> CollectorStats
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+        if on:
+            atexit.register(self.flush)
+
+    def endpoint(self, url):
+        path = urlparse(url).path
+        if path not in self.endpoints:
+            self.endpoints[path] = EndpointStats()
+        return self.endpoints[path]
+
+    def collector(self, name):
+        if name not in self.collectors:
+            self.collectors[name] = CollectorStats()
+        return self.collectors[name]
+
+    # --- Called by connect_to_endpoint ---
+
+    def observe_request(self, url, status, latency, slept, headers):
+        if not self.on:
+            return
+        with self.lock:
+            stats = self.endpoint(url)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.latency_buckets[bisect.bisect_left(c.LATENCY_BUCKETS, latency)] += 1
+            stats.latency_sum += latency
+            stats.sleep_secs += slept
+            stats.recent.append(time.time())
+            try:
+                stats.rate_remaining = int(headers[c.RATE_REMAINING_HDR])
+                stats.rate_limit = int(headers[c.RATE_LIMIT_HDR])
+            except (KeyError, ValueError):
+                pass
+        self.maybe_flush()
+
+    def observe_cache_hit(self, url):
+        if not self.on:
+            return
+        with self.lock:
+            self.endpoint(url).cache_hits += 1
+
+    # --- Called by collectors ---
+
+    def record(self, collector, n=1):
+        """`n` more records (tweets, users, friends lists...) saved by `collector`."""
+        if not self.on:
+            return
+        with self.lock:
+            self.collector(collector).records += n
+        self.maybe_flush()
+
+    def retry(self, collector):
+        if not self.on:
+            return
+        with self.lock:
+            self.collector(collector).retries += 1
+
+    def track_input(self, collector, csv_path, lines, offset):
+        """Start timing `collector`'s progress through `csv_path`, from a resumed (line, byte offset)."""
+        if not self.on:
+            return
+        idx_path = f"{csv_path}{c.LINE_INDEX_EXT}"
+        with self.lock:
+            stats = self.collector(collector)
+            stats.input_path = csv_path
+            stats.input_bytes = os.path.getsize(csv_path)
+            stats.total_lines = os.path.getsize(idx_path) // 8 if os.path.exists(idx_path) else None
+            stats.start_time = time.time()
+            stats.start_lines = stats.lines = lines
+            stats.start_offset = stats.offset = offset
+
+    def track_total(self, collector, total, done=0):
+        """
+        Start timing `collector`'s progress through `total` items (users, rowids...), for collectors
+        w/o an input CSV to track. Report progress w/ progress(collector, items_done).
+        """
+        if not self.on:
+            return
+        with self.lock:
+            stats = self.collector(collector)
+            stats.input_path = None
+            stats.input_bytes = 0
+            stats.total_lines = total
+            stats.start_time = time.time()
+            stats.start_lines = stats.lines = done
+            stats.start_offset = stats.offset = 0
+
+    def progress(self, collector, lines, offset=0):
+        if not self.on:
+            return
+        with self.lock:
+            stats = self.collector(collector)
+            stats.lines = lines
+            stats.offset = offset
+
+    # --- Output ---
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            return {
+              "time": datetime.datetime.now().isoformat(),
+              "endpoints": {path: stats.snapshot(now) for path, stats in self.endpoints.items()},
+              "collectors": {name: stats.snapshot(now) for name, stats in self.collectors.items()},
+            }
+
+    def maybe_flush(self):
+        if time.time() - self.last_flush >= c.TELEMETRY_FLUSH_PD:
+            self.flush()
+
+    def flush(self):
+        if not self.on or not (self.endpoints or self.collectors):
+            return
+        self.last_flush = time.time()
+        snap = self.snapshot()
+        os.makedirs(c.TELEMETRY_DIR, exist_ok=True)
+        with self.lock:     # (so two threads don't rotate at once)
+            rotate(c.TELEMETRY_JSONL)
+            with open(c.TELEMETRY_JSONL, "a") as f:
+                f.write(json.dumps(snap) + "\n")
+            tmp_path = f"{c.TELEMETRY_PROM}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(to_prometheus(snap))
+            os.replace(tmp_path, c.TELEMETRY_PROM)
+
+
+def rotate(path):
+    """Once `path` passes TELEMETRY_MAX_BYTES, shift it to path.1 (path.1 to path.2, ...), dropping the oldest."""
+    if not os.path.exists(path) or os.path.getsize(path) < c.TELEMETRY_MAX_BYTES:
+        return
+    for i in range(c.TELEMETRY_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def to_prometheus(snap):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP twit_{name} {help_text}")
+        lines.append(f"# TYPE twit_{name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"twit_{name}{{{label_str}}} {value}")
+
+    endpoints = snap["endpoints"].items()
+    collectors = snap["collectors"].items()
+    metric("requests_total", "counter", "API requests by response status.", [
+      ({"endpoint": ep, "status": status}, n) for ep, stats in endpoints for status, n in stats["requests"].items()
+    ])
+
+    lines.append("# HELP twit_request_latency_seconds API request latency.")
+    lines.append("# TYPE twit_request_latency_seconds histogram")
+    for ep, stats in endpoints:
+        cumulative = 0
+        for le, n in stats["latency_buckets"].items():
+            cumulative += n
+            lines.append(f'twit_request_latency_seconds_bucket{{endpoint="{ep}",le="{le}"}} {cumulative}')
+        lines.append(f'twit_request_latency_seconds_sum{{endpoint="{ep}"}} {stats["latency_secs"]}')
+        lines.append(f'twit_request_latency_seconds_count{{endpoint="{ep}"}} {cumulative}')
+
+    metric("requests_per_minute", "gauge", "API requests in the last minute.", [
+      ({"endpoint": ep}, stats["requests_per_min"]) for ep, stats in endpoints
+    ])
+    metric("sleep_seconds_total", "counter", "Secs spent waiting on the rate limit.", [
+      ({"endpoint": ep}, stats["sleep_secs"]) for ep, stats in endpoints
+    ])
+    metric("rate_limit_remaining", "gauge", "Requests left in the current rate-limit window.", [
+      ({"endpoint": ep}, stats["rate_remaining"]) for ep, stats in endpoints
+    ])
+    metric("rate_limit", "gauge", "Requests allowed per rate-limit window.", [
+      ({"endpoint": ep}, stats["rate_limit"]) for ep, stats in endpoints
+    ])
+    metric("cache_hits_total", "counter", "Responses served from the response cache.", [
+      ({"endpoint": ep}, stats["cache_hits"]) for ep, stats in endpoints
+    ])
+    metric("records_persisted_total", "counter", "Records saved by each collector.", [
+      ({"collector": name}, stats["records"]) for name, stats in collectors
+    ])
+    metric("retries_total", "counter", "Retried requests / batches, by collector.", [
+      ({"collector": name}, stats["retries"]) for name, stats in collectors
+    ])
+    metric("input_lines", "gauge", "Lines of the input CSV (or items) processed.", [
+      ({"collector": name}, stats["lines"]) for name, stats in collectors
+    ])
+    metric("eta_seconds", "gauge", "Estimated secs until the input is done.", [
+      ({"collector": name}, stats["eta_secs"]) for name, stats in collectors
+    ])
+    return "\n".join(lines) + "\n"
+
+
+TELEMETRY = Telemetry()
@@ -1,12 +1,18 @@
 import json
 import os
+import struct
+from array import array
 import requests
 import datetime
 import sys
 import select
+import threading
 import time
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from . import constants as c
+from .response_cache import ResponseCache, cached_status
+from .telemetry import TELEMETRY
 
 # by RAY CRIST, October 2021
 
@@ -32,6 +38,99 @@ def bearer_oauth(r):
     r.headers["User-Agent"] = "v2FullArchiveSearchPython"
     return r
 
+class TokenBucket:
+    """
+    Paces requests to a single endpoint.
+
+    Twitter tells us on every response how many requests are left in the current
+    15-min window (x-rate-limit-remaining) and when it resets (x-rate-limit-reset).
+    Rather than sleeping a fixed WAIT_PD between calls, we spread whatever is left
+    in the bucket evenly over the rest of the window, and only stall when it's empty.
+    Until the first response comes back, we fall back on the old fixed wait period.
+
+    Thread-safe, so several collectors can share an endpoint's bucket.
+    """
+
+    def __init__(self, wait_pd, min_interval=0):
+        self.wait_pd = wait_pd
+        self.min_interval = min_interval
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.last_req_time = 0
+        self.lock = threading.Lock()
+
+    def next_wait(self, now):
+        """Seconds to wait from `now` before the next request may go out."""
+        if self.reset_at is not None and now >= self.reset_at:
+            # Window rolled over -- bucket is full again.
+            self.remaining = self.limit
+            self.reset_at = None
+
+        if self.remaining is None:
+            interval = self.wait_pd
+        elif self.remaining <= 0 and self.reset_at is None:
+            # Used up a refilled window w/o hearing back when it resets (no headers) -- be conservative.
+            interval = self.wait_pd
+        elif self.remaining <= 0:
+            return max(0, self.reset_at - now)
+        elif self.reset_at is None:
+            interval = self.min_interval
+        else:
+            interval = min(self.wait_pd, (self.reset_at - now) / self.remaining)
+
+        interval = max(interval, self.min_interval)
+        return max(0, interval - (now - self.last_req_time))
+
+    def acquire(self):
+        """Block until a request may be sent, and take a token for it."""
+        with self.lock:
+            now = time.time()
+            wait = self.next_wait(now)
+            # Claim the slot now, so other threads queue up behind it, then sleep w/o holding the lock
+            # (so update() can still get in).
+            self.last_req_time = now + wait
+            if self.remaining:
+                self.remaining -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, headers):
+        """Refill the bucket from a response's x-rate-limit-* headers."""
+        try:
+            limit = int(headers[c.RATE_LIMIT_HDR])
+            remaining = int(headers[c.RATE_REMAINING_HDR])
+            reset_at = int(headers[c.RATE_RESET_HDR]) + c.RATE_RESET_PAD
+        except (KeyError, ValueError):
+            return
+        with self.lock:
+            self.limit = limit
+            self.remaining = remaining
+            self.reset_at = reset_at
+
+
+# One session for all collectors, so connections (and their TLS handshakes) get re-used.
+SESSION = requests.Session()
+SESSION.auth = bearer_oauth
+SESSION.mount("https://", HTTPAdapter(pool_connections=c.HTTP_POOL_SIZE, pool_maxsize=c.HTTP_POOL_SIZE))
+
+# Optional on-disk cache of responses (off unless TWIT_CACHE_MODE is set; see response_cache.py).
+CACHE = ResponseCache()
+
+buckets = dict()    # url -> TokenBucket
+buckets_lock = threading.Lock()
+
+def get_bucket(url):
+    """Return the (shared) TokenBucket for an endpoint, creating it on first use."""
+    with buckets_lock:
+        if url not in buckets:
+            buckets[url] = TokenBucket(
+              c.ENDPOINT_WAIT_PDS.get(url, c.ERR_WAIT_PD),
+              c.ENDPOINT_MIN_INTERVALS.get(url, 0)
+            )
+        return buckets[url]
+
+
 def print_exception_msg(resp, query_params):
     """
     Write to the log file an explanation
@@ -61,13 +160,35 @@ def connect_to_endpoint(url, query_params):
     """
     (Copied from Twitter example code)
     Modification: added print(get_exception_msg(...)).
+    Modification: requests go through the shared SESSION, paced by the endpoint's TokenBucket,
+      so callers no longer need to sleep between calls.
+    Modification: 200 responses (+ 401s, 404s) can be served from / saved to the on-disk CACHE, per RESPONSE_CACHE_MODE.
+    Modification: every request's latency, status + rate-limit headroom go to TELEMETRY.
 
     PARAMETERS:
     URL -- to connect to.
     params -- query parameter object.
     """
 
-    response = requests.request("GET", url, auth=bearer_oauth, params=query_params)
+    cached = CACHE.get(url, query_params)
+    if cached is not None:
+        TELEMETRY.observe_cache_hit(url)
+        status = cached_status(cached)
+        if status == 401:
+            raise TwitterUnauthException("Unauthorized (cached response).")
+        elif status == 404:
+            raise TwitterUnauthException("404 (cached response).")
+        return cached       # no request, so no rate-limit token spent.
+
+    bucket = get_bucket(url)
+    start_time = time.time()
+    bucket.acquire()
+    sent_time = time.time()
+    response = SESSION.get(url, params=query_params)
+    bucket.update(response.headers)
+    TELEMETRY.observe_request(url, response.status_code, time.time() - sent_time, sent_time - start_time, response.headers)
+
+    CACHE.put_status(url, query_params, response.status_code)
     if response.status_code == 401:
         raise TwitterUnauthException("Unauthorized. See log for details.")
     elif response.status_code == 404:
@@ -75,7 +196,9 @@ def connect_to_endpoint(url, query_params):
     elif response.status_code != 200:
         print_exception_msg(response, query_params)
         raise TwitterAPIException(response.status_code, "See log for details.")
-    return response.json()
+    json_resp = response.json()
+    CACHE.put(url, query_params, json_resp)
+    return json_resp
 
 
 def stdin_has_line():
@@ -89,14 +212,71 @@ def stdin_has_line():
   return has_line
 
 
+def line_index_path(csv_path):
+    return f"{csv_path}{c.LINE_INDEX_EXT}"
+
+
+def build_line_index(csv_path):
+    """
+    Write a sidecar index next to a CSV: the byte offset at which each line starts,
+    as packed unsigned 64-bit ints, so line N lives at byte 8*N of the index.
+    """
+    start_time = time.time()
+    offsets = array('Q')
+    pos = 0
+    with open(csv_path, 'rb') as rFile:
+        for line in rFile:
+            offsets.append(pos)
+            pos += len(line)
+    with open(line_index_path(csv_path), 'wb') as idx_file:
+        offsets.tofile(idx_file)
+    print(f"Indexed {len(offsets)} lines of {csv_path} in {time.time()-start_time} seconds")
+
+
+def line_offset(csv_path, line):
+    """
+    Look up the byte offset of a line in the CSV's sidecar index (one 8-byte read).
+    Returns None if there is no index, it's older than the CSV, or the line is past its end.
+    """
+    idx_path = line_index_path(csv_path)
+    if not os.path.exists(idx_path) or os.path.getmtime(idx_path) < os.path.getmtime(csv_path):
+        return None
+    with open(idx_path, 'rb') as idx_file:
+        idx_file.seek(8 * line)
+        packed = idx_file.read(8)
+    if len(packed) < 8:
+        return None
+    return struct.unpack('Q', packed)[0]
+
+
 def advance_to_line(rFile, next_line):
+    """
+    Move a freshly-opened file to the start of `next_line`. Uses the sidecar
+    line index if there is one, else falls back to reading line by line.
+    """
     start_time = time.time()
-    curr_line = 0
-    while curr_line < next_line:
-      rFile.readline()
-      curr_line += 1
+    offset = line_offset(rFile.name, next_line) if next_line > 0 else None
+    if offset is not None:
+        rFile.seek(offset)
+    else:
+        curr_line = 0
+        while curr_line < next_line:
+          rFile.readline()
+          curr_line += 1
     print(f"Reached line {next_line} after {time.time()-start_time} seconds")
 
 
+def advance_to_checkpoint(rFile, saved_dict, offset_key, line_key):
+    """
+    Resume a file from a checkpoint in `saved_dict`: seek straight to the saved byte offset,
+    or, for checkpoints saved before we tracked offsets, replay the saved line count.
+    """
+    if offset_key in saved_dict:
+        rFile.seek(saved_dict[offset_key])
+        print(f"Resumed at byte {saved_dict[offset_key]}")
+    else:
+        advance_to_line(rFile, saved_dict.get(line_key, 0))
+
+
 def calc_wait_time(WAIT_PD, last_req_time):    
     return max(0, WAIT_PD - (time.time() - last_req_time))
\ No newline at end of file
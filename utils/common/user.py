@@ -54,6 +54,29 @@ class Place:
           f"GEO_OBJ:{self.geo}"
         )
 
+    def resolve(self, catalog):
+        """Older users stored full Places rather than PlaceRefs; they already have everything."""
+        return self
+
+
+class PlaceRef:
+    '''
+    A user's reference to a Place in the place catalog (PLACES_SQL),
+    along w/ the tweets in which they tagged it. Saves pickling the same
+    bounding box on every user who tagged the same city.
+    '''
+    def __init__(self, place_id):
+
+        self.place_id = place_id
+        self.tweets = set()
+
+    def resolve(self, catalog):
+        """Look up the full Place (name, type, country, geo) in the place catalog."""
+        return catalog[self.place_id]
+
+    def __str__(self):
+        return f"{self.place_id}: TWTS:{len(self.tweets)}"
+
 
 
       
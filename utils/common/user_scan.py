@@ -0,0 +1,217 @@
+import os
+import json
+import sqlite3
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+from sqlitedict import decode
+
+from . import constants as c
+from .user import User
+from .activity_store import to_row
+
+# -----------------------------------------------------------
+# user_scan.py
+#
+# Parallel, read-only scans of users.sqlite for the loaders' one-off rebuilds.
+#
+# Unpickling millions of Users is CPU-bound, so rather than one SqliteDict.items()
+# loop, the table is split into rowid ranges, and a process pool unpickles them
+# (each worker w/ its own read-only, memory-mapped connection). Workers only pull
+# out the fields asked for, and send them back as Arrow record batches -- the
+# parent never sees a User object.
+#
+# Three kinds of rows:
+#   USER_ROWS      one per user         (fields from USER_FIELDS)
+#   PLACE_ROWS     one per user + place (fields from PLACE_FIELDS), places resolved against the catalog
+#   ACTIVITY_ROWS  one per user w/ an activity rate saved on their User, from before the activity store
+#                  (fields from ACTIVITY_FIELDS)
+#
+# scan_users_multi() fills several kinds at once, so each User is only unpickled once
+# however many tables are being rebuilt.
+#
+# -----------------------------------------------------------
+
+USER_ROWS = "users"
+PLACE_ROWS = "places"
+ACTIVITY_ROWS = "activity"
+
+USER_FIELDS = {
+  "user_id":         (pa.string(), lambda u_id, u: u_id),
+  "following":       (pa.int64(), lambda u_id, u: u.following),
+  "followers":       (pa.int64(), lambda u_id, u: u.followers),
+  "tweet_count":     (pa.int64(), lambda u_id, u: u.tweet_count),
+  "private":         (pa.bool_(), lambda u_id, u: bool(u.private)),
+  "created_at":      (pa.string(), lambda u_id, u: u.created_at),
+  "num_locs":        (pa.int64(), lambda u_id, u: len(u.geos)),
+  "used_prior":      (pa.bool_(), lambda u_id, u: bool(getattr(u, "used_prior", False))),
+}
+
+PLACE_FIELDS = {
+  "place_id":        (pa.string(), lambda u_id, pl_id, pl, ref: pl_id),
+  "full_name":       (pa.string(), lambda u_id, pl_id, pl, ref: pl.full_name),
+  "place_type":      (pa.string(), lambda u_id, pl_id, pl, ref: pl.place_type),
+  "country_code":    (pa.string(), lambda u_id, pl_id, pl, ref: pl.country_code),
+  "user_id":         (pa.string(), lambda u_id, pl_id, pl, ref: u_id),
+  "tweets":          (pa.list_(pa.string()), lambda u_id, pl_id, pl, ref: [str(tw_id) for tw_id in ref.tweets]),
+  "geo":             (pa.string(), lambda u_id, pl_id, pl, ref: json.dumps(pl.geo)),    # (JSON -- geo objects vary in shape)
+}
+
+ACTIVITY_FIELDS = {
+  "user_id":         (pa.string(), lambda u_id, u: u_id),
+  # Hourly tweet counts, fit to ACTIVITY_HOURS (see activity_store.to_row).
+  "activity_rate":   (pa.list_(pa.uint16(), c.ACTIVITY_HOURS), lambda u_id, u: to_row(u.activity_rate)),
+}
+
+FIELDS = {USER_ROWS: USER_FIELDS, PLACE_ROWS: PLACE_FIELDS, ACTIVITY_ROWS: ACTIVITY_FIELDS}
+
+_catalog = None     # the place catalog, loaded once per worker process.
+
+
+def connect(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.execute(c.SET_PRAGMA_MMAP_LIMIT)
+    return conn
+
+
+def schema(fields, kind=USER_ROWS):
+    return pa.schema([(name, FIELDS[kind][name][0]) for name in fields])
+
+
+def load_catalog():
+    global _catalog
+    if _catalog is None:
+        if not os.path.exists(c.PLACES_SQL):     # (no places downloaded yet; not cached, so they're picked up once they are)
+            return {}
+        conn = connect(c.PLACES_SQL)
+        try:
+            _catalog = {pl_id: decode(value) for pl_id, value in conn.execute(f'SELECT key, value FROM "{c.USERS_TABLE}"')}
+        finally:
+            conn.close()
+    return _catalog
+
+
+def rowid_ranges(path, n_ranges):
+    '''Split the table's rowids into up to n_ranges (lo, hi) ranges, inclusive.'''
+    conn = connect(path)
+    try:
+        lo, hi = conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM "{c.USERS_TABLE}"').fetchone()
+    finally:
+        conn.close()
+    if lo is None:
+        return []
+    step = max(1, -(-(hi - lo + 1) // n_ranges))
+    return [(start, min(start + step - 1, hi)) for start in range(lo, hi + 1, step)]
+
+
+class Sink:
+    """Column lists for one kind of row, turned into record batches every SCAN_BATCH_ROWS rows."""
+
+    def __init__(self, kind, fields, batch_rows=c.SCAN_BATCH_ROWS):
+        self.kind = kind
+        self.getters = [FIELDS[kind][name][1] for name in fields]
+        self.schema = schema(fields, kind)
+        self.batch_rows = batch_rows
+        self.columns = [[] for _ in fields]
+        self.batches = []
+
+    def add(self, *row_args):
+        for col, get in zip(self.columns, self.getters):
+            col.append(get(*row_args))
+        if len(self.columns[0]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.columns[0]:
+            self.batches.append(pa.RecordBatch.from_arrays(
+              [to_array(col, field.type) for col, field in zip(self.columns, self.schema)], schema=self.schema
+            ))
+            for col in self.columns:
+                col.clear()
+
+
+def to_array(col, arrow_type):
+    if pa.types.is_fixed_size_list(arrow_type):
+        # (the activity rows are already arrays -- one flat buffer instead of a Python int per hour)
+        flat = np.frombuffer(b"".join(row.tobytes() for row in col), dtype=np.uint16)
+        return pa.FixedSizeListArray.from_arrays(pa.array(flat, type=arrow_type.value_type), arrow_type.list_size)
+    return pa.array(col, type=arrow_type)
+
+
+def scan_range(path, lo, hi, outputs):
+    '''
+    Worker: for every User w/ a rowid in [lo, hi], fill each of `outputs` -- (kind, fields) pairs.
+    Returns a list of record batches per output.
+    '''
+    sinks = [Sink(kind, fields) for kind, fields in outputs]
+    catalog = load_catalog() if any(sink.kind == PLACE_ROWS for sink in sinks) else None
+
+    conn = connect(path)
+    try:
+        for u_id, value in conn.execute(
+          f'SELECT key, value FROM "{c.USERS_TABLE}" WHERE rowid BETWEEN ? AND ? ORDER BY rowid', (lo, hi)
+        ):
+            user = decode(value)
+            if not isinstance(user, User):
+                continue        # LAST_LINE, LAST_OFFSET, ...
+            for sink in sinks:
+                if sink.kind == USER_ROWS:
+                    sink.add(u_id, user)
+                elif sink.kind == PLACE_ROWS:
+                    for pl_id, ref in user.geos.items():
+                        sink.add(u_id, pl_id, ref.resolve(catalog), ref)
+                elif len(getattr(user, "activity_rate", [])) > 0:
+                    sink.add(u_id, user)
+    finally:
+        conn.close()
+
+    for sink in sinks:
+        sink.flush()
+    return [sink.batches for sink in sinks]
+
+
+def scan_users_multi(outputs, workers=c.SCAN_WORKERS, path=c.USERS_SQL):
+    '''
+    One pass over users.sqlite, filling several outputs -- (kind, fields) pairs -- at once.
+    Yields, per rowid range (in order), a list of record batches for each output.
+    '''
+    ranges = rowid_ranges(path, workers * c.SCAN_RANGES_PER_WORKER)
+    if workers <= 1:
+        for i, (lo, hi) in enumerate(ranges):
+            yield scan_range(path, lo, hi, outputs)
+            print(f"{i + 1}/{len(ranges)} rowid ranges scanned, {datetime.datetime.now()}")
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_range, path, lo, hi, outputs) for lo, hi in ranges]
+        for i, future in enumerate(futures):
+            yield future.result()
+            print(f"{i + 1}/{len(ranges)} rowid ranges scanned, {datetime.datetime.now()}")
+
+
+def scan_users_tables(outputs, workers=c.SCAN_WORKERS, path=c.USERS_SQL):
+    '''scan_users_multi, collected into one Arrow table per output.'''
+    per_output = [[] for _ in outputs]
+    for range_batches in scan_users_multi(outputs, workers, path):
+        for batches, output_batches in zip(per_output, range_batches):
+            batches.extend(output_batches)
+    return [
+      pa.Table.from_batches(batches, schema=schema(fields, kind))
+      for batches, (kind, fields) in zip(per_output, outputs)
+    ]
+
+
+def scan_users(fields, kind=USER_ROWS, workers=c.SCAN_WORKERS, path=c.USERS_SQL):
+    '''
+    Yield record batches of `fields` (names from USER_FIELDS, PLACE_FIELDS or ACTIVITY_FIELDS, per `kind`)
+    for every User in users.sqlite, in rowid order, unpickled across `workers` processes.
+    '''
+    for (batches,) in scan_users_multi([(kind, fields)], workers, path):
+        yield from batches
+
+
+def scan_users_table(fields, kind=USER_ROWS, workers=c.SCAN_WORKERS, path=c.USERS_SQL):
+    '''scan_users, collected into one Arrow table.'''
+    return scan_users_tables([(kind, fields)], workers, path)[0]
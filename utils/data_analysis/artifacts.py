@@ -0,0 +1,366 @@
+import os
+import json
+import shutil
+import hashlib
+import datetime
+import numpy as np
+from pyarrow import feather
+
+from ..common import constants as c
+from ..common import storage
+from ..common import friends_store
+
+'''
+A registry of the cached dataframes (feathers) the loaders build, and what each is built from:
+
+  users  -> places -> locations
+  users  -> activity
+  edges  -> geo_edges <- users
+  edges, geo_edges -> graph, geo_graph <- users (+ the user index; see follower_graph.py)
+  tweets, geo_tweets
+  subdivs -> salients, nation (the external datasets, see load_datasets.py)
+
+Next to every feather is a manifest (FEATHER + MANIFEST_EXT) recording the content
+hashes of the raw files it was built from (users.sqlite, friends.sqlite...), the
+hashes of the feathers it was built from, and the ARTIFACT_VERSIONS entry of the code
+that built it. load(name) only rebuilds an artifact (and whatever it depends on) if
+one of those has changed; otherwise it just reads the feather.
+
+A feather that's up to date but won't read is an error, not a cache miss -- a
+transient read failure shouldn't set off a multi-hour rescan. Use rebuild(name)
+to force it.
+
+Input files are only re-hashed when their size / mtime change, so checking
+that everything's up to date costs a few stat() calls.
+'''
+
+
+class ArtifactReadError(Exception):
+    pass
+
+
+class Artifact:
+
+    def __init__(self, name, path, build, inputs=lambda: [], deps=(), read=feather.read_feather, write=feather.write_feather):
+        self.name = name
+        self.path = path
+        self.build = build          # () -> {name: object}, for this artifact + any others built alongside it
+        self.inputs = inputs        # () -> raw files it's built from (depends on the storage backend)
+        self.deps = deps            # names of artifacts it's built from
+        self.read = read
+        self.write = write
+
+    @property
+    def version(self):
+        return c.ARTIFACT_VERSIONS[self.name]
+
+    @property
+    def manifest_path(self):
+        return f"{self.path}{c.MANIFEST_EXT}"
+
+
+# --- Fingerprints ---
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(c.HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def content_paths(path):
+    '''The files that make up `path`: it + its SQLite WAL, if it has one -- or, for a directory, the files in it.'''
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    return [p for p in [path, f"{path}-wal"] if os.path.exists(p)]
+
+
+def fingerprint(path, recorded=None):
+    '''
+    {"stat": [size, mtime], "sha256": ...} for `path` (see content_paths),
+    or None if it doesn't exist. Reuses `recorded`'s hash if the file hasn't been touched since.
+    '''
+    paths = content_paths(path)
+    if not paths:
+        return None
+    stat = [stat_key(p) for p in paths]
+    if recorded is not None and recorded.get("stat") == stat:
+        return recorded
+    return {"stat": stat, "sha256": "".join(file_hash(p) for p in paths)}
+
+
+def read_manifest(artifact):
+    try:
+        with open(artifact.manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(artifact, manifest):
+    tmp_path = f"{artifact.manifest_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, artifact.manifest_path)
+
+
+def dep_hashes(artifact):
+    hashes = dict()
+    for dep in artifact.deps:
+        manifest = read_manifest(ARTIFACTS[dep])
+        hashes[dep] = manifest["output"]["sha256"] if manifest else None
+    return hashes
+
+
+def input_fingerprints(artifact, recorded=None):
+    recorded = recorded or dict()
+    return {path: fingerprint(path, recorded.get(path)) for path in artifact.inputs()}
+
+
+def stale_reason(artifact):
+    '''Why `artifact` needs rebuilding, or None if it's up to date. (Its deps should be checked first.)'''
+    manifest = read_manifest(artifact)
+    if not os.path.exists(artifact.path):
+        return "no cached file"
+    if manifest is None:
+        return "no manifest (built before the artifact registry; see adopt())"
+    if manifest["version"] != artifact.version:
+        return f"code version {manifest['version']} -> {artifact.version}"
+    if manifest["output"]["sha256"] != (fingerprint(artifact.path, manifest["output"]) or {}).get("sha256"):
+        return "cached file changed since it was built"
+    if manifest["deps"] != dep_hashes(artifact):
+        return "rebuilt dependencies"
+
+    inputs = input_fingerprints(artifact, manifest["inputs"])
+    changed = [path for path in set(inputs) | set(manifest["inputs"]) if
+               (inputs.get(path) or {}).get("sha256") != (manifest["inputs"].get(path) or {}).get("sha256")]
+    if changed:
+        return f"inputs changed: {', '.join(sorted(changed))}"
+    if inputs != manifest["inputs"]:
+        # (touched, but the same contents -- remember the new mtimes so they aren't hashed again)
+        manifest["inputs"] = inputs
+        write_manifest(artifact, manifest)
+    return None
+
+
+# --- Building + loading ---
+
+def record(artifact, inputs):
+    write_manifest(artifact, {
+      "version": artifact.version,
+      "built": datetime.datetime.now().isoformat(),
+      "inputs": inputs,
+      "deps": dep_hashes(artifact),
+      "output": fingerprint(artifact.path),
+    })
+
+
+def build(artifact):
+    print(f"Building {artifact.name} -> {artifact.path}, {datetime.datetime.now()}")
+    for dep in artifact.deps:
+        ensure(dep)
+    before = input_fingerprints(artifact)      # (before building, so changes made meanwhile aren't missed)
+
+    built = artifact.build()
+    for name, obj in built.items():
+        other = ARTIFACTS[name]
+        os.makedirs(os.path.dirname(other.path), exist_ok=True)
+        tmp_path = f"{other.path}.tmp"
+        other.write(obj, tmp_path)
+        if os.path.isdir(other.path):
+            shutil.rmtree(other.path)       # (os.replace won't swap a directory over a non-empty one)
+        os.replace(tmp_path, other.path)
+    for name in built:      # (deps first, as the build functions return them)
+        other = ARTIFACTS[name]
+        record(other, {path: before[path] if path in before else fingerprint(path) for path in other.inputs()})
+    return built
+
+
+def ensure(name):
+    '''Rebuild artifact `name` (and anything it's built from) if it's out of date.'''
+    artifact = ARTIFACTS[name]
+    for dep in artifact.deps:
+        ensure(dep)
+    reason = stale_reason(artifact)
+    if reason is not None:
+        print(f"{name} is out of date: {reason}")
+        return build(artifact)[name]
+    return None
+
+
+def load(name, **read_args):
+    '''
+    Artifact `name`, rebuilt first if it's out of date.
+    Any read_args that aren't None (e.g. columns=[...]) are passed on to its reader.
+    Always read back from the file, so a fresh build comes back just as a cached one would.
+    '''
+    read_args = {arg: value for arg, value in read_args.items() if value is not None}
+    ensure(name)
+    artifact = ARTIFACTS[name]
+    try:
+        return artifact.read(artifact.path, **read_args)
+    except Exception as e:
+        raise ArtifactReadError(
+          f"Couldn't read {artifact.path}, though it's up to date:\n{e}\n"
+          f"If it's corrupt, rebuild it w/ artifacts.rebuild('{name}')."
+        ) from e
+
+
+def rebuild(name):
+    return build(ARTIFACTS[name])[name]
+
+
+def build_group(names):
+    '''Rebuild several artifacts, w/o building twice any that come out of the same build.'''
+    built = dict()
+    for name in names:
+        if name not in built:
+            built.update(build(ARTIFACTS[name]))
+    return built
+
+
+def adopt(name):
+    '''Record a manifest for an existing file (e.g. built before this registry) as-is, without rebuilding it.'''
+    artifact = ARTIFACTS[name]
+    for dep in artifact.deps:
+        if read_manifest(ARTIFACTS[dep]) is None:
+            adopt(dep)
+    record(artifact, input_fingerprints(artifact))
+
+
+def status():
+    '''name -> why it's out of date (or None), without rebuilding anything.'''
+    return {name: stale_reason(artifact) for name, artifact in ARTIFACTS.items()}
+
+
+# --- The artifacts (builders import their loader modules late, to avoid circular imports) ---
+
+def users_inputs():
+    return [c.STORAGE_SQL] if storage.uses_tables() else [c.USERS_SQL]
+
+def places_inputs():
+    return [c.STORAGE_SQL] if storage.uses_tables() else [c.USERS_SQL, c.PLACES_SQL]
+
+def activity_inputs():
+    return [c.ACTIVITY_RATES, c.ACTIVITY_IDS]       # (+ users, for who's geotagged, as a dep)
+
+def friends_inputs():
+    if storage.uses_tables():
+        return [c.STORAGE_SQL]
+    return [c.FRIENDS_PACKED_SQL] if friends_store.uses_packed() else [c.FRIENDS_SQL]
+
+
+def build_users_sqlite():
+    '''On the SqliteDict backend, users + places both come out of one scan of users.sqlite.'''
+    from .extract_users import extract_dfs
+    users_df, places_df = extract_dfs()
+    return {"users": users_df, "places": places_df}
+
+def build_users():
+    if not storage.uses_tables():
+        return build_users_sqlite()
+    from .load_users import generate_users_dfs
+    return {"users": generate_users_dfs()}
+
+def build_places():
+    if not storage.uses_tables():
+        return build_users_sqlite()
+    from .load_places import generate_places_df
+    return {"places": generate_places_df()}
+
+def build_activity():
+    from .load_activity import generate_geo_activity_df
+    return {"activity": generate_geo_activity_df(load("users"))}
+
+def build_locations():
+    from .load_locations import generate_locations_gdf
+    return {"locations": generate_locations_gdf()}
+
+def build_edges():
+    from .load_edges import generate_edges_df, add_edge_indices
+    edges_df = generate_edges_df()
+    # (give any new users their indices now, rather than while building the graphs -- which are
+    #  rebuilt when the user index changes, so would otherwise be rebuilt twice)
+    add_edge_indices(edges_df.copy())
+    return {"edges": edges_df}
+
+def build_geo_edges():
+    from .load_edges import generate_geo_edges_df
+    return {"geo_edges": generate_geo_edges_df(load("edges"))}
+
+def build_graph():
+    from .follower_graph import generate_follower_graph
+    return {"graph": generate_follower_graph()}
+
+def build_geo_graph():
+    from .follower_graph import generate_follower_graph
+    return {"geo_graph": generate_follower_graph(geo=True)}
+
+def build_tweets():
+    from .load_tweets import generate_tweets_dfs
+    geo_tweets_df, tweets_df = generate_tweets_dfs()
+    return {"tweets": tweets_df, "geo_tweets": geo_tweets_df}
+
+
+def build_subdivs():
+    from .load_datasets import generate_subdivs_gdf
+    return {"subdivs": generate_subdivs_gdf()}
+
+def build_nation():
+    from .load_datasets import generate_nation_gdf
+    return {"nation": generate_nation_gdf()}
+
+def build_salients():
+    from .load_datasets import generate_salients_df
+    return {"salients": generate_salients_df()}
+
+
+def read_locations(path):
+    import geopandas as gpd
+    locations_df = gpd.read_feather(path)
+    return gpd.GeoDataFrame(locations_df, geometry=locations_df[c.CENTROID], crs="epsg:2163")
+
+def write_geo_feather(gdf, path):
+    gdf.to_feather(path)
+
+def write_edges(edges_df, path):
+    feather.write_feather(edges_df, path, compression="zstd")
+
+def read_graph(path):
+    from .follower_graph import FollowerGraph
+    return FollowerGraph.load(path)
+
+def write_graph(graph, path):
+    graph.save(path)
+
+def read_geoparquet(path, columns=None, bbox=None):
+    import geopandas as gpd
+    return gpd.read_parquet(path, columns=columns, bbox=bbox)
+
+def write_geoparquet(gdf, path):
+    # Rows in Hilbert-curve order (+ a bbox column), so a bbox filter can skip whole row groups.
+    gdf = gdf.iloc[np.argsort(gdf.geometry.hilbert_distance().to_numpy(), kind="stable")]
+    gdf.to_parquet(path, index=False, write_covering_bbox=True, row_group_size=c.GEOPARQUET_ROW_GROUP_ROWS)
+
+
+ARTIFACTS = {artifact.name: artifact for artifact in [
+  Artifact("users", c.USERS_FTR, build_users, users_inputs),
+  Artifact("places", c.PLACES_FTR, build_places, places_inputs, deps=("users",)),
+  Artifact("activity", c.ACTIVITY_FTR, build_activity, activity_inputs, deps=("users",)),
+  Artifact("locations", c.LOCS_FTR, build_locations, deps=("places",), read=read_locations, write=write_geo_feather),
+  Artifact("edges", c.EDGES_FTR, build_edges, friends_inputs, write=write_edges),
+  Artifact("geo_edges", c.GEO_EDGES_FTR, build_geo_edges, deps=("edges", "users"), write=write_edges),
+  Artifact("graph", c.GRAPH_DIR, build_graph, lambda: [c.USER_INDEX_NPY], deps=("edges", "users"), read=read_graph, write=write_graph),
+  Artifact("geo_graph", c.GEO_GRAPH_DIR, build_geo_graph, lambda: [c.USER_INDEX_NPY], deps=("geo_edges", "users"), read=read_graph, write=write_graph),
+  Artifact("tweets", c.TWEETS_FTR, build_tweets, lambda: [c.TWTS_CSV]),
+  Artifact("geo_tweets", c.GEO_TWEETS_FTR, build_tweets, lambda: [c.TWTS_CSV]),
+  Artifact("subdivs", c.SUBDIVS_PARQUET, build_subdivs, lambda: [c.COUSUB_SHP, c.COUSUB_DBF], read=read_geoparquet, write=write_geoparquet),
+  Artifact("nation", c.NATION_PARQUET, build_nation, lambda: [c.NATION_SHP], read=read_geoparquet, write=write_geoparquet),
+  Artifact("salients", c.SALIENTS_FTR, build_salients, lambda: [c.ACS_CSV, c.MPV_CSV], deps=("subdivs",)),
+]}
@@ -0,0 +1,49 @@
+import datetime
+
+from ..common import constants as c
+from ..common import user_scan
+from . import artifacts
+from .load_users import USER_SCAN_FIELDS, users_from_scan, generate_users_dfs
+from .load_places import PLACE_SCAN_FIELDS, places_from_scan
+from .load_activity import import_scanned_rates
+
+'''
+Rebuilds the feathers that come from users.sqlite -- users (USERS_FTR) and
+places (PLACES_FTR) -- in one pass, rather than a full scan (and unpickling
+everyone) per feather. The same pass picks up activity rates still saved on
+User objects (from before the activity store) and imports them into the store,
+which geotagged users' activity rates (ACTIVITY_FTR) are then built from
+(see load_activity.py).
+
+Each worker in the scan (see common/user_scan.py) fills all three sets of
+columns from the same User as it goes.
+'''
+
+OUTPUTS = [
+  (user_scan.USER_ROWS, USER_SCAN_FIELDS),
+  (user_scan.PLACE_ROWS, PLACE_SCAN_FIELDS),
+  (user_scan.ACTIVITY_ROWS, ["user_id", "activity_rate"]),
+]
+
+
+def extract_dfs():
+    '''Scan users.sqlite once; return (users_df, places_df), importing any activity rates saved on Users along the way.'''
+
+    print(f"Extracting users, places and activity from {c.USERS_SQL}, {datetime.datetime.now()}")
+    users_table, places_table, activity_table = user_scan.scan_users_tables(OUTPUTS)
+    import_scanned_rates(activity_table)
+
+    users_df = generate_users_dfs(users_from_scan(users_table))
+    places_df = places_from_scan(places_table)
+    print(f"{len(users_df)} users, {len(places_df)} user-places extracted.")
+
+    return users_df, places_df
+
+
+def extract_feathers():
+    '''
+    Rebuild the users, places + activity feathers (recording them in the artifact registry),
+    whether or not they're out of date. Returns (users_df, places_df, activity_df).
+    '''
+    built = artifacts.build_group(["users", "places", "activity"])
+    return built["users"], built["places"], built["activity"]
@@ -0,0 +1,149 @@
+import os
+import numpy as np
+
+from ..common import constants as c
+from .load_edges import load_edges_df, load_geo_edges_df
+from .user_index import load_user_index
+from . import artifacts
+
+'''
+The follower graph as compressed sparse rows, over the dense user indices
+from user_index.py -- the one representation for anything that needs
+"who follows this author" (or "who does this user follow").
+
+  indptr, indices       CSR by Source: followers of user u are indices[indptr[u]:indptr[u+1]]
+  t_indptr, t_indices   the transpose (CSC), by Target: the users u follows
+
+Built once from the edge table and saved as .npy files (GRAPH_DIR / GEO_GRAPH_DIR);
+loads memory-map them, so opening the graph is instant and only the rows you
+touch are read from disk. The graphs are artifacts ("graph", "geo_graph" in artifacts.py),
+rebuilt when the edges, the users or the user index they're numbered by change.
+'''
+
+ARRAYS = ["indptr", "indices", "t_indptr", "t_indices"]
+
+
+def compress(rows, cols, n_nodes):
+    '''(rows, cols) edge arrays -> (indptr, indices), cols sorted within each row.'''
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32)
+
+
+class FollowerGraph:
+
+    def __init__(self, indptr, indices, t_indptr, t_indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.t_indptr = t_indptr
+        self.t_indices = t_indices
+        self.n_nodes = len(indptr) - 1
+
+    @classmethod
+    def from_edges(cls, sources, targets, n_nodes=None):
+        '''From edge arrays of user indices, where targets[i] follows sources[i].'''
+        sources = np.asarray(sources, dtype=np.int32)
+        targets = np.asarray(targets, dtype=np.int32)
+        if n_nodes is None:
+            n_nodes = int(max(sources.max(initial=-1), targets.max(initial=-1))) + 1
+        indptr, indices = compress(sources, targets, n_nodes)
+        t_indptr, t_indices = compress(targets, sources, n_nodes)
+        return cls(indptr, indices, t_indptr, t_indices)
+
+    @classmethod
+    def load(cls, graph_dir):
+        return cls(*[np.load(f"{graph_dir}/{name}.npy", mmap_mode="r") for name in ARRAYS])
+
+    def save(self, graph_dir):
+        os.makedirs(graph_dir, exist_ok=True)
+        for name in ARRAYS:
+            np.save(f"{graph_dir}/{name}.npy", getattr(self, name))
+
+    def __len__(self):
+        '''Number of edges.'''
+        return len(self.indices)
+
+    # --- Neighbors (views into the arrays -- copy them before modifying) ---
+
+    def followers(self, u):
+        if u >= self.n_nodes:
+            return self.indices[:0]
+        return self.indices[self.indptr[u]:self.indptr[u + 1]]
+
+    def friends(self, u):
+        '''The users u follows.'''
+        if u >= self.n_nodes:
+            return self.t_indices[:0]
+        return self.t_indices[self.t_indptr[u]:self.t_indptr[u + 1]]
+
+    def followers_of_many(self, us):
+        '''Followers of each of us, concatenated; returns (authors, followers), one entry per edge.'''
+        return gather(self.indptr, self.indices, self.n_nodes, us)
+
+    def friends_of_many(self, us):
+        '''Who each of us follows, concatenated; returns (users, friends), one entry per edge.'''
+        return gather(self.t_indptr, self.t_indices, self.n_nodes, us)
+
+    # --- Degrees ---
+
+    def out_degree(self, us=None):
+        '''Follower counts (of every user, or of us). Users added to the index after the build have 0.'''
+        return degree(self.indptr, self.n_nodes, us)
+
+    def in_degree(self, us=None):
+        '''Friend counts (of every user, or of us).'''
+        return degree(self.t_indptr, self.n_nodes, us)
+
+    # --- Subgraphs ---
+
+    def subgraph_edges(self, nodes):
+        '''Edges w/ both ends in `nodes`, as (sources, targets) arrays of user indices.'''
+        nodes = np.unique(np.asarray(nodes, dtype=np.int32))
+        sources, targets = self.followers_of_many(nodes)
+        keep = np.isin(targets, nodes, assume_unique=False)
+        return sources[keep], targets[keep]
+
+    def subgraph(self, nodes):
+        '''The induced subgraph on `nodes` (same user indices, so it's just a smaller, in-memory graph).'''
+        sources, targets = self.subgraph_edges(nodes)
+        return FollowerGraph.from_edges(sources, targets, self.n_nodes)
+
+    def count_edges_within(self, nodes):
+        return len(self.subgraph_edges(nodes)[0])
+
+
+def degree(indptr, n_nodes, us):
+    counts = np.diff(indptr)
+    if us is None:
+        return counts
+    us = np.asarray(us)
+    out = np.zeros(len(us), dtype=np.int64)
+    known = (us >= 0) & (us < n_nodes)
+    out[known] = counts[us[known]]
+    return out
+
+
+def gather(indptr, indices, n_nodes, us):
+    us = np.asarray(us, dtype=np.int64)
+    us = us[(us >= 0) & (us < n_nodes)]
+    starts = np.asarray(indptr[us])
+    counts = np.asarray(indptr[us + 1]) - starts
+    # Position of every edge in `indices`: each row's start, plus 0, 1, 2... within the row.
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(us, counts).astype(np.int32), np.asarray(indices[np.repeat(starts, counts) + offsets])
+
+
+def generate_follower_graph(geo=False):
+    edges_df = load_geo_edges_df(with_indices=True) if geo else load_edges_df(with_indices=True)
+    graph = FollowerGraph.from_edges(edges_df[c.SOURCE_IDX], edges_df[c.TARGET_IDX], len(load_user_index()))
+    print(f"{len(graph)} edges over {graph.n_nodes} users.")
+    return graph
+
+
+def load_follower_graph(geo=False):
+    '''
+    The (memory-mapped) follower graph of every edge, or w/ geo=True,
+    just the edges whose sources are geotagged (load_geo_edges_df).
+    '''
+    return artifacts.load("geo_graph" if geo else "graph")
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pandas as pd
+
+from ..common import constants as c
+from ..common import activity_store
+from . import artifacts
+
+'''
+Load users' hourly tweet counts (activity rates) from the activity store
+written by download_activity.py. Both files are memory-mapped, so nothing
+is read into memory until it's used.
+'''
+
+
+def load_activity_arrays():
+    '''
+    Returns (ids, rates), where ids[i] is a user's ID (int64) and
+    rates[i] their ACTIVITY_HOURS hourly tweet counts (uint16), oldest first.
+    '''
+
+    if not (os.path.exists(c.ACTIVITY_RATES) and os.path.exists(c.ACTIVITY_IDS)):
+        n_rows = 0      # (nothing downloaded or imported yet)
+    else:
+        n_rows = min(
+          os.path.getsize(c.ACTIVITY_RATES) // activity_store.ROW_BYTES,
+          os.path.getsize(c.ACTIVITY_IDS) // activity_store.ID_BYTES,
+        )
+    if n_rows == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, c.ACTIVITY_HOURS), dtype=np.uint16)
+
+    ids = np.memmap(c.ACTIVITY_IDS, dtype=np.int64, mode='r', shape=(n_rows,))
+    rates = np.memmap(c.ACTIVITY_RATES, dtype=np.uint16, mode='r', shape=(n_rows, c.ACTIVITY_HOURS))
+    return ids, rates
+
+
+def load_activity_df():
+    '''
+    One row per user, where "Activity Rate" is the fraction of hours
+    in which they tweeted at all (i.e. logged in).
+    '''
+
+    ids, rates = load_activity_arrays()
+    activity_df = pd.DataFrame({
+      c.U_ID: ids.astype(str),
+      c.ACTIVITY_RATE: np.count_nonzero(rates, axis=1) / c.ACTIVITY_HOURS,
+    })
+    return activity_df
+
+
+def load_geo_activity_df():
+    '''
+    Like load_activity_df, for geotagged users only -- the activity rates the simulations use.
+    Cached in ACTIVITY_FTR.
+    '''
+    return artifacts.load("activity")
+
+
+def generate_geo_activity_df(users_df):
+    '''From the activity store (on either storage backend), for users_df's (load_users_df) geotagged users.'''
+    activity_df = load_activity_df()
+    geo_u_ids = users_df.loc[users_df[c.HAS_TAG], c.U_ID]
+    return activity_df[activity_df[c.U_ID].isin(geo_u_ids)].reset_index(drop=True)
+
+
+
+def import_scanned_rates(table):
+    '''
+    Arrow table of (user_id, activity_rate) rows from user_scan -- rates saved on User objects,
+    from before the activity store -- into the store, skipping anyone already in it.
+    The store's only opened for writing if there's someone to add, so this is a no-op
+    (safe alongside download_activity) once they've all been imported.
+    '''
+    u_ids = table.column("user_id").to_numpy(zero_copy_only=False)
+    saved_ids, _ = load_activity_arrays()
+    new = ~np.isin(u_ids.astype(np.int64), saved_ids)
+    if not new.any():
+        return 0
+    rates = table.column("activity_rate").combine_chunks().flatten().to_numpy().reshape(-1, c.ACTIVITY_HOURS)
+    with activity_store.ActivityStore() as store:
+        store.append_rows(u_ids[new], np.ascontiguousarray(rates[new]))
+    print(f"Imported {new.sum()} users' activity rates from their User objects into the activity store.")
+    return new.sum()
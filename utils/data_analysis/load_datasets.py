@@ -0,0 +1,146 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+from ..common import constants as c
+from ..common import geo_helpers as g
+from . import artifacts
+
+'''
+Loads the external datasets -- the Census county subdivisions + nation outline, the
+American Community Survey (ACS) and Mapping Police Violence (MPV) -- from copies ingested
+once (make datasets), rather than re-reading the shapefiles / CSVs every session.
+
+  subdivs   (GeoParquet) Geo_FIPS, Geo_QNAME + geometry, projected to epsg:2163
+  nation    (GeoParquet) the US outline, projected to epsg:2163
+  salients  (Feather)    the ACS columns we use, w/ the smaller race groups folded into
+                         OtherRacePop(Perc), + police killings per subdivision (PoliceKillings,
+                         PKPerCap, PKPerSqMile) and Blck_Wht_PerCap_Ratio. Populated subdivisions only.
+
+The GeoParquet files are written in Hilbert-curve order w/ a bbox column, so reading
+just `columns`, or just the rows in a bbox, only touches that part of the file.
+'''
+
+OTHER_RACES = ["Native", "Asian", "Islander", "MultiRace"]     # folded into OtherRace
+ACS_COLUMNS = [
+  c.GEO_FIPS,
+  'Geo_NAME',
+  'Geo_STATE',
+  'Geo_COUNTY',
+  'Geo_COUSUB',
+  c.TOTAL_POP,
+  'Pop_Dens',
+  c.LAND_AREA,
+  'WhitePop',
+  'BlackPop',
+  'OtherRacePop',
+  'WhitePopPerc',
+  'BlackPopPerc',
+  'OtherRacePopPerc',
+  'PctLatinoPop',
+  'WhitePerCap',
+  'BlackPerCap',
+  'LatinoPerCap',
+  'PerCap',
+]
+MPV_LAT = 'Latitude'
+MPV_LNG = 'Longitude'
+MPV_ADDRESS = 'Street Address of Incident'
+SUBDIV_COLUMNS = [c.GEO_FIPS, c.GEO_QNAME, "geometry"]
+
+
+def stored_bbox(bbox, bbox_crs):
+    '''A (minx, miny, maxx, maxy) bbox in bbox_crs -> epsg:2163, as the GeoParquet files are stored.'''
+    if bbox is None or bbox_crs is None:
+        return bbox
+    return g.reproject_bounds(bbox, bbox_crs, "epsg:2163")
+
+
+# --- County subdivisions ---
+
+def load_subdivs_gdf(columns=None, bbox=None, bbox_crs="epsg:4326", salients=False):
+    '''
+    The county subdivisions (Geo_FIPS, Geo_QNAME, geometry), projected to epsg:2163.
+
+      columns   only read these columns (Geo_FIPS + geometry always come along)
+      bbox      (minx, miny, maxx, maxy), in bbox_crs (lng/lat by default; None for epsg:2163 meters):
+                only read subdivisions whose bounding boxes overlap it
+      salients  merge in the salients columns (load_salients_df), dropping unpopulated
+                subdivisions. `columns` can then name salients columns too.
+    '''
+    geo_columns = salient_columns = None
+    if columns is not None:
+        geo_columns = [c.GEO_FIPS] + ([c.GEO_QNAME] if c.GEO_QNAME in columns else []) + ["geometry"]
+        salient_columns = [c.GEO_FIPS] + [col for col in columns if col not in SUBDIV_COLUMNS]
+
+    subdivs_gdf = artifacts.load("subdivs", columns=geo_columns, bbox=stored_bbox(bbox, bbox_crs))
+    if salients:
+        subdivs_gdf = subdivs_gdf.merge(load_salients_df(salient_columns), how="inner", on=c.GEO_FIPS)
+    return subdivs_gdf
+
+
+def generate_subdivs_gdf():
+    import geopandas as gpd
+
+    print(f"Reading county subdivisions from {c.COUSUB_DBF}, {datetime.datetime.now()}")
+    subdivs_gdf = gpd.read_file(c.COUSUB_DBF)[SUBDIV_COLUMNS]
+    subdivs_gdf[c.GEO_FIPS] = subdivs_gdf[c.GEO_FIPS].astype(np.int64)
+    subdivs_gdf = subdivs_gdf.to_crs("epsg:2163")
+    print(f"{len(subdivs_gdf)} county subdivisions.")
+    return subdivs_gdf
+
+
+# --- Nation outline ---
+
+def load_nation_gdf(columns=None):
+    '''The US outline (cb_2018_us_nation_5m), projected to epsg:2163.'''
+    if columns is not None and "geometry" not in columns:
+        columns = list(columns) + ["geometry"]
+    return artifacts.load("nation", columns=columns)
+
+
+def generate_nation_gdf():
+    import geopandas as gpd
+
+    print(f"Reading {c.NATION_SHP}")
+    return gpd.read_file(c.NATION_SHP).to_crs("epsg:2163")
+
+
+# --- ACS + MPV ---
+
+def load_salients_df(columns=None):
+    '''ACS + MPV columns per populated county subdivision (see above); just `columns`, if given.'''
+    return artifacts.load("salients", columns=columns)
+
+
+def generate_salients_df():
+    from .subdiv_index import points_per_subdiv
+
+    print(f"Reading {c.ACS_CSV}, {datetime.datetime.now()}")
+    other_race_cols = [f"{race}Pop" for race in OTHER_RACES] + [f"{race}PopPerc" for race in OTHER_RACES]
+    acs_df = pd.read_csv(c.ACS_CSV, header=1, usecols=ACS_COLUMNS + other_race_cols, low_memory=False)
+    for race in OTHER_RACES:
+        acs_df['OtherRacePop'] += acs_df[f"{race}Pop"]
+        acs_df['OtherRacePopPerc'] += acs_df[f"{race}PopPerc"]
+    salients_df = acs_df.loc[acs_df[c.TOTAL_POP] > 0, ACS_COLUMNS].reset_index(drop=True)
+    salients_df[c.GEO_FIPS] = salients_df[c.GEO_FIPS].astype(np.int64)
+
+    # Police killings per subdivision (incidents w/ an address, as counted before).
+    print(f"Reading {c.MPV_CSV}")
+    mpv_df = pd.read_csv(c.MPV_CSV, usecols=[MPV_LAT, MPV_LNG, MPV_ADDRESS], low_memory=False)
+    mpv_df = mpv_df.loc[mpv_df[MPV_ADDRESS].notna()]
+    mpv_by_subdiv = points_per_subdiv(mpv_df[MPV_LNG], mpv_df[MPV_LAT], c.POLICE_KILLINGS)
+
+    salients_df = salients_df.merge(mpv_by_subdiv, how="left", on=c.GEO_FIPS)
+    salients_df = salients_df.fillna({c.POLICE_KILLINGS: 0})
+    salients_df["PKPerCap"] = salients_df[c.POLICE_KILLINGS] / salients_df[c.TOTAL_POP]
+    salients_df["PKPerSqMile"] = salients_df[c.POLICE_KILLINGS] / salients_df[c.LAND_AREA]
+    salients_df["Blck_Wht_PerCap_Ratio"] = salients_df["BlackPerCap"] / salients_df["WhitePerCap"]
+
+    print(f"{len(salients_df)} populated subdivisions, {int(salients_df[c.POLICE_KILLINGS].sum())} police killings.")
+    return salients_df
+
+
+def ingest_datasets():
+    '''Rebuild the subdivisions, nation + salients files from the raw datasets, whether or not they're out of date.'''
+    return artifacts.build_group(["subdivs", "nation", "salients"])
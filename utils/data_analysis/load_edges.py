@@ -1,9 +1,13 @@
 from sqlitedict import SqliteDict
-from pyarrow import feather
+import numpy as np
 import pandas as pd
 
 from ..common import constants as c
+from ..common import storage
+from ..common import friends_store
 from .load_users import load_users_dfs
+from .user_index import load_user_index, add_index_column
+from . import artifacts
 
 """
 Loads all the edges into a dataframe,
@@ -11,33 +15,32 @@ where an edge from user A to B means
 that user B follows user A (thus,
 information flows from A->B).
 
+Columns are just "Target" and "Source", both int64 user IDs
+(every edge is directed, w/ weight 1, so those columns aren't stored).
+W/ with_indices=True, their dense user indices, TARGET_IDX and SOURCE_IDX
+(see user_index.py), come along too -- e.g. for follower_graph.py.
+
 Assumes that the "FRIENDS SQL" table
 has already been created.
 """
 
-def load_edges_df():
+def load_edges_df(with_indices=False):
 
-    try:
-        edges_df = feather.read_feather(c.EDGES_FTR)
-    except Exception as e:
-        print(f"Feather failed:\n{e}\n")
-        edges_df = generate_edges_df()
-        feather.write_feather(edges_df, c.EDGES_FTR)
+    edges_df = artifacts.load("edges")
+    return add_edge_indices(edges_df) if with_indices else edges_df
 
-    return edges_df
 
+def load_geo_edges_df(with_indices=False):
 
-def load_geo_edges_df():
+    geo_edges_df = artifacts.load("geo_edges")
+    return add_edge_indices(geo_edges_df) if with_indices else geo_edges_df
 
-    try:
-        geo_edges_df = feather.read_feather(c.GEO_EDGES_FTR)
-    except Exception as e:
-        print(f"Feather failed:\n{e}\n")
-        edges_df = load_edges_df()
-        geo_edges_df = generate_geo_edges_df(edges_df)
-        feather.write_feather(geo_edges_df, c.GEO_EDGES_FTR)
 
-    return geo_edges_df 
+def add_edge_indices(edges_df):
+    index = load_user_index()
+    add_index_column(edges_df, "Target", c.TARGET_IDX, index)
+    add_index_column(edges_df, "Source", c.SOURCE_IDX, index)
+    return edges_df
 
 
 def generate_edges_df():
@@ -45,51 +48,60 @@ def generate_edges_df():
     All edges' targets are geotagged users.
     This df includes those edges whose targets
     may not be geotagged.
+
+    Each user's friends go straight into an int64 array, and the arrays are
+    concatenated once at the end -- no per-edge Python objects. Users we
+    couldn't download ([FRIENDS_UNAUTH] / [FRIENDS_404]) have no edges.
     '''
 
-    data = []
-    with SqliteDict(c.FRIENDS_SQL) as friends_dict:
-        
-        runs = 0
-
-        for u_id, friends_ids in friends_dict.items():
-            if isinstance(friends_ids, list):
-                for friend_id in friends_ids:
-                    data.append((u_id, friend_id))
-                runs += 1
-                
-            if runs % 1000 == 0:
-                print(f"{runs} users loaded.")
-                    
-        print(f"Data length = {len(data)}")
-        friends_dict.close(force=True)
-        
-    edges_df = pd.DataFrame(data, columns=["Target", "Source"])
-    edges_df["Type"] = "Directed"
-    edges_df["Weight"] = 1
-
-    # pyarrow can't deal with ints for these columns for some reason.
-    edges_df['Source'] = edges_df['Source'].astype(str)
-    edges_df['Target'] = edges_df['Target'].astype(str)
-   
+    if storage.uses_tables():
+        with storage.Storage(readonly=True) as store:
+            edges_df = pd.read_sql_query("SELECT user_id AS Target, friend_id AS Source FROM friends", store.conn)
+        return edges_df.astype(np.int64)
+
+    targets, sources = [], []
+    if friends_store.uses_packed():
+        with friends_store.FriendsStore(readonly=True) as store:
+            for u_ids, friend_ids in store.iter_batches():
+                targets.append(u_ids)
+                sources.append(friend_ids)
+    else:
+        with SqliteDict(c.FRIENDS_SQL) as friends_dict:
+
+            runs = 0
+
+            for u_id, friends_ids in friends_dict.items():
+                if isinstance(friends_ids, list):
+                    if friends_ids not in [[c.FRIENDS_UNAUTH], [c.FRIENDS_404]]:
+                        sources.append(np.array(friends_ids).astype(np.int64))     # (decimal strings -> int64)
+                        targets.append(np.full(len(friends_ids), int(u_id), dtype=np.int64))
+                    runs += 1
+
+                if runs % 1000 == 0:
+                    print(f"{runs} users loaded.")
+
+            friends_dict.close(force=True)
+
+    edges_df = pd.DataFrame({
+      "Target": np.concatenate(targets) if targets else np.empty(0, dtype=np.int64),
+      "Source": np.concatenate(sources) if sources else np.empty(0, dtype=np.int64),
+    })
+    print(f"Data length = {len(edges_df)}")
     return edges_df
 
 def generate_geo_edges_df(edges_df):
     '''
-    I downloaded only geotagged users' friend information, 
+    I downloaded only geotagged users' friend information,
     therefore, all edges' targets are geotagged users.
     This function filters out edges where
     source users which are not geotagged.
     '''
 
     _, geo_users_df = load_users_dfs()
-    u_ids = geo_users_df[c.U_ID]
+    geo_u_ids = geo_users_df[c.U_ID].astype(np.int64).unique()
 
-    geo_edges_df = edges_df.merge(u_ids, how='left', left_on="Source", right_on=c.U_ID)
-    print(geo_edges_df)
+    # Semi-join: keep edges whose Source is a geo user (a hash lookup per edge, no merged columns to drop).
+    geo_edges_df = edges_df.loc[edges_df["Source"].isin(geo_u_ids), ["Target", "Source"]].reset_index(drop=True)
+    print(f"{len(geo_edges_df)} / {len(edges_df)} edges have geotagged sources.")
 
-    geo_edges_df = geo_edges_df.loc[geo_edges_df[c.U_ID].notna()]
-    print(geo_edges_df)
-    
-    geo_edges_df = geo_edges_df.drop(c.U_ID, axis=1)
-    return geo_edges_df
\ No newline at end of file
+    return geo_edges_df
@@ -1,5 +1,7 @@
 
 from sqlitedict import SqliteDict
+import numpy as np
+import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from pyarrow import feather
@@ -7,6 +9,7 @@ from pyarrow import feather
 from ..common import geo_helpers as g
 from ..common import constants as c
 from .load_places import load_places_df
+from . import artifacts
 
 
 '''
@@ -19,18 +22,18 @@ provided that that user's mean location is within
 '''
 
 
-def conv_to_geometry(geos_col):
-    '''
-    Convert Twitter geotags series into a series that GeoPandas can read.
+def place_centroids(places_df):
     '''
+    Flat-USA (epsg:2163) centroids of each unique place in places_df, as (pl_codes, pl_ids, xs, ys):
+    row i of places_df is place pl_ids[pl_codes[i]], at (xs[pl_codes[i]], ys[pl_codes[i]]). NaN for places w/o a bbox.
 
-    out = []
-    for geo in geos_col:
-        if 'bbox' in geo:
-            out.append(g.polygon_from_bbox(geo))
-        else:
-            out.append('')
-    return out
+    The bbox math + reprojection run once per place, not once per user who tagged it.
+    '''
+    pl_codes, pl_ids = pd.factorize(places_df[c.PL_ID])
+    first_rows = np.unique(pl_codes, return_index=True)[1]
+    bboxes = g.bbox_array(places_df[c.GEOTAG].to_numpy()[first_rows])
+    xs, ys = g.reproject(*g.bbox_centroids(bboxes))
+    return pl_codes, np.asarray(pl_ids), np.asarray(xs), np.asarray(ys)
 
 
 def load_locations_gdf():
@@ -41,13 +44,7 @@ def load_locations_gdf():
     other resources will likely need.
     '''
 
-    try:
-        locations_df = gpd.read_feather(c.LOCS_FTR)
-        locations_gdf = gpd.GeoDataFrame(locations_df, geometry=locations_df[c.CENTROID], crs="epsg:2163")
-    except Exception as e:
-        print(f"Feather failed:\n{e}\n")
-        locations_gdf = generate_locations_gdf()
-        locations_gdf.to_feather(c.LOCS_FTR)
+    locations_gdf = artifacts.load("locations")
 
     locations_gdf = locations_gdf.set_crs(epsg=2163)
     locations_gdf = locations_gdf.to_crs(epsg=4326)
@@ -55,66 +52,52 @@ def load_locations_gdf():
 
 
 def generate_locations_gdf():
+    '''
+    One row per (user, place) -- no exploding to a row per tweet. Each place's
+    tweet count is used as its weight in the user's mean location, and the
+    user's mode location is the place w/ the most tweets.
+    '''
 
     places_df = load_places_df()
-    places_df = places_df.explode(c.NUM_TWEETS, ignore_index=False)     # Create seperate row for each tweet.
-    
-    # Convert into a geo-capable dataframe.
-    gdf = gpd.GeoDataFrame(
-      places_df, 
-      geometry=conv_to_geometry(places_df[c.GEOTAG])
-    )
-
-    # Set up GDF geometry. 
-    gdf = gdf.set_crs(epsg=4326)  # Convert lat/lng coords
-    gdf = gdf.to_crs(epsg=2163)   # to flat USA coords
-    gdf = gdf.rename(columns={'geometry': 'geom'}).set_geometry('geom')
-    gdf[c.CENTROID] = gdf.centroid
-    gdf = gdf.set_geometry(c.CENTROID)
-
-    # Track which geotags came from outside United States:
-    gdf[c.FOREIGN] = gdf[c.C_CODE].apply(lambda c_code: c_code != c.US_CC)
-
-    print("Viewing how many unique users in GDF:")
-    print(gdf.groupby(gdf[c.U_ID]).count().describe())
-    print(c.SEPERATOR)
 
-    # Filter out non-valuable geotags.
-    gdf = gdf[gdf[c.PL_TYPE] != c.PL_ADMIN]
-    gdf = gdf[gdf[c.PL_TYPE] != c.PL_COUNTRY]
-
-    # Set up mean/mode DFs
-    mode_gdf = gdf.groupby(gdf[c.U_ID]).agg({
-      c.CENTROID: g.mode_gdf_centroid,
-      c.FOREIGN: 'any',
-      c.PL_ID: 'nunique',
-      c.NUM_TWEETS: 'count',
-      c.FOREIGN: 'any',
-    })
-    mean_gdf = gdf.groupby(gdf[c.U_ID]).agg({
-      c.CENTROID: g.mean_gdf_centroid,
-      c.FOREIGN: 'any',
-    })
-
-    # Filter out users with a tweet in a foreign location.
-    mean_gdf = mean_gdf.loc[lambda x: x[c.FOREIGN] == False]
-    mode_gdf = mode_gdf.loc[lambda x: x[c.FOREIGN] == False]
-    
-    # Re-set geometry after creating new GDFs...
-    mean_gdf = mean_gdf.set_geometry(c.CENTROID)
-    mode_gdf = mode_gdf.set_geometry(c.CENTROID)
-
-    print("GDF MEAN:")
-    print(mean_gdf)
-    print("GDF MODE:")
-    print(mode_gdf)
+    # Each place's bbox center, in flat USA coords.
+    pl_codes, pl_ids, pl_xs, pl_ys = place_centroids(places_df)
+
+    # Filter out non-valuable geotags (+ any w/o a bbox).
+    keep = ~places_df[c.PL_TYPE].isin([c.PL_ADMIN, c.PL_COUNTRY]).to_numpy() & np.isfinite(pl_xs[pl_codes])
+    xs = pl_xs[pl_codes][keep]
+    ys = pl_ys[pl_codes][keep]
+    n_tweets = places_df[c.NUM_TWEETS].map(len).to_numpy()[keep]
+    weights = np.maximum(n_tweets, 1).astype(np.float64)     # (as exploding an empty list still left a row)
+    foreign = (places_df[c.C_CODE] != c.US_CC).to_numpy()[keep]     # Track which geotags came from outside United States.
+    user_codes, u_ids = pd.factorize(places_df[c.U_ID].to_numpy()[keep])
+    place_codes = pl_codes[keep]
+    n_users = len(u_ids)
+    print(f"{len(xs)} user-places, {n_tweets.sum()} tweets, from {n_users} users.")
+
+    # Set up mean/mode locations, indexed by user code.
+    mean_xs, mean_ys = g.mean_centroids(user_codes, xs, ys, weights)
+    mode_row = g.mode_rows(user_codes, place_codes, weights)
+    mode_xs, mode_ys = xs[mode_row], ys[mode_row]
+
+    n_places = place_codes.max() + 1 if len(place_codes) else 1
+    pairs = np.unique(user_codes.astype(np.int64) * n_places + place_codes)
+    mode_gdf = gpd.GeoDataFrame({
+      c.U_ID: u_ids,
+      c.PL_ID: np.bincount(pairs // n_places, minlength=n_users),     # unique places
+      c.NUM_TWEETS: np.bincount(user_codes, weights=n_tweets, minlength=n_users).astype(np.int64),
+      # Calculate distance between mode and mean location centroid.
+      c.GEO_DEV: np.hypot(mode_xs - mean_xs, mode_ys - mean_ys),
+      c.FOREIGN: np.bincount(user_codes, weights=foreign, minlength=n_users) > 0,
+      c.MODE_PL_ID: pl_ids[place_codes[mode_row]],     # (for looking up the user's subdivision, see subdiv_index.py)
+    }, geometry=gpd.points_from_xy(mode_xs, mode_ys), crs="epsg:2163")
+    mode_gdf = mode_gdf.rename_geometry(c.CENTROID)
+
+    # Filter out users with a tweet in a foreign location, or whose mean location is >30km from their mode.
+    mode_gdf = mode_gdf.loc[~mode_gdf[c.FOREIGN] & (mode_gdf[c.GEO_DEV] < c.DIST_THRESHOLD)]
+    mode_gdf = mode_gdf.drop(columns=[c.FOREIGN]).reset_index(drop=True)
+
+    print(f"{len(mode_gdf)} / {n_users} users located.")
     print(c.SEPERATOR)
 
-    # Calculate distance between mode and mean location centroid. Sift out any with >30km variation.
-    mode_gdf[c.GEO_DEV] = mode_gdf.distance(mean_gdf, align=False)
-    mode_gdf = mode_gdf.loc[lambda x: x[c.GEO_DEV] < c.DIST_THRESHOLD]
-
-    mode_gdf.reset_index(inplace=True)
-    mode_gdf = mode_gdf.drop(['foreign'], axis=1)
-
     return mode_gdf
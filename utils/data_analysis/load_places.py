@@ -1,8 +1,12 @@
-import pyarrow.feather as feather
+import json
 import pandas as pd
 from sqlitedict import SqliteDict
 
 from ..common import constants as c
+from ..common import storage
+from ..common import user_scan
+from . import artifacts
+from .user_index import add_index_column
 
 '''
 Note: I use "places" to refer to geotags, 
@@ -16,37 +20,64 @@ and 1 place may have been tagged by many users).
 
 def load_places_df():
 
-    try:
-        places_df = feather.read_feather(c.PLACES_FTR)
-    except Exception as e:
-        print(f"Feather failed:\n{e}\n")
-        places_df = generate_places_df()
-        feather.write_feather(places_df, c.PLACES_FTR)
+    places_df = artifacts.load("places")
+
+    add_index_column(places_df, c.U_ID, c.U_IDX)
     return places_df
 
 
+def load_place_catalog():
+    '''
+    The place catalog (place_id -> Place) that users' PlaceRefs point into.
+    Small enough (one entry per unique place) to just hold in memory.
+    '''
+    with SqliteDict(c.PLACES_SQL) as places_dict:
+        catalog = dict(places_dict.items())
+    return catalog
+
+
+PLACE_SCAN_FIELDS = ["place_id", "full_name", "place_type", "country_code", "user_id", "tweets", "geo"]
+
+
 def generate_places_df():
 
-    df = None
-    with SqliteDict(c.USERS_SQL) as u_dict:
-      
-        dSeries = []
-        runs = 0
-        
-        for i, u in u_dict.items():
-          try:
-              if len(u.geos) > 0:
-                  for pl_id, pl in u.geos.items():
-                      dSeries.append((pl_id, pl.full_name, pl.place_type, pl.country_code, i, pl.tweets, pl.geo))
-              if runs % 10000 == 0:
-                print(f"{runs} users' information imported.")
-              runs += 1
-          except Exception as e:
-              print(e)
-              print(i, u)
-
-        places_df = pd.DataFrame.from_dict(dSeries)
-        places_df.columns =[c.PL_ID, c.PL_NAME, c.PL_TYPE, c.C_CODE, c.U_ID, c.NUM_TWEETS, c.GEOTAG]
-        u_dict.close(force=True)
+    if storage.uses_tables():
+        return read_places_table()
+
+    # One row per user per place, unpickled in parallel (see common/user_scan.py).
+    return places_from_scan(user_scan.scan_users_table(PLACE_SCAN_FIELDS, kind=user_scan.PLACE_ROWS))
+
+
+def places_from_scan(table):
+    '''Arrow table of PLACE_SCAN_FIELDS -> places_df.'''
+    places_df = table.to_pandas()
+    places_df["tweets"] = places_df["tweets"].map(list)
+    places_df["geo"] = places_df["geo"].map({geo: json.loads(geo) for geo in places_df["geo"].unique()})
+    places_df.columns = [c.PL_ID, c.PL_NAME, c.PL_TYPE, c.C_CODE, c.U_ID, c.NUM_TWEETS, c.GEOTAG]
+
+    return places_df
+
+
+def read_places_table():
+    '''
+    Same rows as generate_places_df, from the typed tables: one per user per place,
+    w/ the list of tweets they tagged it in.
+    '''
+    with storage.Storage(readonly=True) as store:
+        rows_df = pd.read_sql_query(
+          "SELECT t.place_id, p.full_name, p.place_type, p.country_code, t.user_id, t.tweet_id "
+          "FROM user_place_tweets t JOIN places p ON p.place_id = t.place_id",
+          store.conn
+        )
+        geos = {pl_id: json.loads(geo) for pl_id, geo in store.conn.execute("SELECT place_id, geo FROM places")}
 
+    rows_df["user_id"] = rows_df["user_id"].astype(str)
+    rows_df["tweet_id"] = rows_df["tweet_id"].astype(str)
+    places_df = (
+      rows_df.groupby(["place_id", "full_name", "place_type", "country_code", "user_id"], sort=False)["tweet_id"]
+      .agg(list)
+      .reset_index()
+    )
+    places_df["geo"] = places_df["place_id"].map(geos)
+    places_df.columns = [c.PL_ID, c.PL_NAME, c.PL_TYPE, c.C_CODE, c.U_ID, c.NUM_TWEETS, c.GEOTAG]
     return places_df
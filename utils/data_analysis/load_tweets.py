@@ -1,8 +1,13 @@
+import os
 import matplotlib.pyplot as plt
-import pandas as pd
-from pyarrow import feather
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 from ..common import constants as c
+from .user_index import load_user_index, add_index_column
+from . import artifacts
 
 # DATA_VIS_TWEETS.CSV
 # For running statistics on the tweets and geotagged tweets CSV.
@@ -10,20 +15,38 @@ from ..common import constants as c
 #
 # 
 
+# Rows of TWTS_CSV, as written by download_tweets.save_tweets -- the geo column is the repr of the tweet's geo dict.
+TWEETS_CSV_SCHEMA = pa.schema([
+  (c.TW_ID, pa.int64()),
+  (c.U_ID, pa.int64()),
+  (c.CREATED_AT, pa.timestamp("ms", tz="UTC")),
+  (c.GEOS, pa.string()),
+])
+PLACE_ID_PATTERN = r"'place_id': '(?P<place_id>[^']+)'"
+# What read_tweets_csv returns -- the geo column cut down to its place_id.
+TWEETS_SCHEMA = pa.schema(list(TWEETS_CSV_SCHEMA)[:3] + [pa.field(c.PL_ID, pa.string())])
+
+
 def load_tweets_dfs():
 
-    try:
-        tweets_df = feather.read_feather(c.TWEETS_FTR)
-        geo_tweets_df = feather.read_feather(c.GEO_TWEETS_FTR)
-    except Exception as e:
-        print(f"Feather failed:\n{e}\n")
-        geo_tweets_df, tweets_df = generate_tweets_dfs()
-        feather.write_feather(tweets_df, c.TWEETS_FTR)
-        feather.write_feather(geo_tweets_df, c.GEO_TWEETS_FTR)
+    if c.TWTS_FMT == c.PARQUET_FMT:
+        # Already typed -- no need to go through the CSV or the feathers.
+        tweets_df, geo_tweets_df = read_tweets_parquet()
+    else:
+        tweets_df = artifacts.load("tweets")
+        geo_tweets_df = artifacts.load("geo_tweets")
 
     tweets_df[c.CREATED_AT] = tweets_df[c.CREATED_AT].dt.tz_convert("US/Eastern")
     geo_tweets_df[c.CREATED_AT] = geo_tweets_df[c.CREATED_AT].dt.tz_convert("US/Eastern")
     
+    return add_tweet_indices(tweets_df, geo_tweets_df)
+
+
+def add_tweet_indices(tweets_df, geo_tweets_df):
+    '''Authors' dense user indices (U_IDX), added after loading so they're never in the feathers.'''
+    index = load_user_index()
+    add_index_column(tweets_df, c.U_ID, c.U_IDX, index)
+    add_index_column(geo_tweets_df, c.U_ID, c.U_IDX, index)
     return tweets_df, geo_tweets_df
 
 
@@ -31,21 +54,63 @@ def generate_tweets_dfs():
 
     '''
     Return a tuple of form (df_geo, df_all) where the columns represent...
-    TW_ID, AUTH_ID, CREATED_AT, GEOTAG
+    TW_ID, U_ID, CREATED_AT, PL_ID
 
     ...of tweets in the CSV file.
     '''
-        
-    # Generate the GEO dataset...
-    # geo_tweets_df = pd.read_csv(c.GEO_TWTS_CSV , header=None)
-    # geo_tweets_df.columns =[c.TW_ID, c.U_ID, c.CREATED_AT, c.GEOS]
-    #geo_tweets_df[c.CREATED_AT] = pd.to_datetime(geo_tweets_df[c.CREATED_AT])       # ISO formats autodetected...
 
-    # Generate the ALL dataset...
-    tweets_df = pd.read_csv(c.TWTS_CSV, header=None)
-    tweets_df.columns =[c.TW_ID, c.U_ID, c.CREATED_AT, c.GEOS]
-    tweets_df[c.CREATED_AT] = pd.to_datetime(tweets_df[c.CREATED_AT])       # ISO formats autodetected...
+    tweets_df, geo_tweets_df = read_tweets_csv()
+    return geo_tweets_df, tweets_df
+
+
+def read_tweets_csv(path=c.TWTS_CSV):
+    '''
+    Stream the tweets CSV through pyarrow, CSV_BLOCK_BYTES at a time, w/ the types
+    given up front (int64 IDs, ISO-8601 timestamps parsed as UTC), and the geo dict
+    cut down to its place_id. Geotagged tweets are picked out of each batch as it's read,
+    so the full frame never has to be filtered afterwards.
+
+    Returns (tweets_df, geo_tweets_df), w/ the same columns as read_tweets_parquet.
+    '''
+
+    reader = pv.open_csv(
+      path,
+      read_options=pv.ReadOptions(column_names=TWEETS_CSV_SCHEMA.names, block_size=c.CSV_BLOCK_BYTES),
+      convert_options=pv.ConvertOptions(
+        column_types=TWEETS_CSV_SCHEMA,
+        timestamp_parsers=[pv.ISO8601],
+        strings_can_be_null=True,       # (no geotag -> empty field -> null)
+      ),
+    )
 
-    geo_tweets_df = tweets_df[tweets_df[c.GEOS].notna()]
+    tweet_batches, geo_batches = [], []
+    for batch in reader:
+        place_ids = pc.struct_field(pc.extract_regex(batch.column(c.GEOS), PLACE_ID_PATTERN), [0])
+        batch = pa.RecordBatch.from_arrays(
+          [batch.column(c.TW_ID), batch.column(c.U_ID), batch.column(c.CREATED_AT), place_ids], schema=TWEETS_SCHEMA
+        )
+        tweet_batches.append(batch)
+        geo_batches.append(batch.filter(pc.is_valid(place_ids)))
 
-    return geo_tweets_df, tweets_df
\ No newline at end of file
+    tweets_df = pa.Table.from_batches(tweet_batches, schema=TWEETS_SCHEMA).to_pandas(split_blocks=True, self_destruct=True)
+    geo_tweets_df = pa.Table.from_batches(geo_batches, schema=TWEETS_SCHEMA).to_pandas(split_blocks=True, self_destruct=True)
+    return tweets_df, geo_tweets_df
+
+
+def read_tweets_parquet():
+    '''
+    Read the hour-partitioned Parquet files written by download_tweets
+    (TWTS_FMT = PARQUET_FMT), returning (tweets_df, geo_tweets_df) w/ columns...
+    TW_ID, U_ID, CREATED_AT, PL_ID
+
+    ...where geotagged tweets are those with a PL_ID.
+    '''
+
+    if not os.path.isdir(c.TWTS_PARQUET_DIR):
+        raise FileNotFoundError(f"TWTS_FMT is {c.PARQUET_FMT}, but there are no tweets in {c.TWTS_PARQUET_DIR}.")
+    table = pq.read_table(c.TWTS_PARQUET_DIR, columns=[c.TW_ID, c.U_ID, c.CREATED_AT, c.PL_ID])
+    tweets_df = table.to_pandas()
+    tweets_df = tweets_df.sort_values(c.CREATED_AT, kind="stable", ignore_index=True)
+
+    geo_tweets_df = tweets_df[tweets_df[c.PL_ID].notna()]
+    return tweets_df, geo_tweets_df
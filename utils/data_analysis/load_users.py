@@ -1,63 +1,66 @@
 #!/Users/raycrist/local/bin/python3.8
 
 # data_vis_geo_users.py
-import pyarrow.feather as feather
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
-from sqlitedict import SqliteDict
 
 from ..common import constants as c
+from ..common import storage
+from ..common import user_scan
+from . import artifacts
+from .user_index import add_index_column
 
 def load_users_dfs():
-    try:
-        users_df = feather.read_feather(c.USERS_FTR)
-    except Exception as e:
-        print(f"Feather failed:\n{e}\n")
-        users_df = generate_users_dfs()
-        feather.write_feather(users_df, c.USERS_FTR)
+    users_df = artifacts.load("users")     # (rebuilt, w/ places + activity, if users.sqlite has changed)
 
+    add_index_column(users_df, c.U_ID, c.U_IDX)
     geo_users_df = users_df[users_df[c.HAS_TAG]] 
     return users_df, geo_users_df
 
-def generate_users_dfs():
-    with SqliteDict(c.USERS_SQL) as u_dict:
-
-        # Load in users:
-        dSeries = []
-        runs = 0
-        for i, u in u_dict.items():
-            try:
-                dSeries.append((
-                  i, 
-                  u.following, 
-                  u.followers, 
-                  u.tweet_count, 
-                  u.private, 
-                  u.created_at, 
-                  len(u.geos), 
-                  u.used_prior if (hasattr(u, "used_prior")) else False
-                ))
-                if runs % 100000 == 0:
-                    print(f"{runs} users imported.")
-                runs += 1
-            except Exception as e:      
-                print(f"{e} at {i}")       # Will fail when a u_dict item isn't a user.
-
-        users_df = pd.DataFrame.from_dict(dSeries)
-        users_df.columns =[c.U_ID, c.FLWNG, c.FLWRS, c.TW_COUNT, c.PRIV, c.BORN, c.LOCS, c.PRIOR_ADOPTER]
-
-        # Sort out now private users.
-        users_df = users_df[~users_df[c.PRIV]]
-
-        # Track if geotagged.
-        users_df[c.HAS_TAG] = users_df[c.LOCS].apply(lambda len_geo: len_geo > 0)
-
-        # Get birthday -- ISO formats autodetected...
-        users_df[c.BORN] = pd.to_datetime(users_df[c.BORN])
-
-        # Sometimes SQLiteDict gets stuck.
-        u_dict.close(force=True)
+USER_SCAN_FIELDS = ["user_id", "following", "followers", "tweet_count", "private", "created_at", "num_locs", "used_prior"]
+
+def generate_users_dfs(users_df=None):
+    '''Users who aren't private, w/ HAS_TAG and BORN filled in. `users_df` is the raw users, if already read.'''
+    if users_df is not None:
+        pass
+    elif storage.uses_tables():
+        users_df = read_users_table()
+    else:
+        users_df = read_users_dict()
+
+    # Sort out now private users.
+    users_df = users_df[~users_df[c.PRIV]]
+
+    # Track if geotagged.
+    users_df[c.HAS_TAG] = users_df[c.LOCS].apply(lambda len_geo: len_geo > 0)
+
+    # Get birthday -- ISO formats autodetected...
+    users_df[c.BORN] = pd.to_datetime(users_df[c.BORN])
 
     return users_df
 
+def read_users_table():
+    with storage.Storage(readonly=True) as store:
+        users_df = pd.read_sql_query(
+          "SELECT u.user_id, u.following, u.followers, u.tweet_count, u.private, u.created_at, "
+          "COUNT(DISTINCT t.place_id), COALESCE(u.used_prior, 0) "
+          "FROM users u LEFT JOIN user_place_tweets t ON t.user_id = u.user_id "
+          "GROUP BY u.user_id",
+          store.conn
+        )
+    users_df.columns = [c.U_ID, c.FLWNG, c.FLWRS, c.TW_COUNT, c.PRIV, c.BORN, c.LOCS, c.PRIOR_ADOPTER]
+    users_df[c.U_ID] = users_df[c.U_ID].astype(str)
+    users_df[c.PRIV] = users_df[c.PRIV].astype(bool)
+    users_df[c.PRIOR_ADOPTER] = users_df[c.PRIOR_ADOPTER].astype(bool)
+    return users_df
+
+def read_users_dict():
+    '''Every User in users.sqlite, unpickled in parallel (see common/user_scan.py).'''
+    return users_from_scan(user_scan.scan_users_table(USER_SCAN_FIELDS))
+
+def users_from_scan(table):
+    '''Arrow table of USER_SCAN_FIELDS -> raw users_df.'''
+    users_df = table.to_pandas()
+    users_df.columns = [c.U_ID, c.FLWNG, c.FLWRS, c.TW_COUNT, c.PRIV, c.BORN, c.LOCS, c.PRIOR_ADOPTER]
+    return users_df
@@ -0,0 +1,197 @@
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from pyarrow import feather
+
+from ..common import constants as c
+from . import artifacts
+from .load_datasets import load_subdivs_gdf
+
+'''
+Assigns points -- users' locations, places, police killings -- to Census county
+subdivisions, w/o re-reading + re-projecting the COUSUB shapefile and spatially
+joining against all of it every session.
+
+  - The subdivisions come from load_datasets.py (read once, projected to epsg:2163),
+    w/ an STRtree over them built once per process.
+  - A point's subdivision is the one it's in, or else the nearest within SUBDIV_MAX_DIST
+    meters (as sjoin_nearest(max_distance=...) did); UNASSIGNED if there isn't one.
+  - Each place's subdivision (from its bbox center, the same point a user's location is
+    taken from) is kept in PLACE_FIPS_FTR, place_id -> Geo_FIPS. Places are only ever added,
+    so locating new users is a lookup, plus a tree query for places not seen before.
+    The table's cleared if the subdivisions are rebuilt after it.
+'''
+
+UNASSIGNED = -1
+
+_index = None       # the SubdivIndex, built once per process.
+
+
+class SubdivIndex:
+
+    def __init__(self, subdivs_gdf):
+        self.fips = subdivs_gdf[c.GEO_FIPS].to_numpy(dtype=np.int64)
+        self.names = subdivs_gdf[c.GEO_QNAME].to_numpy()
+        self.tree = shapely.STRtree(np.asarray(subdivs_gdf.geometry.array))
+
+    def __len__(self):
+        return len(self.fips)
+
+    def nearest(self, xs, ys, max_distance=c.SUBDIV_MAX_DIST):
+        '''
+        Row (in the subdivisions) of the subdivision each epsg:2163 point is in, or
+        the nearest one within max_distance meters; UNASSIGNED otherwise (or if the point's NaN).
+        '''
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        rows = np.full(len(xs), UNASSIGNED, dtype=np.int64)
+        valid = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+        if len(valid) == 0 or len(self) == 0:
+            return rows
+        point_i, subdiv_i = self.tree.query_nearest(shapely.points(xs[valid], ys[valid]), max_distance=max_distance)
+        rows[valid[point_i]] = subdiv_i
+        return rows
+
+    def intersecting(self, xs, ys):
+        '''
+        (points, rows): every (point, subdivision) pair where the epsg:2163 point lies in / on the subdivision,
+        as sjoin(predicate="intersects") -- a point on a shared border counts for both.
+        '''
+        xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        valid = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+        point_i, subdiv_i = self.tree.query(shapely.points(xs[valid], ys[valid]), predicate="intersects")
+        return valid[point_i], subdiv_i
+
+    def to_fips(self, rows):
+        '''Rows -> Geo_FIPS (int64), UNASSIGNED rows staying UNASSIGNED.'''
+        rows = np.asarray(rows)
+        return np.where(rows == UNASSIGNED, UNASSIGNED, self.fips[rows])
+
+
+def load_subdiv_index():
+    global _index
+    if _index is None:
+        _index = SubdivIndex(load_subdivs_gdf())
+    return _index
+
+
+# --- Place -> subdivision table ---
+
+class PlaceFips:
+
+    def __init__(self, path=c.PLACE_FIPS_FTR):
+        self.path = path
+        if os.path.exists(path) and not self.is_stale():
+            fips_df = feather.read_feather(path)
+            self.pl_ids = fips_df[c.PL_ID].to_numpy(dtype=object)
+            self.fips = fips_df[c.GEO_FIPS].to_numpy(dtype=np.int64)
+        else:
+            self.pl_ids = np.empty(0, dtype=object)
+            self.fips = np.empty(0, dtype=np.int64)
+        self.positions = pd.Index(self.pl_ids)
+
+    def is_stale(self):
+        return os.path.exists(c.SUBDIVS_PARQUET) and os.path.getmtime(c.SUBDIVS_PARQUET) > os.path.getmtime(self.path)
+
+    def __len__(self):
+        return len(self.pl_ids)
+
+    def lookup(self, pl_ids):
+        '''
+        (fips, unknown): Geo_FIPS of each of pl_ids (UNASSIGNED if it's in no subdivision),
+        + a mask of the places not in the table yet (whose fips are UNASSIGNED for now).
+        '''
+        pos = self.positions.get_indexer(np.asarray(pl_ids, dtype=object))
+        unknown = pos == -1
+        fips = np.full(len(pos), UNASSIGNED, dtype=np.int64)
+        fips[~unknown] = self.fips[pos[~unknown]]
+        return fips, unknown
+
+    def intern(self, pl_ids, xs, ys, index=None):
+        '''
+        Geo_FIPS of each of pl_ids, whose centers are at epsg:2163 (xs, ys); any places
+        not seen before are assigned (nearest, w/in SUBDIV_MAX_DIST) and saved.
+        '''
+        pl_ids = np.asarray(pl_ids, dtype=object)
+        fips, unknown = self.lookup(pl_ids)
+        if not unknown.any():
+            return fips
+
+        new_ids, first = np.unique(pl_ids[unknown], return_index=True)
+        new_rows = np.flatnonzero(unknown)[first]
+        index = index if index is not None else load_subdiv_index()
+        new_fips = index.to_fips(index.nearest(np.asarray(xs)[new_rows], np.asarray(ys)[new_rows]))
+
+        self.pl_ids = np.concatenate([self.pl_ids, new_ids])
+        self.fips = np.concatenate([self.fips, new_fips])
+        self.positions = pd.Index(self.pl_ids)
+        self.save()
+        print(f"Assigned {len(new_ids)} places to county subdivisions ({len(self)} total).")
+        return self.lookup(pl_ids)[0]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        feather.write_feather(pd.DataFrame({c.PL_ID: self.pl_ids, c.GEO_FIPS: self.fips}), tmp_path)
+        os.replace(tmp_path, self.path)
+
+
+def load_place_fips():
+    load_subdiv_index()     # (rebuilding the subdivisions first, if need be, so a stale table is cleared now)
+    return PlaceFips()
+
+
+def place_fips(places_df):
+    '''
+    Geo_FIPS of the place on each row of places_df (load_places_df). Admin + country
+    places (states, the US) are too big to pin to a subdivision, so they're UNASSIGNED.
+    '''
+    from .load_locations import place_centroids
+
+    table = load_place_fips()
+    fips, unknown = table.lookup(places_df[c.PL_ID])
+    if unknown.any():
+        new_df = places_df.loc[unknown]
+        pl_codes, pl_ids, xs, ys = place_centroids(new_df)
+        too_big = new_df[c.PL_TYPE].isin([c.PL_ADMIN, c.PL_COUNTRY]).to_numpy()
+        xs, ys = xs[pl_codes], ys[pl_codes]
+        xs[too_big] = np.nan        # (NaN -> UNASSIGNED)
+        fips[unknown] = table.intern(new_df[c.PL_ID], xs, ys)
+    return fips
+
+
+def add_fips_column(locs_gdf):
+    '''
+    Add Geo_FIPS to locs_gdf (load_locations_gdf): the subdivision each user's location is in,
+    or the nearest w/in SUBDIV_MAX_DIST meters -- UNASSIGNED if none.
+    Users are located through their mode place (MODE_PL_ID), w/o touching a geometry:
+    places not in the table yet are assigned from their own bbox centers, in the places feather.
+    '''
+    from .load_locations import place_centroids
+
+    mode_pl_ids = locs_gdf[c.MODE_PL_ID].to_numpy(dtype=object)
+    table = load_place_fips()
+    fips, unknown = table.lookup(mode_pl_ids)
+    if unknown.any():
+        places_df = artifacts.load("places", columns=[c.PL_ID, c.GEOTAG])
+        places_df = places_df.loc[places_df[c.PL_ID].isin(mode_pl_ids[unknown])]
+        _, pl_ids, xs, ys = place_centroids(places_df)
+        table.intern(pl_ids, xs, ys)
+        fips[unknown] = table.lookup(mode_pl_ids[unknown])[0]
+    locs_gdf[c.GEO_FIPS] = fips
+    return locs_gdf
+
+
+def points_per_subdiv(lons, lats, count_col):
+    '''
+    Number of (lon, lat) points in each county subdivision, as a dataframe of
+    Geo_FIPS + count_col (subdivisions w/ no points are left out).
+    '''
+    from ..common.geo_helpers import reproject
+
+    index = load_subdiv_index()
+    xs, ys = reproject(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    _, rows = index.intersecting(xs, ys)
+    counts = np.bincount(rows, minlength=len(index))
+    hit = np.flatnonzero(counts)
+    return pd.DataFrame({c.GEO_FIPS: index.fips[hit], count_col: counts[hit]})
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+
+from ..common import constants as c
+
+'''
+A persisted dictionary from Twitter user IDs to dense int32 indices (0, 1, 2, ...),
+shared by every loader, so users, edges, tweets and places can all be joined on
+one small integer column -- and graph / simulation code can index NumPy arrays
+by user instead of keeping dicts keyed by ID strings.
+
+The IDs live in USER_INDEX_NPY as one int64 array: a user's index is their
+position in it. New IDs are only ever appended, so an index never changes once
+it's handed out, and a feather written last week still lines up with today's.
+'''
+
+MAX_USERS = 2**31 - 1       # int32 indices.
+UNKNOWN = -1
+
+
+def to_int64(u_ids):
+    '''Twitter IDs as decimal strings or ints -> int64 array.'''
+    return np.asarray(u_ids).astype(np.int64)
+
+
+class UserIndex:
+
+    def __init__(self, path=c.USER_INDEX_NPY):
+        self.path = path
+        if os.path.exists(path):
+            self.ids = np.load(path)
+        else:
+            self.ids = np.empty(0, dtype=np.int64)
+        self.sort()
+
+    def sort(self):
+        self.order = np.argsort(self.ids, kind="stable").astype(np.int32)
+        self.sorted_ids = self.ids[self.order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, u_ids):
+        '''Index of each of u_ids (int32), or UNKNOWN for IDs not in the dictionary.'''
+        u_ids = to_int64(u_ids)
+        idx = np.full(len(u_ids), UNKNOWN, dtype=np.int32)
+        if len(self.sorted_ids) == 0:
+            return idx
+        pos = np.searchsorted(self.sorted_ids, u_ids)
+        pos[pos == len(self.sorted_ids)] = 0
+        hit = self.sorted_ids[pos] == u_ids
+        idx[hit] = self.order[pos[hit]]
+        return idx
+
+    def intern(self, u_ids):
+        '''Index of each of u_ids, adding (and saving) any IDs not seen before.'''
+        u_ids = to_int64(u_ids)
+        idx = self.lookup(u_ids)
+        new_ids = np.unique(u_ids[idx == UNKNOWN])
+        if len(new_ids) == 0:
+            return idx
+
+        if len(self.ids) + len(new_ids) > MAX_USERS:
+            raise OverflowError(f"More than {MAX_USERS} users; indices no longer fit in int32.")
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.save()
+        self.sort()
+        print(f"Added {len(new_ids)} users to the user index ({len(self.ids)} total).")
+        return self.lookup(u_ids)
+
+    def to_ids(self, idx):
+        '''Indices -> Twitter IDs (int64).'''
+        return self.ids[np.asarray(idx)]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npy"
+        np.save(tmp_path, self.ids)
+        os.replace(tmp_path, self.path)      # (never leaves a half-written index behind)
+
+
+def load_user_index():
+    return UserIndex()
+
+
+def add_index_column(df, id_col, idx_col, index=None):
+    '''
+    Add `idx_col` to df: the dense index of each ID in `id_col`.
+    Done after a loader reads / writes its feather, so the feathers themselves don't depend on the index.
+    '''
+    index = index if index is not None else load_user_index()
+    df[idx_col] = index.intern(df[id_col].to_numpy())
+    return df
@@ -0,0 +1,336 @@
+import asyncio
+import datetime
+import traceback
+from sqlitedict import SqliteDict
+
+from ..common import activity_store
+from ..common import storage
+from ..common.telemetry import TELEMETRY
+from ..common import twitter_helpers as tw
+from ..common import constants as c
+from . import download_users, download_geos, download_friends, download_activity
+
+# -----------------------------------------------------------
+# collect_all.py
+#
+# Runs the users, geos, friends and activity downloads side by side,
+# instead of one `make` target after another. Each endpoint has its own
+# rate-limit budget (and its own TokenBucket in twitter_helpers), so a full
+# collection only takes as long as the slowest endpoint.
+#
+# Stages hand IDs to each other through queues:
+#   users   -> geos, friends    (geotagged authors, as soon as their User is saved)
+#   geos    -> activity         (once their places have been saved)
+#
+# Each stage runs its (blocking) download + save calls in a worker thread.
+# Stages write to the same users.sqlite, but every write is committed right away,
+# so SQLite's own locking keeps them from stepping on each other.
+#
+# -----------------------------------------------------------
+
+STOP = None             # queue sentinel: no more IDs coming.
+STDIN_POLL_PD = 1       # secs between checks for user interrupt.
+MAX_STAGE_ERRS = 2      # consecutive errors before a stage gives up (same as the sequential scripts).
+BATCH_WAIT_PD = 30      # secs a batched stage waits to fill its query before sending a partial one.
+
+
+def log_stage(stage, msg):
+    print(f"[{stage}] {msg}, {datetime.datetime.now()}")
+
+
+def log_stage_err(stage, e):
+    print(
+      f"{c.SEPERATOR}\n"
+      f"[{stage}] Error at time {datetime.datetime.now()}\n"
+      f"{e}\n"
+      f"{traceback.format_exc()}\n"
+      f"{c.SEPERATOR}\n"
+    )
+
+
+def load_geo_authors():
+    """Set of authors in the geotagged tweets CSV -- the only users the later stages run on."""
+    authors = set()
+    with open(c.GEO_TWTS_CSV) as geo_tweets:
+        for tw_row in geo_tweets:
+            if len(tw_row) > 1:
+                authors.add(tw_row.split(',', 4)[1])
+    return authors
+
+
+def read_user_batch(tweets, size, seen=frozenset()):
+    """
+    Read tweet lines until `size` unique authors not in `seen` are found (or EOF).
+    Returns (author_ids, lines_read, offset_after, reached_end).
+    """
+    users_to_download = set()
+    lines_read = 0
+    while len(users_to_download) < size:
+        tw_row = tweets.readline()
+        if not tw_row or len(tw_row) <= 1:
+            return users_to_download, lines_read, tweets.tell(), True
+        lines_read += 1
+        author_id = tw_row.split(',', 4)[1]
+        if author_id not in seen:
+            users_to_download.add(author_id)
+    return users_to_download, lines_read, tweets.tell(), False
+
+
+def load_saved_ids():
+    """IDs of every user already in the users store (plus, on SqliteDict, its checkpoint keys -- harmless here)."""
+    if storage.uses_tables():
+        with storage.Storage() as store:
+            return set(store.user_ids())
+    with SqliteDict(c.USERS_SQL) as users_dict:
+        return set(users_dict.keys())
+
+
+def seed_saved_users(geo_authors):
+    """
+    Split the geo authors into those already in the users dict (from an earlier run),
+    and work out which of those still need their geos downloaded.
+    """
+    saved, need_geos = [], []
+    if storage.uses_tables():
+        with storage.Storage() as store:
+            saved_ids = store.user_ids()
+            geo_ids = store.user_ids(geotagged=True)
+        saved = [u_id for u_id in geo_authors if u_id in saved_ids]
+        need_geos = [u_id for u_id in saved if u_id not in geo_ids]
+        return saved, need_geos
+
+    with SqliteDict(c.USERS_SQL) as users_dict:
+        for author_id in geo_authors:
+            user = users_dict.get(author_id)
+            if user is not None:
+                saved.append(author_id)
+                if len(user.geos) == 0:
+                    need_geos.append(author_id)
+    return saved, need_geos
+
+
+def needs_activity(u_id):
+    if storage.uses_tables():
+        with storage.Storage() as store:
+            return store.has_places(u_id)     # (the activity stage checks the activity store itself)
+    with SqliteDict(c.USERS_SQL) as users_dict:
+        user = users_dict.get(u_id)
+    return (user is not None) and (len(user.geos) > 0) and (len(user.activity_rate) == 0)
+
+
+def load_friends_done():
+    with download_friends.open_friends() as store:
+        return download_friends.saved_authors(store)
+
+
+async def drain(queue, size):
+    """
+    Wait for up to `size` IDs from a queue, so batched queries stay full. Once we have
+    at least one, give up waiting for the rest after BATCH_WAIT_PD. Returns (ids, got_stop).
+    """
+    ids = []
+    while len(ids) < size:
+        try:
+            u_id = await asyncio.wait_for(queue.get(), BATCH_WAIT_PD if ids else None)
+        except asyncio.TimeoutError:
+            break
+        if u_id is STOP:
+            return ids, True
+        ids.append(u_id)
+    return ids, False
+
+
+async def forward(queues, ids):
+    for queue in queues:
+        for u_id in ids:
+            await queue.put(u_id)
+
+
+async def close(queues):
+    for queue in queues:
+        await queue.put(STOP)
+
+
+async def watch_stdin(stop):
+    """Set `stop` once the user types anything (same 'any key + enter' interrupt as the scripts)."""
+    while not stop.is_set():
+        if tw.stdin_has_line():
+            print("Interrupt received; stages will finish their current batch and stop.")
+            stop.set()
+        await asyncio.sleep(STDIN_POLL_PD)
+
+
+async def users_stage(stop, geo_authors, seen, out_queues):
+    """
+    Download + save the authors in the tweets CSV. Authors in `seen` (already saved, or
+    requested earlier this run) are skipped: saving them again would replace their User --
+    and any geos / activity saved on it -- w/ a fresh one, and send them to geos again.
+    """
+    errs = 0
+    with open(download_users.TWTS_CSV) as tweets:
+        with storage.checkpoints_for(download_users.USERS_DICT) as checkpoints:
+            log_stage("users", f"Beginning download at line {checkpoints.get(c.LAST_LINE, 0)}")
+            tw.advance_to_checkpoint(tweets, checkpoints, c.LAST_OFFSET, c.LAST_LINE)
+            TELEMETRY.track_input("users", download_users.TWTS_CSV, checkpoints.get(c.LAST_LINE, 0), tweets.tell())
+
+        reached_end = False
+        u_ids = set()
+        runs = 0
+        while not stop.is_set():
+            if not u_ids:
+                # Only move on to the next batch once the last one is saved, so the line count stays right.
+                if reached_end:
+                    break
+                u_ids, lines_read, offset, reached_end = await asyncio.to_thread(read_user_batch, tweets, 100, seen)
+                if not u_ids and lines_read:
+                    # (nothing new in the last lines; just move the checkpoint past them)
+                    await asyncio.to_thread(download_users.save_users, [], lines_read, offset)
+                continue
+            try:
+                user_objs = await asyncio.to_thread(download_users.download_users, u_ids)
+                await asyncio.to_thread(download_users.save_users, user_objs, lines_read, offset)
+                seen.update(u_ids)      # (incl. any Twitter didn't return, so they aren't requested again)
+                await forward(out_queues, [u.user_id for u in user_objs if u.user_id in geo_authors])
+                u_ids = set()
+                runs += 1
+                if runs % download_users.PRINT_X_RUNS == 0:
+                    log_stage("users", f"{runs} runs complete this round")
+                errs = 0
+            except Exception as e:
+                log_stage_err("users", e)
+                errs += 1
+                TELEMETRY.retry("users")
+                if errs >= MAX_STAGE_ERRS:
+                    break
+                await asyncio.sleep(c.ERR_WAIT_PD)
+
+    log_stage("users", "Done")
+    await close(out_queues)
+
+
+async def geos_stage(stop, in_queue, out_queues):
+    errs = 0
+    processed = 0
+    got_stop = False
+    while not got_stop and not stop.is_set():
+        u_ids, got_stop = await drain(in_queue, c.GEOS_MAX_USERS_PER_QUERY)
+        if not u_ids:
+            continue
+        try:
+            await asyncio.to_thread(download_geos.download_geos, u_ids)
+            await forward(out_queues, u_ids)
+            processed += len(u_ids)
+            if processed % 500 < len(u_ids):
+                log_stage("geos", f"Processed {processed} users")
+            errs = 0
+        except Exception as e:
+            log_stage_err("geos", e)
+            errs += 1
+            TELEMETRY.retry("geos")
+            if errs >= MAX_STAGE_ERRS:
+                break
+            await asyncio.sleep(c.ERR_WAIT_PD)
+
+    log_stage("geos", f"Done. Processed {processed} users")
+    await close(out_queues)
+
+
+async def friends_stage(stop, in_queue):
+    errs = 0
+    runs = 0
+    done = await asyncio.to_thread(load_friends_done)
+    while not stop.is_set():
+        author_id = await in_queue.get()
+        if author_id is STOP:
+            break
+        if author_id in done:
+            continue
+        try:
+            friends = await asyncio.to_thread(download_friends.download_friends, author_id)
+            await asyncio.to_thread(download_friends.save_friends, author_id, friends)
+            TELEMETRY.record("friends")
+            done.add(author_id)
+            runs += 1
+            if runs % download_friends.PRINT_X_USERS == 0:
+                log_stage("friends", f"Saved {runs} users this round")
+            errs = 0
+        except tw.TwitterUnauthException as e:
+            await asyncio.to_thread(download_friends.save_friends, author_id, [c.FRIENDS_UNAUTH])
+            done.add(author_id)
+            log_stage("friends", f"{e} Unauth at uId={author_id}. Skipping")
+        except tw.Twitter404Exception as e:
+            await asyncio.to_thread(download_friends.save_friends, author_id, [c.FRIENDS_404])
+            done.add(author_id)
+            log_stage("friends", f"{e} 404 at uId={author_id}. Skipping")
+        except Exception as e:
+            log_stage_err("friends", e)
+            errs += 1
+            TELEMETRY.retry("friends")
+            if errs >= MAX_STAGE_ERRS:
+                break
+            await asyncio.sleep(c.ERR_WAIT_PD)
+
+    log_stage("friends", f"Done. Saved {runs} users")
+
+
+async def activity_stage(stop, in_queue):
+    errs = 0
+    runs = 0
+    store = activity_store.ActivityStore()
+    done = store.saved_ids()
+    while not stop.is_set():
+        u_id = await in_queue.get()
+        if u_id is STOP:
+            break
+        if u_id in done or not await asyncio.to_thread(needs_activity, u_id):
+            continue
+        try:
+            activity_rate = await asyncio.to_thread(download_activity.download_activity, u_id)
+            if activity_rate is not None:
+                store.append(u_id, activity_rate)
+                store.flush()
+                TELEMETRY.record("activity")
+                done.add(u_id)
+                runs += 1
+                if runs % 1000 == 0:
+                    log_stage("activity", f"Processed {runs} users")
+            errs = 0
+        except Exception as e:
+            log_stage_err("activity", e)
+            errs += 1
+            TELEMETRY.retry("activity")
+            if errs >= MAX_STAGE_ERRS:
+                break
+            await asyncio.sleep(c.ERR_WAIT_PD)
+
+    store.close()
+    log_stage("activity", f"Done. Processed {runs} users")
+
+
+async def collect():
+    download_users.check_tweets_format()
+    stop = asyncio.Event()
+    geos_q, friends_q, activity_q = asyncio.Queue(), asyncio.Queue(), asyncio.Queue()
+
+    # Users saved by an earlier run won't come out of the users stage again,
+    # so hand them straight to the later stages.
+    geo_authors = await asyncio.to_thread(load_geo_authors)
+    saved, need_geos = await asyncio.to_thread(seed_saved_users, geo_authors)
+    seen = await asyncio.to_thread(load_saved_ids)
+    await forward([friends_q, activity_q], saved)
+    await forward([geos_q], need_geos)
+    log_stage("collect", f"{len(geo_authors)} geo authors, {len(saved)} already saved, {len(need_geos)} need geos")
+
+    watcher = asyncio.create_task(watch_stdin(stop))
+    await asyncio.gather(
+      users_stage(stop, geo_authors, seen, [geos_q, friends_q]),
+      geos_stage(stop, geos_q, [activity_q]),
+      friends_stage(stop, friends_q),
+      activity_stage(stop, activity_q),
+    )
+    stop.set()
+    await watcher
+
+
+def run():
+    asyncio.run(collect())
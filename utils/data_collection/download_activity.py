@@ -5,17 +5,19 @@ from dotenv import load_dotenv
 import datetime
 import traceback
 import time
-from sqlitedict import SqliteDict
 
+from ..common import activity_store
+from ..common import storage
+from ..common.telemetry import TELEMETRY
 from ..common import twitter_helpers as tw
 from ..common import constants as c
 
 # -----------------------------------------------------------
 # download_activity.py
 #
-# Save to User object the list of tweets per hour for each user.
-# Need to know for simulations how often users post on Twitter
-# to calculate activity rate. 
+# Save to the activity store (common/activity_store.py) the list of tweets
+# per hour for each user. Need to know for simulations how often users post
+# on Twitter to calculate activity rate. 
 #
 # -----------------------------------------------------------
 
@@ -24,42 +26,105 @@ query_params = {
   'end_time': '2020-06-03T00:00:00Z',
 }
 
+def download_activity(u_id):
+    """
+    Get the list of tweet counts per hour (oldest to newest) for a single user.
+    Returns None if Twitter has no data for them.
+    """
+    params = dict(query_params, query=f"-is:nullcast from:{u_id}")
+    json_response = tw.connect_to_endpoint(c.COUNT_ENDPOINT, params)
+    if "data" not in json_response:
+        print(f"No data for {u_id}, json: {json_response}")
+        return None
+    return [time_pd["tweet_count"] for time_pd in json_response["data"]]
+
+
+def load_scan_rowid():
+    if storage.uses_tables():
+        with storage.Storage() as store:
+            return store.checkpoints.get(c.ACTIVITY_SCAN_KEY, 0)
+    if os.path.exists(c.ACTIVITY_SCAN_ROWID):
+        with open(c.ACTIVITY_SCAN_ROWID) as f:
+            return int(f.read().strip() or 0)
+    return 0
+
+
+def save_scan_rowid(rowid):
+    if storage.uses_tables():
+        with storage.Storage() as store:
+            store.checkpoints[c.ACTIVITY_SCAN_KEY] = rowid
+            store.commit()
+        return
+    with open(c.ACTIVITY_SCAN_ROWID, "w") as f:
+        print(rowid, file=f)
+
+
+def iter_candidates(start_rowid, done):
+    """
+    Stream the users whose activity rate still needs downloading: geotagged users
+    not already in the activity store (or w/ one saved on their User, from before the store).
+    Yields (rowid, u_id). (In the typed tables, a user's rowid is their ID.)
+    """
+    if storage.uses_tables():
+        with storage.Storage(readonly=True) as store:
+            for u_id in store.geo_user_ids_after(start_rowid):
+                if str(u_id) not in done:
+                    yield u_id, str(u_id)
+        return
+
+    j = 0
+    for rowid, u_id, user in activity_store.iter_users(start_rowid):
+        # if the item is a User object, a geotagged user, and has not had activity rate downloaded yet, 
+        # then add to queue.
+        if (hasattr(user, "geos")) and (len(user.geos) > 0) and (len(user.activity_rate) == 0) and (u_id not in done):
+            yield rowid, u_id
+        j += 1
+        if (j % 1000000 == 0):
+            print(f"Scanned {j} users, {datetime.datetime.now()}")
+
+
+def last_rowid():
+    """The last rowid iter_candidates will reach (in the typed tables, the largest user ID) -- for the ETA."""
+    if storage.uses_tables():
+        with storage.Storage(readonly=True) as store:
+            return store.last_user_id()
+    return activity_store.last_user_rowid()
+
+
 def run():
 
-    # Go through all users,
-    # and create a dictionary of users whose activity rate must be downloaded 
-    with SqliteDict(c.USERS_SQL) as users_dict:
-
-        to_add = dict()
-        j = 0
-        for u_id, user in users_dict.items(): 
-            # if the item is a User object, a geotagged user, and has not had activity rate downloaded yet, 
-            # then add to queue.
-            if (not isinstance(user, int)) and (len(user.geos) > 0) and (len(user.activity_rate) == 0):
-                to_add[u_id] = user
-            j += 1
-            if (j % 1000000 == 0):
-                print(f"Loaded {j} users, {datetime.datetime.now()}")
-
-        print(f"Loaded in To Add: {len(to_add)}, {datetime.datetime.now()}")
-
-        # For each user, conduct a query just for their tweets,
-        # and save the list of tweet counts for time period (oldest to newest)
+    # Go through all users (from where the last run left off), 
+    # and for each one whose activity rate must be downloaded, conduct a query just for their tweets,
+    # and save the list of tweet counts for time period (oldest to newest)
+    start_rowid = load_scan_rowid()
+    print(f"Resuming scan after rowid {start_rowid}, {datetime.datetime.now()}")
+
+    # (the number of users left isn't known w/o a scan of its own, so the ETA goes by how far through the rowids we are.)
+    TELEMETRY.track_total("activity", last_rowid(), start_rowid)
+
+    with activity_store.ActivityStore() as store:
+        done = store.saved_ids()
         i = 0
-        for u_id, user in to_add.items():
+        # Once a user fails or comes back w/o data, stop moving the checkpoint, so the next run retries them
+        # (as before the checkpoint, users are only skipped once their counts are saved).
+        had_err = False
+        for rowid, u_id in iter_candidates(start_rowid, done):
+            if tw.stdin_has_line():
+                print("Interrupted.")
+                break
             try:
-                query_params["query"] = f"-is:nullcast from:{u_id}"
-                json_response = tw.connect_to_endpoint(c.COUNT_ENDPOINT, query_params)
-                if "data" in json_response:
-                    user.activity_rate = [time_pd["tweet_count"] for time_pd in json_response["data"]]
-                    users_dict[u_id] = user
+                activity_rate = download_activity(u_id)
+                if activity_rate is not None:
+                    store.append(u_id, activity_rate)
+                    TELEMETRY.record("activity")
                     i += 1
                     if (i % 1000 == 0):
                         print(f"Processed {i} users, {datetime.datetime.now()}")
-                        users_dict.commit() 
+                        store.flush()
+                        if not had_err:
+                            save_scan_rowid(rowid)
                 else:
-                    print(f"No data for {u_id}, json: {json_response}")
-                time.sleep(c.COUNT_WAIT_PD) 
+                    had_err = True
             except Exception as e:
                 print(
                   f"Error at time {datetime.datetime.now()}"
@@ -68,8 +133,14 @@ def run():
                   f"{traceback.format_exc()}\n"
                   f"{c.SEPERATOR}\n"
                 )
-                users_dict.commit()
+                store.flush()
+                had_err = True
                 time.sleep(c.ERR_WAIT_PD)
-                print("Committed!")
+                print("Saved!")
+            if not had_err:
+                start_rowid = rowid
+            TELEMETRY.progress("activity", rowid)
 
-                
+        store.flush()
+        save_scan_rowid(start_rowid)
+        print(f"Processed {i} users this run.")
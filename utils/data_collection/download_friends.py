@@ -5,6 +5,9 @@ import time
 
 from ..common import twitter_helpers as tw
 from ..common import constants as c
+from ..common import storage
+from ..common import friends_store
+from ..common.telemetry import TELEMETRY
 
 # -----------------------------------------------------------
 # download_friends.py
@@ -16,9 +19,7 @@ from ..common import constants as c
 # -----------------------------------------------------------
 
 PRINT_X_USERS = 30
-
-last_req_time = time.time()   # global variable to track last JSON request.
-hit_first_author = False      # global variable to let us know when we've started.
+COMMIT_X_USERS = 10     # how many users to save between commits.
 
 TWTS_CSV = c.GEO_TWTS_CSV # modify as needed. In my case, I only downloaded rich data for geotagged users.
 
@@ -31,11 +32,11 @@ def log_run_start(count):
     )
 
 
-def log_run_end(count, lines):
+def log_run_end(count, pending):
     """Announce state of progress at end of run."""
     print(
       f"Ending run. Users saved = {count}.\n"
-      f"{lines} processed.\n"
+      f"{pending} users still to download.\n"
       f"{c.SEPERATOR}\n"
     )
 
@@ -47,15 +48,10 @@ def download_friends(author_id):
       Load the next page if necessary.
     Returns list of followers. 
     """
-    global last_req_time    # Will update the last_req_time at end.
-
     params = {"user_id": author_id, "stringify_ids": True, "cursor": "-1"}
     friends = []
 
     while params['cursor'] != "0":
-        time.sleep(tw.calc_wait_time(c.FRIENDS_WAIT_PD, last_req_time)) 
-        last_req_time = time.time()
-
         json_resp = tw.connect_to_endpoint(c.FRIENDS_ENDPOINT, params)
         params['cursor'] = json_resp['next_cursor_str']
         for fr_id in json_resp['ids']:
@@ -64,71 +60,110 @@ def download_friends(author_id):
     return friends
 
 
+def open_friends():
+    """
+    The friends store for the configured STORAGE_BACKEND / FRIENDS_FMT: the typed tables,
+    the packed friends store, or the friends SqliteDict.
+    """
+    if storage.uses_tables():
+        return storage.Storage()
+    if friends_store.uses_packed():
+        return friends_store.FriendsStore()
+    return SqliteDict(c.FRIENDS_SQL)
+
+
+def is_pickled(store):
+    return isinstance(store, SqliteDict)
+
+
+def saved_authors(store):
+    """Users whose friends are already saved. (Keys only -- no need to unpickle anyone's friends list.)"""
+    if is_pickled(store):
+        return {key for key in store.keys() if key.isdigit()}     # (not LAST_LINE, or other checkpoints)
+    return store.friends_done()
+
+
+def write_friends(store, author_id, friends):
+    """Write (without committing) a user's friends, or [FRIENDS_UNAUTH] / [FRIENDS_404]."""
+    if is_pickled(store):
+        store[author_id] = friends
+    else:
+        store.save_friends(author_id, friends)
+
+
 def save_friends(author_id, friends):
-    with SqliteDict(c.FRIENDS_SQL) as friends_dict:
-        friends_dict[author_id] = friends
-        friends_dict[c.LAST_LINE] = friends_dict[c.LAST_LINE] + 1
-        friends_dict.commit()
+    """Save (and commit) a single user's friends. run() batches its own commits instead."""
+    with open_friends() as store:
+        write_friends(store, author_id, friends)
+        store.commit()
 
 
-def run():
-  
+def load_pending_authors(done):
+    """
+    One pass over TWTS_CSV, returning each author not yet in `done`, once,
+    in the order they first appear.
+    """
+    pending = []
+    seen = set(done)
     with open(TWTS_CSV) as tweets:
+        for tw_row in tweets:
+            if len(tw_row) <= 1:
+                continue
+            author_id = tw_row.split(',', 4)[1]      # tRow = "id,author_id,created_at,geo"
+            if author_id not in seen:
+                seen.add(author_id)
+                pending.append(author_id)
+    return pending
+
 
-        with SqliteDict(c.FRIENDS_SQL) as friends_dict:
-            log_run_start(len(friends_dict))
-            friends_dict[c.LAST_LINE] = friends_dict.get(c.LAST_LINE, 0)
-            friends_dict[c.LAST_LINE] = 0 # un-comment this line to reset
-            friends_dict.commit()
-            tw.advance_to_line(tweets, friends_dict[c.LAST_LINE])
+def run():
+
+    with open_friends() as friends_dict:
+
+        done = saved_authors(friends_dict)
+        log_run_start(len(done))
+        pending = load_pending_authors(done)
+        print(f"{len(pending)} users to download.")
+        TELEMETRY.track_total("friends", len(pending))
 
         last_run_had_err = False
         runs = 0
+        uncommitted = 0
+        i = 0
 
-        while not tw.stdin_has_line():        # while the user hasn't interrupted
-            tw_row = tweets.readline()        # read another line, until EOF
-            if not tw_row or len(tw_row) <= 1:
-                print("END OF FILE! Done.")
-                break
-            tweet = tw_row.split(',', 4)      # tRow = "id,author_id,created_at,geo"
-            author_id = tweet[1]
+        while i < len(pending) and not tw.stdin_has_line():        # while the user hasn't interrupted
+            author_id = pending[i]
+            friends = None
 
             try:
-                with SqliteDict(c.FRIENDS_SQL) as friends_dict:
-                    author_saved_before = (author_id in friends_dict)
-
-                if not author_saved_before:
-                    # Save progress
-                    friends = download_friends(author_id)
-                    save_friends(author_id, friends)
-                    # Log progress
-                    runs += 1
-                    if runs % PRINT_X_USERS == 0:
-                        print(f"Saved {runs} users this round.")
-                
+                friends = download_friends(author_id)
+                # Log progress
+                runs += 1
+                if runs % PRINT_X_USERS == 0:
+                    print(f"Saved {runs} users this round.")
                 last_run_had_err = False # Update errors.
 
             except tw.TwitterUnauthException as e:
-                if not author_saved_before:
-                    save_friends(author_id, [-1])
+                friends = [c.FRIENDS_UNAUTH]
                 print(f"{e}\n...Unauth at uId={author_id}. Skipping.")
-                time.sleep(tw.calc_wait_time(c.FRIENDS_WAIT_PD, last_req_time)) 
 
             except tw.Twitter404Exception as e:
-                if not author_saved_before:
-                    save_friends(author_id, [-2])
+                friends = [c.FRIENDS_404]
                 print(f"{e}\n...404 at uId={author_id}. Skipping.")
-                time.sleep(tw.calc_wait_time(c.FRIENDS_WAIT_PD, last_req_time)) 
 
             except tw.TwitterAPIException as e:
                 print(
                   f"Download error at user: {author_id}\n"
                   f"{c.SEPERATOR}\n\n"
                 )
+                friends_dict.commit()
+                uncommitted = 0
                 if not last_run_had_err:
                     last_run_had_err = True
-                    time.sleep(tw.calc_wait_time(c.FRIENDS_WAIT_PD, last_req_time))
+                    TELEMETRY.retry("friends")
+                    time.sleep(c.ERR_WAIT_PD)
                     print("Resuming.")
+                    continue        # retry this user.
                 else:
                     print(
                       f"2nd error. Aborting.\n"
@@ -145,10 +180,14 @@ def run():
                   f"{traceback.format_exc()}\n"
                   f"{c.SEPERATOR}\n"
                 )
+                friends_dict.commit()
+                uncommitted = 0
                 if not last_run_had_err:
                     last_run_had_err = True
+                    TELEMETRY.retry("friends")
                     time.sleep(c.ERR_WAIT_PD)
                     print("Resuming.")
+                    continue        # retry this user.
                 else:
                     print(
                       f"2nd error. Aborting.\n"
@@ -156,6 +195,17 @@ def run():
                       )
                     break                       
 
-        with SqliteDict(c.FRIENDS_SQL) as friends_dict:
-            print(f"{c.SEPERATOR}\n")
-            log_run_end(len(friends_dict), friends_dict[c.LAST_LINE])
+            # Save progress
+            write_friends(friends_dict, author_id, friends)
+            TELEMETRY.record("friends")
+            done.add(author_id)
+            i += 1
+            TELEMETRY.progress("friends", i)
+            uncommitted += 1
+            if uncommitted >= COMMIT_X_USERS:
+                friends_dict.commit()
+                uncommitted = 0
+
+        friends_dict.commit()
+        print(f"{c.SEPERATOR}\n")
+        log_run_end(runs, len(pending) - i)
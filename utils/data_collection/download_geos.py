@@ -1,12 +1,13 @@
 from sqlitedict import SqliteDict
 import json
-import time
 import datetime
 import traceback
 
-from ..common.user import Place
+from ..common.user import Place, PlaceRef
 from ..common import twitter_helpers as tw
 from ..common import constants as c
+from ..common import storage
+from ..common.telemetry import TELEMETRY
 
 # -----------------------------------------------------------
 # download_geos.py
@@ -14,10 +15,90 @@ from ..common import constants as c
 # which have a geotag, and save each geo-obj to that user along w/ the list
 # of tweets for that user in which it appeared.
 #
+# Each place's geometry is stored once, in the place catalog (PLACES_SQL);
+# users only keep a PlaceRef (place_id + their tweet IDs) to it.
+#
 # -----------------------------------------------------------
 
 TWTS_CSV = c.GEO_TWTS_CSV # modify as needed. In my case, I only downloaded rich data for geotagged users.
 
+catalogued = None   # place_ids already in the catalog, loaded on first use.
+
+
+def catalog_places(geo_objs):
+    """Add any places we haven't seen before to the place catalog."""
+    global catalogued
+    if storage.uses_tables():
+        with storage.Storage() as store:
+            if catalogued is None:
+                catalogued = store.place_ids()
+            new_ids = [pl_id for pl_id in geo_objs if pl_id not in catalogued]
+            store.save_places([geo_objs[pl_id] for pl_id in new_ids])
+            store.commit()
+            catalogued.update(new_ids)
+        return
+
+    with SqliteDict(c.PLACES_SQL) as places_dict:
+        if catalogued is None:
+            catalogued = set(places_dict.keys())
+        new_ids = [pl_id for pl_id in geo_objs if pl_id not in catalogued]
+        for pl_id in new_ids:
+            places_dict[pl_id] = Place(geo_objs[pl_id])
+        if new_ids:
+            places_dict.commit()
+            catalogued.update(new_ids)
+
+
+def save_page(json_resp, geo_objs):
+    """
+    Add a page of tweets to their authors' PlaceRefs. Tweets are grouped by author first,
+    so each user is read and re-written once per page rather than once per tweet.
+    """
+    catalog_places(geo_objs)
+
+    tweets_by_user = dict()     # u_id -> {pl_id -> set of tweet ids}
+    for tweet in json_resp["data"]:
+        # Get tweet data:
+        tweet_id = tweet["id"]
+
+        if not ("geo" in tweet):
+            print(f"geo not in TW:{tweet_id}")
+            continue
+
+        pl_id = tweet["geo"].get("place_id", -1)
+        if pl_id not in catalogued:
+            print(f"Place ID = {pl_id} for {tweet_id}; geo: {tweet['geo']}")
+            continue
+        tweets_by_user.setdefault(tweet["author_id"], dict()).setdefault(pl_id, set()).add(tweet_id)
+
+    if storage.uses_tables():
+        with storage.Storage() as store:
+            rows = []
+            for u_id, user_places in tweets_by_user.items():
+                if not store.has_user(u_id):
+                    print(f"{u_id} not in users table!")
+                    continue
+                rows.extend((u_id, pl_id, tweet_id) for pl_id, tweet_ids in user_places.items() for tweet_id in tweet_ids)
+            store.save_user_place_tweets(rows)
+            store.commit()
+        TELEMETRY.record("geos", len(rows))
+        return
+
+    with SqliteDict(c.USERS_SQL) as users_dict:
+        for u_id, user_places in tweets_by_user.items():
+            user = users_dict.get(u_id)
+            if not user:
+                print(f"{u_id} not in users_dict!")
+                continue
+            for pl_id, tweet_ids in user_places.items():
+                if pl_id not in user.geos:
+                    user.geos[pl_id] = PlaceRef(pl_id)  # A dict avoids repeating Geo's accidentally!
+                user.geos[pl_id].tweets.update(tweet_ids)
+            users_dict[u_id] = user               # Then save!
+        users_dict.commit()
+    TELEMETRY.record("geos", sum(len(tweet_ids) for user_places in tweets_by_user.values() for tweet_ids in user_places.values()))
+
+
 def download_geos(users_ids):
     """
     Given a set of users, call Twitter's API to get their data, and populate their objects in user dict.
@@ -35,7 +116,6 @@ def download_geos(users_ids):
     while True:
 
         try:
-            time.sleep(c.TWTS_WAIT_PD)
             json_resp = tw.connect_to_endpoint(c.TWTS_ENDPOINT, params)
 
             if "errors" in json_resp:
@@ -55,31 +135,7 @@ def download_geos(users_ids):
                 print(json.dumps(json_resp, indent=4, sort_keys=True))
                 return
 
-            with SqliteDict(c.USERS_SQL) as users_dict:
-                for tweet in json_resp["data"]:
-                    # Get tweet data:
-                    tweet_id = tweet["id"]
-                    u_id = tweet["author_id"]
-
-                    if not ("geo" in tweet):
-                        print(f"geo not in TW:{tweet_id}")
-                        continue
-
-                    pl_id = tweet["geo"].get("place_id", -1)
-                    geo_obj = geo_objs.get(pl_id)
-                    user = users_dict.get(u_id)
-
-                    if not user:
-                        print(f"{u_id} not in users_dict!")
-                    elif not geo_obj:
-                        print(f"Place ID = {pl_id} for {tweet_id}; geo: {tweet['geo']}")
-                    else:
-                        if pl_id not in user.geos:
-                            user.geos[pl_id] = Place(geo_obj)  # A dict avoids repeating Geo's accidentally!
-                        user.geos[pl_id].tweets.add(tweet_id)                  
-                        users_dict[u_id] = user               # Then save!
-
-                users_dict.commit()
+            save_page(json_resp, geo_objs)
             
             if "next_token" not in json_resp["meta"]:     # Update next token to finish this download!
                 break
@@ -95,13 +151,16 @@ def run():
 
         # Keep track of how many lines have been reviewed so far. 
         # Advance to that point so we don't duplicate.
-        with SqliteDict(c.USERS_SQL) as users_dict:
-            users_dict[c.DWNLD_GEOS_LINES] = users_dict.get(c.DWNLD_GEOS_LINES, 0)
-            # users_dict[c.DWNLD_GEOS_LINES] = 0 # un-comment this line to reset line count
-            users_dict.commit()
-            tw.advance_to_line(geo_users, users_dict[c.DWNLD_GEOS_LINES])
+        with storage.checkpoints_for(c.USERS_SQL) as checkpoints:
+            checkpoints[c.DWNLD_GEOS_LINES] = checkpoints.get(c.DWNLD_GEOS_LINES, 0)
+            # checkpoints[c.DWNLD_GEOS_LINES] = 0 # un-comment this line (and delete DWNLD_GEOS_OFFSET) to reset line count
+            checkpoints.commit()
+            tw.advance_to_checkpoint(geo_users, checkpoints, c.DWNLD_GEOS_OFFSET, c.DWNLD_GEOS_LINES)
+            start_lines = checkpoints[c.DWNLD_GEOS_LINES]
+            TELEMETRY.track_input("geos", TWTS_CSV, start_lines, geo_users.tell())
 
         processed = 0
+        offset = geo_users.tell()     # byte offset just past the last fully-processed batch.
         reached_end = False
         while not tw.stdin_has_line() and not reached_end:
             try:
@@ -119,6 +178,8 @@ def run():
 
                 download_geos(user_queue)         # do the adding to user_dict.
                 processed += len(user_queue)      # should increment processed AFTER loading.
+                offset = geo_users.tell()
+                TELEMETRY.progress("geos", start_lines + processed, offset)
 
                 if processed % 500 < 100:
                     print(f"Processed {processed} runs")
@@ -133,21 +194,45 @@ def run():
                 break
 
         # Save our total progress, and alert user.
-        with SqliteDict(c.USERS_SQL) as users_dict:
-            users_dict[c.DWNLD_GEOS_LINES] = users_dict[c.DWNLD_GEOS_LINES] + processed
-            users_dict.commit()
-            print(f"Total users processed: {users_dict[c.DWNLD_GEOS_LINES]}")
-
-
-    
-
-
-
-        
-
-
-    
-
-
+        with storage.checkpoints_for(c.USERS_SQL) as checkpoints:
+            checkpoints[c.DWNLD_GEOS_LINES] = checkpoints[c.DWNLD_GEOS_LINES] + processed
+            checkpoints[c.DWNLD_GEOS_OFFSET] = offset
+            checkpoints.commit()
+            print(f"Total users processed: {checkpoints[c.DWNLD_GEOS_LINES]}")
 
 
+def migrate_to_place_catalog():
+    """
+    One-off: move the full Place objects saved on users before the place catalog existed
+    into the catalog, replacing them on each user w/ a PlaceRef. Run VACUUM on
+    users.sqlite afterwards to actually get the space back.
+    """
+    migrated = 0
+    with SqliteDict(c.USERS_SQL) as users_dict, SqliteDict(c.PLACES_SQL) as places_dict:
+        to_migrate = [
+          u_id for u_id, user in users_dict.items()
+          if hasattr(user, "geos") and any(not isinstance(pl, PlaceRef) for pl in user.geos.values())
+        ]
+        print(f"{len(to_migrate)} users to migrate.")
+        for u_id in to_migrate:
+            user = users_dict[u_id]
+            for pl_id, pl in user.geos.items():
+                if isinstance(pl, PlaceRef):
+                    continue
+                if pl_id not in places_dict:
+                    tweets, pl.tweets = pl.tweets, set()
+                    places_dict[pl_id] = pl
+                else:
+                    tweets = pl.tweets
+                ref = PlaceRef(pl_id)
+                ref.tweets = tweets
+                user.geos[pl_id] = ref
+            users_dict[u_id] = user
+            migrated += 1
+            if migrated % 10000 == 0:
+                users_dict.commit()
+                places_dict.commit()
+                print(f"Migrated {migrated} users, {datetime.datetime.now()}")
+        users_dict.commit()
+        places_dict.commit()
+    print(f"Migrated {migrated} users.")
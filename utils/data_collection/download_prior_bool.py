@@ -5,6 +5,8 @@ import time
 from ..common.user import User
 from ..common import twitter_helpers as tw
 from ..common import constants as c
+from ..common import storage
+from ..common.telemetry import TELEMETRY
 
 # download_prior_bool.py
 # *--------------*
@@ -17,11 +19,12 @@ query_params = {
   'max_results': 10,
   }
 QUERY_BASE = "#blacklivesmatter -is:nullcast"
+BATCHED_MAX_RESULTS = 500     # most results full-archive search returns per page.
 
 def get_user_tw_count(u_id):
   '''
-  Search for a user's tweets in the period in question 
-  (after waiting a sleep-period to avoid) rate-limiting.
+  Search for a user's tweets in the period in question
+  (connect_to_endpoint paces the call to avoid rate-limiting).
   Return the number of results*.
 
   *Note: will just return number for that *page* of results,
@@ -29,7 +32,6 @@ def get_user_tw_count(u_id):
   not how many.
   '''
 
-  time.sleep(c.TWTS_WAIT_PD)
   query_params["query"] = f"{QUERY_BASE} from:{u_id}"
   try:
       json_resp = tw.connect_to_endpoint(c.TWTS_ENDPOINT, query_params)
@@ -41,20 +43,99 @@ def get_user_tw_count(u_id):
   return num_prior_tweets
 
 
-def run():
+def get_users_prior(u_ids):
+  '''
+  Batched version of get_user_tw_count: pack several users into one
+  `from:a OR from:b` search (as download_geos does), and read author_id
+  off the results to see which of them had prior tweets.
+
+  Every page of results names at least one user, so rather than paging through
+  a prolific user's tweets, we re-query with just the users not yet found.
+  Once a query comes back without a next_token, the rest had no prior tweets.
+
+  Returns the set of users with prior tweets.
+  '''
+
+  found = set()
+  unresolved = set(u_ids)
+  while unresolved:
+      params = dict(
+        query_params,
+        query=f"{QUERY_BASE} (from:{' OR from:'.join(sorted(unresolved))})",
+        max_results=BATCHED_MAX_RESULTS,
+      )
+      params["tweet.fields"] = "author_id"
+      try:
+          json_resp = tw.connect_to_endpoint(c.TWTS_ENDPOINT, params)
+      except:
+          TELEMETRY.retry("prior-adopters")
+          time.sleep(c.ERR_WAIT_PD)
+          json_resp = tw.connect_to_endpoint(c.TWTS_ENDPOINT, params)
+
+      authors = {tweet["author_id"] for tweet in json_resp.get("data", [])} & unresolved
+      found |= authors
+      unresolved -= authors
+      if not authors or "next_token" not in json_resp["meta"]:
+          break
+
+  print(f"{len(found)} / {len(u_ids)} users have prior tweets.")
+  return found
+
+
+def open_users():
+    """The users store for the configured STORAGE_BACKEND: the users SqliteDict, or the typed tables."""
+    return storage.Storage() if storage.uses_tables() else SqliteDict(c.USERS_SQL)
+
+
+def unchecked_ids(users_store):
+    """Geotagged users who haven't been checked yet."""
+    if storage.uses_tables():
+        return users_store.unchecked_prior_ids()
+    return [
+      u_id for u_id, user in users_store.items()
+      if (not hasattr(user, "used_prior")) and (hasattr(user, "geos")) and (len(user.geos) > 0)
+    ]
+
+
+def write_prior(users_store, u_ids, found):
+    """Record (without committing) which of u_ids had prior tweets."""
+    if storage.uses_tables():
+        users_store.save_prior(u_ids, found)
+        return
+    for u_id in u_ids:
+        user = users_store[u_id]
+        user.used_prior = (u_id in found)
+        users_store[u_id] = user
+
+
+def run(batched=True):
+    '''
+    Check every geotagged user who hasn't been checked yet.
+    By default packs GEOS_MAX_USERS_PER_QUERY users per query; batched=False goes one user at a time.
+    Commits after every query, so an interrupted run can pick up where it left off.
+    '''
+
+    with open_users() as users_store:
+        to_check = unchecked_ids(users_store)
+        print(f"{len(to_check)} users to check.")
+
+        batch_size = c.GEOS_MAX_USERS_PER_QUERY if batched else 1
+        for i in range(0, len(to_check), batch_size):
+            if tw.stdin_has_line():
+                print("Interrupted.")
+                break
 
-    with SqliteDict(c.USERS_SQL) as users_dict:
-        for u_id, user in users_dict.items():
-            # if not already downloaded, and a geotagged user, then do the download
-            if (not hasattr(user, "used_prior")) and (hasattr(user, "geos")) and (len(user.geos) > 0):    
-                if get_user_tw_count(u_id) > 0:
-                    user.used_prior = True
-                else:
-                    user.used_prior = False
-                users_dict[u_id] = user
+            batch = to_check[i:i+batch_size]
+            if batched:
+                found = get_users_prior(batch)
+            else:
+                found = set(batch) if get_user_tw_count(batch[0]) > 0 else set()
 
-        print("Finished loading users' prior-adopter records. Now updating the SQL.")
-        users_dict.commit()
+            write_prior(users_store, batch, found)
+            users_store.commit()
+            TELEMETRY.record("prior-adopters", len(batch))
 
+            if (i // batch_size) % 100 == 0:
+                print(f"Checked {i + len(batch)} / {len(to_check)} users.")
 
-    
+        print("Finished updating users' prior-adopter records.")
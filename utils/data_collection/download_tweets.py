@@ -7,6 +7,7 @@ import traceback
 
 from ..common import twitter_helpers as tw
 from ..common import constants as c
+from ..common.telemetry import TELEMETRY
 
 
 # -----------------------------------------------------------
@@ -22,6 +23,9 @@ from ..common import constants as c
 PAGES_MAX = 100000          # Defines how many 'pages' of tweets are downloaded per run. Good for testing. 
 UPDATE_EVERY_X_PAGES = 20   # Don't print an update to the console every page -- just after x pages.
 
+OUTPUT_FORMAT = c.TWTS_FMT  # c.CSV_FMT appends to TWTS_CSV; c.PARQUET_FMT writes typed, hour-partitioned files to TWTS_PARQUET_DIR.
+FLUSH_EVERY_X_PAGES = 50    # (Parquet only) pages buffered in memory between writes. Progress is only saved on a flush.
+
 query_params = {
   'query': '#blacklivesmatter -is:nullcast',
   'tweet.fields': 'author_id,created_at,geo',
@@ -59,6 +63,77 @@ def save_tweets(json_resp):
             ])
 
 
+class ParquetTweetSink:
+    """
+    Buffers pages of tweets in memory, and on flush() writes them out as typed Parquet --
+    one file (a single row group) per hour of `created_at` per flush, under
+    TWTS_PARQUET_DIR/hour=YYYY-MM-DDTHH/. IDs are int64, created_at a UTC timestamp,
+    and the geo dict is flattened to its place_id (+ point coordinates, when tagged).
+
+    Files are named for the newest tweet in them, so re-writing a page after a crash
+    overwrites rather than duplicates it.
+    """
+
+    def __init__(self):
+        # Imported here so the CSV path doesn't need pyarrow installed.
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.pq = pq
+        self.schema = pa.schema([
+          (c.TW_ID, pa.int64()),
+          (c.U_ID, pa.int64()),
+          (c.CREATED_AT, pa.timestamp("ms", tz="UTC")),
+          (c.PL_ID, pa.string()),
+          (c.GEO_LON, pa.float64()),
+          (c.GEO_LAT, pa.float64()),
+        ])
+        self.rows = dict()      # hour -> list of row tuples
+        self.meta_rows = []
+        os.makedirs(c.TWTS_PARQUET_DIR, exist_ok=True)
+
+    def add(self, json_resp):
+        self.meta_rows.append([
+          json_resp["meta"]["newest_id"], 
+          json_resp["meta"]["oldest_id"], 
+          json_resp["meta"].get("next_token")
+        ])
+        for tweet in json_resp.get("data", []):
+            geo = tweet.get("geo") or {}
+            point = geo.get("coordinates", {}).get("coordinates", [None, None])
+            hour = tweet["created_at"][:13]     # ISO 8601 -> "YYYY-MM-DDTHH"
+            self.rows.setdefault(hour, []).append((
+              int(tweet["id"]),
+              int(tweet["author_id"]),
+              tweet["created_at"],
+              geo.get("place_id"),
+              point[0],
+              point[1],
+            ))
+
+    def flush(self):
+        pa = self.pa
+        for hour, rows in self.rows.items():
+            cols = list(zip(*rows))
+            table = pa.table([
+              pa.array(cols[0], pa.int64()),
+              pa.array(cols[1], pa.int64()),
+              pa.array(cols[2], pa.string()).cast(self.schema.field(c.CREATED_AT).type),
+              pa.array(cols[3], pa.string()),
+              pa.array(cols[4], pa.float64()),
+              pa.array(cols[5], pa.float64()),
+            ], schema=self.schema)
+            hour_dir = f"{c.TWTS_PARQUET_DIR}/hour={hour}"
+            os.makedirs(hour_dir, exist_ok=True)
+            self.pq.write_table(table, f"{hour_dir}/part-{max(cols[0])}.parquet")
+        self.rows = dict()
+
+        with open(c.META_TWTS_CSV, mode='a', newline='') as meta_csv:
+            writer = csv.writer(meta_csv, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerows(self.meta_rows)
+        self.meta_rows = []
+
+
 def save_progress(count, pages_done):
     """Write the last query's token and count to save-file."""
     with open(c.SAVED_NXT_TOKEN_TWTS_FILE, "w") as saved_data:
@@ -114,9 +189,10 @@ def run():
     As long as there are more tweets to get and no std input, 
     fetch more pages of results.
 
-    Calls time.sleep between calls to avoid rate limiting.
+    connect_to_endpoint paces calls to avoid rate limiting.
     """
     os.makedirs(c.TWEET_DIR, exist_ok=True)
+    sink = ParquetTweetSink() if OUTPUT_FORMAT == c.PARQUET_FMT else None
     pages_done = 0
     count = load_saved_data()
     log_run_start()
@@ -126,10 +202,14 @@ def run():
     while pages_done < PAGES_MAX and not tw.stdin_has_line():
         try:
             json_resp = tw.connect_to_endpoint(c.TWTS_ENDPOINT, query_params)
-            save_meta(json_resp)
-            save_tweets(json_resp)
+            if sink:
+                sink.add(json_resp)
+            else:
+                save_meta(json_resp)
+                save_tweets(json_resp)
             count += json_resp["meta"]["result_count"]
             pages_done += 1
+            TELEMETRY.record("tweets", json_resp["meta"]["result_count"])
             
             if (pages_done % UPDATE_EVERY_X_PAGES == 1):
               print(f"Done downloading page {pages_done}, {count} total tweets saved.")
@@ -139,8 +219,11 @@ def run():
                 break
             else:
                 query_params["next_token"] = json_resp["meta"]["next_token"]
-                save_progress(count, pages_done)
-                time.sleep(c.TWTS_WAIT_PD)       
+                if not sink:
+                    save_progress(count, pages_done)
+                elif pages_done % FLUSH_EVERY_X_PAGES == 0:
+                    sink.flush()                        # only save the token once its pages are on disk.
+                    save_progress(count, pages_done)
             
             lastRunHadAPIError = False
 
@@ -154,6 +237,7 @@ def run():
               break     # stop downloading!
             else:
               lastRunHadAPIError = True
+              TELEMETRY.retry("tweets")
               print(f"Waiting {c.ERR_WAIT_PD} seconds before re-attempt.")
               time.sleep(c.ERR_WAIT_PD)
               print("Continuing.")
@@ -168,6 +252,8 @@ def run():
             )
             break
 
+    if sink:
+        sink.flush()
     save_progress(count, pages_done)
     log_run_end(count, pages_done)
 
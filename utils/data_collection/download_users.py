@@ -1,10 +1,13 @@
 from sqlitedict import SqliteDict
 import datetime
 import traceback
-import time
+import threading
+import queue
 
 from ..common import twitter_helpers as tw
 from ..common import constants as c
+from ..common import storage
+from ..common.telemetry import TELEMETRY
 from ..common.user import User
 
 # -----------------------------------------------------------
@@ -27,6 +30,11 @@ USERS_DICT = c.USERS_SQL
 # per how many API calls should we log our progress?
 PRINT_X_RUNS = 100 
 
+# The background writer commits every X batches (and holds at most MAX_QUEUED_BATCHES
+# waiting to be written, so the download can't run away from it).
+COMMIT_X_BATCHES = 10
+MAX_QUEUED_BATCHES = 50
+
 # Properties to download from Twitter's Users lookup.
 PUBLIC_METRICS = "public_metrics"
 FOLLOWERS_COUNT = "followers_count"
@@ -37,6 +45,15 @@ CREATED_AT = "created_at"
 USER_FIELDS = f"{PUBLIC_METRICS},{PRIVATE},{CREATED_AT}"
 
 
+def check_tweets_format():
+    """Authors are read out of TWTS_CSV line by line (w/ byte-offset checkpoints); there's no Parquet equivalent."""
+    if c.TWTS_FMT != c.CSV_FMT:
+        raise ValueError(
+          f"TWTS_FMT is {c.TWTS_FMT}, but downloading users needs the tweets CSV ({TWTS_CSV}). "
+          f"Collect tweets w/ TWIT_TWEETS_FMT={c.CSV_FMT} first."
+        )
+
+
 def log_run_end(lines):
     """Announce state of progress at end of run."""
     print(
@@ -66,68 +83,149 @@ def download_users(users_ids):
     return(user_objs)
 
 
+def open_users():
+    """The users store for the configured STORAGE_BACKEND: the users SqliteDict, or the typed tables."""
+    return storage.Storage() if storage.uses_tables() else SqliteDict(USERS_DICT)
+
+
+def write_users(users_store, user_objs, lines_read, offset):
+    """
+    Write (without committing) user objects, and move the saved line pointer
+    forward by the number of tweet lines they were read from
+    (`offset` being the byte offset in the tweets CSV just past those lines).
+    """
+    if storage.uses_tables():
+        users_store.save_users(user_objs)
+        checkpoints = users_store.checkpoints
+    else:
+        for user_obj in user_objs:
+          users_store[user_obj.user_id] = user_obj
+        checkpoints = users_store
+    checkpoints[c.LAST_LINE] = checkpoints.get(c.LAST_LINE, 0) + lines_read
+    checkpoints[c.LAST_OFFSET] = offset
+    TELEMETRY.record("users", len(user_objs))
+    TELEMETRY.progress("users", checkpoints[c.LAST_LINE], offset)
+
+
+def save_users(user_objs, lines_read, offset):
+    """Write + commit a batch of users along w/ the checkpoint past them."""
+    with open_users() as users_store:
+        write_users(users_store, user_objs, lines_read, offset)
+        users_store.commit()
+
+
+class UsersWriter(threading.Thread):
+    """
+    Saves downloaded users to the users dict from a background thread, so pickling
+    and committing happen while the main thread is waiting on the next API call.
+
+    Each batch's line count + offset are written alongside its users, and only
+    committed together, so the saved checkpoint never runs ahead of the saved users.
+    """
+
+    STOP = None
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue(maxsize=MAX_QUEUED_BATCHES)
+        self.error = None
+
+    def put(self, user_objs, lines_read, offset):
+        # (keep checking on the writer while the queue's full, so we don't wait forever on a dead thread)
+        while True:
+            if self.error:
+                raise self.error
+            if not self.is_alive():
+                raise RuntimeError("Users writer thread is no longer running.")
+            try:
+                self.queue.put((user_objs, lines_read, offset), timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self):
+        try:
+            with open_users() as users_store:
+                uncommitted = 0
+                while True:
+                    batch = self.queue.get()
+                    if batch is self.STOP:
+                        break
+                    write_users(users_store, *batch)
+                    uncommitted += 1
+                    if uncommitted >= COMMIT_X_BATCHES:
+                        users_store.commit()
+                        uncommitted = 0
+                users_store.commit()
+        except Exception as e:
+            print(
+              f"{c.SEPERATOR}\n"
+              f"Writer failed: {e}\n"
+              f"{traceback.format_exc()}\n"
+              f"at time {datetime.datetime.now()}"
+              f"{c.SEPERATOR}\n"
+            )
+            self.error = e
+
+    def close(self):
+        """Write + commit whatever is still queued, and wait for the thread to finish."""
+        if self.is_alive():
+            self.queue.put(self.STOP)
+        self.join()
+
+
 def run():
-  """
-  The driver code for doing the user download, 
-  to be called by a script in the root-level of directory (or Makefile)
-  """
-    last_req_time = time.time()
+    """
+    The driver code for doing the user download, 
+    to be called by a script in the root-level of directory (or Makefile)
+    """
+    check_tweets_format()
     with open(TWTS_CSV) as tweets:
 
-        with SqliteDict(USERS_DICT) as users_dict:
-            users_dict[c.LAST_LINE] = users_dict.get(c.LAST_LINE, 0) # manually set to 0 if adding a new CSV to a dictionary of users.
-            users_dict.commit()
-            tw.advance_to_line(tweets, users_dict[c.LAST_LINE])
-            print(f"Beginning download at line {users_dict[c.LAST_LINE]}.")
+        with storage.checkpoints_for(USERS_DICT) as checkpoints:
+            checkpoints[c.LAST_LINE] = checkpoints.get(c.LAST_LINE, 0) # manually set to 0 (and delete LAST_OFFSET) if adding a new CSV to a dictionary of users.
+            checkpoints.commit()
+            tw.advance_to_checkpoint(tweets, checkpoints, c.LAST_OFFSET, c.LAST_LINE)
+            print(f"Beginning download at line {checkpoints[c.LAST_LINE]}.")
+            TELEMETRY.track_input("users", TWTS_CSV, checkpoints[c.LAST_LINE], tweets.tell())
+
+        writer = UsersWriter()
+        writer.start()
 
         users_to_download = set()
-        last_run_had_err = False
         temp_lines = 0
         runs = 0
+        reached_end = False
         
-        while not tw.stdin_has_line():        # while the user hasn't interrupted
+        while not reached_end and not tw.stdin_has_line():        # while the user hasn't interrupted
             
             # read another line, until EOF
             tw_row = tweets.readline()        
             if not tw_row or len(tw_row) <= 1:
                 print("END OF FILE! Done.")
-                break
-
-            # if valid line, increment line pointer, and get author_id
-            temp_lines += 1
-            tweet = tw_row.split(',', 4)
-            author_id = tweet[1]
+                reached_end = True        # still download the last, partial batch.
+            else:
+                # if valid line, increment line pointer, and get author_id
+                temp_lines += 1
+                tweet = tw_row.split(',', 4)
+                users_to_download.add(tweet[1])
 
             try:
-                users_to_download.add(author_id)
-
                 # Each request takes 100 user_ids. When reached, run request.
-                if len(users_to_download) == 100:
-                    with SqliteDict(USERS_DICT) as users_dict:
-                      
-                        # Get user objects, and save to SQLiteDict.
-                        user_objs = download_users(users_to_download)
-                        for user_obj in user_objs:
-                          users_dict[user_obj.user_id] = user_obj
-
-                        # Save lines progress
-                        users_dict[c.LAST_LINE] = users_dict[c.LAST_LINE] + temp_lines
-                        temp_lines = 0
-
-                        # Save all new info to dictionary.
-                        users_dict.commit()
-                        
-                        # Print to log.
-                        if runs % PRINT_X_RUNS == 0:
-                            print(f"{runs} runs complete this round.")
-                        runs += 1
-                        
-                        # Reset for next round
-                        users_to_download = set()   
-
-                        # If the wait has been less than 1, wait!
-                        time.sleep(tw.calc_wait_time(c.USERS_WAIT_PD, last_req_time))
-                        last_req_time = time.time()
+                if len(users_to_download) == 100 or (reached_end and users_to_download):
+                  
+                    # Get user objects, and hand them off to be saved (along with lines progress).
+                    user_objs = download_users(users_to_download)
+                    writer.put(user_objs, temp_lines, tweets.tell())
+                    temp_lines = 0
+                    
+                    # Print to log.
+                    if runs % PRINT_X_RUNS == 0:
+                        print(f"{runs} runs complete this round.")
+                    runs += 1
+                    
+                    # Reset for next round
+                    users_to_download = set()   
 
             except Exception as e:
                 print(
@@ -139,5 +237,6 @@ def run():
                 )
                 break
 
-        with SqliteDict(USERS_DICT) as users_dict:
-            log_run_end(users_dict[c.LAST_LINE])
+        writer.close()
+        with storage.checkpoints_for(USERS_DICT) as checkpoints:
+            log_run_end(checkpoints[c.LAST_LINE])